@@ -0,0 +1,207 @@
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import discord
+
+# Every packet is stored behind its length, so playback needs no Ogg demuxing
+PACKET_HEADER = struct.Struct('<H')
+FILE_SUFFIX = ".opuspk"
+# Tracks longer than this are not recorded, long mixes would push everything else out
+MAX_CACHED_SECONDS = 15 * 60
+
+
+class CachedOpusSource(discord.AudioSource):
+    """Plays Opus packets from a cache file through a memory map, no FFmpeg involved"""
+
+    def __init__(self, path, start_at=None):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            self.file.close()
+            raise
+        self.offset = 0
+        if start_at:
+            self._skip(int(start_at * 1000 / discord.opus.Encoder.FRAME_LENGTH))
+
+    def _skip(self, packets):
+        for _ in range(packets):
+            if self.offset + PACKET_HEADER.size > len(self.map):
+                return
+            (length,) = PACKET_HEADER.unpack_from(self.map, self.offset)
+            self.offset += PACKET_HEADER.size + length
+
+    def read(self):
+        if self.map is None or self.offset + PACKET_HEADER.size > len(self.map):
+            return b''
+        (length,) = PACKET_HEADER.unpack_from(self.map, self.offset)
+        start = self.offset + PACKET_HEADER.size
+        self.offset = start + length
+        return self.map[start:self.offset]
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.file.close()
+
+
+class OpusRecorder:
+    """Collects the packets of a track while it plays, kept only if it played to the end"""
+
+    def __init__(self, cache, key, path):
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self.file = open(path, 'wb')
+        self.size = 0
+
+    def write(self, packet):
+        if self.file is None:
+            return
+        self.file.write(PACKET_HEADER.pack(len(packet)))
+        self.file.write(packet)
+        self.size += PACKET_HEADER.size + len(packet)
+
+    def finish(self, complete):
+        """Store the recording if the whole track was captured, otherwise throw it away"""
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if complete and self.size:
+            self.cache.admit(self.key, self.path, self.size)
+        else:
+            self.cache.abandon(self.key, self.path)
+
+
+class AudioFileCache:
+    """
+    On-disk cache of transcoded Opus tracks, bounded by total size with least recently
+    played files evicted first. Recordings are committed from the voice player thread,
+    so the index is guarded by a lock.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> size in bytes, least recently played first
+        self.size = 0
+        self.recording = set()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + FILE_SUFFIX)
+
+    def _load(self):
+        """Index what an earlier run left behind, oldest first, and drop unfinished recordings"""
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                self.discard(path)
+            elif name.endswith(FILE_SUFFIX):
+                stat = os.stat(path)
+                found.append((stat.st_mtime, name[:-len(FILE_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.discard(self._path(key))
+
+    def lookup(self, key):
+        """Return the file holding key and mark it recently played, or None"""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            # The modification time orders the files when the index is rebuilt after a restart
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.size -= self.entries.pop(key, 0)
+            return None
+        return path
+
+    def open(self, key, start_at=None):
+        """Return a CachedOpusSource for key, or None on a miss"""
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            return CachedOpusSource(path, start_at)
+        except (OSError, ValueError) as e:
+            print(f"Could not open cached audio {path}: {e}")
+            return None
+
+    def recorder(self, key):
+        """Start recording key, or None if it is already cached or being recorded"""
+        with self.lock:
+            if key in self.entries or key in self.recording:
+                return None
+            self.recording.add(key)
+        try:
+            return OpusRecorder(self, key, f"{self._path(key)}.tmp")
+        except OSError as e:
+            print(f"Could not record {key} to the audio cache: {e}")
+            with self.lock:
+                self.recording.discard(key)
+            return None
+
+    def admit(self, key, temporary_path, size):
+        with self.lock:
+            self.recording.discard(key)
+            if size > self.max_bytes:
+                self.discard(temporary_path)
+                return
+            try:
+                os.replace(temporary_path, self._path(key))
+            except OSError as e:
+                print(f"Could not store {key} in the audio cache: {e}")
+                self.discard(temporary_path)
+                return
+            self.entries[key] = size
+            self.size += size
+            self._evict()
+
+    def abandon(self, key, temporary_path):
+        """Drop an unfinished recording"""
+        with self.lock:
+            self.recording.discard(key)
+        self.discard(temporary_path)
+
+    @staticmethod
+    def discard(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def snapshot(self):
+        """Files cached, bytes used and tracks being recorded"""
+        with self.lock:
+            return {
+                'files': len(self.entries),
+                'bytes': self.size,
+                'recording': len(self.recording)
+            }
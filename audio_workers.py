@@ -0,0 +1,269 @@
+import itertools
+import multiprocessing
+import queue
+import shlex
+import subprocess
+import threading
+
+import discord
+from discord.oggparse import OggStream
+
+# Frames (20ms each) a worker may send ahead of playback before it has to wait for credit
+LEAD_FRAMES = 150
+# Credit is returned to the worker in batches to keep pipe traffic low
+CREDIT_BATCH = 50
+# How long playback waits for the next frame before treating the stream as finished
+READ_TIMEOUT = 10
+
+
+def build_ffmpeg_args(stream_url, before_options, options, codec, bitrate, executable='ffmpeg'):
+    """Build an FFmpeg command that writes Ogg Opus to stdout, matching discord.FFmpegOpusAudio"""
+    args = [executable]
+    args.extend(shlex.split(before_options or ''))
+    args.extend(('-i', stream_url))
+    args.extend(('-map_metadata', '-1',
+                 '-f', 'opus',
+                 '-c:a', codec,
+                 '-ar', '48000',
+                 '-ac', '2',
+                 '-b:a', f'{bitrate}k',
+                 '-loglevel', 'warning'))
+    args.extend(shlex.split(options or ''))
+    args.append('pipe:1')
+    return args
+
+
+class _StreamJob(threading.Thread):
+    """Runs inside a worker process: reads Opus packets from FFmpeg and sends them to the bot"""
+
+    def __init__(self, stream_id, args, send):
+        super().__init__(daemon=True)
+        self.stream_id = stream_id
+        self.args = args
+        self.send = send
+        self.credits = LEAD_FRAMES
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.process = None
+
+    def add_credit(self, frames):
+        with self.condition:
+            self.credits += frames
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+
+    def run(self):
+        error = None
+        try:
+            self.process = subprocess.Popen(
+                self.args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+            for packet in OggStream(self.process.stdout).iter_packets():
+                # Skip the Ogg Opus header packets, Discord only wants audio
+                if packet.startswith((b'OpusHead', b'OpusTags')):
+                    continue
+                with self.condition:
+                    # Wait for the bot to play what it already has before sending more
+                    while self.credits <= 0 and not self.stopped:
+                        self.condition.wait()
+                    if self.stopped:
+                        break
+                    self.credits -= 1
+                self.send(('frame', self.stream_id, packet))
+        except Exception as e:
+            error = str(e)
+        finally:
+            if self.process and self.process.poll() is None:
+                self.process.kill()
+            if self.process:
+                self.process.wait()
+            try:
+                self.send(('end', self.stream_id, error))
+            except Exception:
+                pass
+
+
+def _worker_main(conn, index):
+    """Entry point of a worker process, runs one thread per stream assigned to it"""
+    send_lock = threading.Lock()
+    jobs = {}
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        kind, stream_id = message[0], message[1]
+        if kind == 'start':
+            job = _StreamJob(stream_id, message[2], send)
+            jobs[stream_id] = job
+            job.start()
+        elif kind == 'credit':
+            job = jobs.get(stream_id)
+            if job:
+                job.add_credit(message[2])
+        elif kind == 'stop':
+            job = jobs.pop(stream_id, None)
+            if job:
+                job.stop()
+        elif kind == 'shutdown':
+            break
+
+    for job in jobs.values():
+        job.stop()
+
+
+class WorkerOpusSource(discord.AudioSource):
+    """Audio source fed with ready Opus frames by an audio worker process"""
+
+    def __init__(self, worker, stream_id):
+        self.worker = worker
+        self.stream_id = stream_id
+        self.frames = queue.Queue()
+        self.consumed = 0
+        self.ended = False
+
+    def read(self):
+        if self.ended:
+            return b''
+        try:
+            frame = self.frames.get(timeout=READ_TIMEOUT)
+        except queue.Empty:
+            print(f"Audio worker stream {self.stream_id} stalled, ending it")
+            frame = None
+        if frame is None:
+            self.ended = True
+            return b''
+
+        self.consumed += 1
+        if self.consumed % CREDIT_BATCH == 0:
+            self.worker.send(('credit', self.stream_id, CREDIT_BATCH))
+        return frame
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.worker.stop_stream(self.stream_id)
+
+
+class _AudioWorker:
+    """Bot-side handle for one worker process and the streams assigned to it"""
+
+    def __init__(self, context, index):
+        self.index = index
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, index), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.streams = {}
+        self.send_lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def send(self, message):
+        try:
+            with self.send_lock:
+                self.conn.send(message)
+        except (OSError, ValueError) as e:
+            print(f"Audio worker {self.index} unreachable: {e}")
+
+    def start_stream(self, stream_id, args):
+        source = WorkerOpusSource(self, stream_id)
+        self.streams[stream_id] = source
+        self.send(('start', stream_id, args))
+        return source
+
+    def stop_stream(self, stream_id):
+        if self.streams.pop(stream_id, None) is not None:
+            self.send(('stop', stream_id))
+
+    def _read_loop(self):
+        while True:
+            try:
+                kind, stream_id, payload = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            source = self.streams.get(stream_id)
+            if source is None:
+                continue
+            if kind == 'frame':
+                source.frames.put(payload)
+            elif kind == 'end':
+                if payload:
+                    print(f"Audio worker {self.index} stream {stream_id} failed: {payload}")
+                source.frames.put(None)
+
+        # The worker died, end everything it was playing
+        for source in list(self.streams.values()):
+            source.frames.put(None)
+
+    def shutdown(self):
+        # Sources still open end now and have nothing left to stop in the worker
+        for source in self.streams.values():
+            source.frames.put(None)
+        self.streams.clear()
+        self.send(('shutdown', 0))
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class AudioWorkerPool:
+    """
+    Pool of processes that run FFmpeg and read Opus frames for voice playback,
+    keeping that work off the bot's GIL. Each guild always uses the same worker.
+    """
+
+    def __init__(self, size, executable='ffmpeg'):
+        self.size = size
+        self.executable = executable
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [None] * size
+        self.stream_ids = itertools.count(1)
+
+        # Start every worker up front, spawning a process takes a moment
+        for index in range(size):
+            self.worker_for(index)
+
+    def worker_for(self, guild_id):
+        """Return the worker assigned to a guild, restarting it if it died"""
+        index = guild_id % self.size
+        worker = self.workers[index]
+        if worker is None or not worker.is_alive():
+            if worker is not None:
+                print(f"Audio worker {index} died, restarting it")
+            worker = _AudioWorker(self.context, index)
+            self.workers[index] = worker
+        return worker
+
+    def create_source(self, guild_id, stream_url, before_options, options, codec='libopus', bitrate=96):
+        """Start streaming a URL on the guild's worker and return the matching audio source"""
+        args = build_ffmpeg_args(stream_url, before_options, options, codec, bitrate, self.executable)
+        return self.worker_for(guild_id).start_stream(next(self.stream_ids), args)
+
+    def stream_counts(self):
+        """Number of active streams on each worker"""
+        return [len(worker.streams) if worker else 0 for worker in self.workers]
+
+    def shutdown(self):
+        """Stop every worker process, main.py calls this once the client has closed"""
+        for worker in self.workers:
+            if worker is not None:
+                worker.shutdown()
+        self.workers = [None] * self.size
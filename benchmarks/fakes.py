@@ -0,0 +1,358 @@
+"""
+In-process stand-ins for Discord voice/gateway objects and local stubs for
+YoutubeSearch, yt_dlp and spotipy, so MusicPlayer can be driven offline.
+"""
+import asyncio
+import hashlib
+import json
+import time
+
+import discord
+
+
+class Latency:
+    """Simulated network latency, in seconds, for each stubbed service"""
+
+    def __init__(self, search=0.05, extract=0.1, spotify=0.05):
+        self.search = search
+        self.extract = extract
+        self.spotify = spotify
+
+
+LATENCY = Latency()
+
+
+def fake_video_id(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:11]
+
+
+class StubYoutubeSearch:
+    """Replaces youtube_search.YoutubeSearch, blocks like the real HTTP request does"""
+
+    calls = 0
+
+    def __init__(self, search_terms, max_results=1, retries=3, timeout=10):
+        StubYoutubeSearch.calls += 1
+        self.search_terms = search_terms
+        time.sleep(LATENCY.search)
+
+    def to_json(self, clear_cache=True):
+        return json.dumps({'videos': [{
+            'id': fake_video_id(self.search_terms),
+            'title': self.search_terms,
+            'duration': '3:00'
+        }]})
+
+
+class StubYoutubeDL:
+    """Replaces yt_dlp.YoutubeDL, returns a signed-looking stream URL after a delay"""
+
+    calls = 0
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def extract_info(self, url, download=False):
+        StubYoutubeDL.calls += 1
+        time.sleep(LATENCY.extract)
+        video_id = url.rsplit('v=', 1)[-1]
+        expire = int(time.time()) + 6 * 3600
+        return {
+            'id': video_id,
+            'url': f"https://stub.googlevideo.com/videoplayback?id={video_id}&expire={expire}",
+            'title': f"Video {video_id}",
+            'duration': 180,
+            'acodec': 'opus'
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class StubSpotify:
+    """Replaces spotipy.Spotify, serves generated playlists in pages of 100"""
+
+    playlist_size = 300
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _page(self, kind, item_id, offset):
+        time.sleep(LATENCY.spotify)
+        end = min(offset + 100, self.playlist_size)
+        items = []
+        for index in range(offset, end):
+            track = {'name': f"{item_id} track {index}", 'duration_ms': 180000, 'artists': [{'name': 'Stub Artist'}]}
+            items.append({'track': track} if kind == 'playlist' else track)
+        next_page = (kind, item_id, end) if end < self.playlist_size else None
+        return {'items': items, 'next': next_page, 'total': self.playlist_size}
+
+    def playlist_items(self, playlist_id, fields=None, additional_types=None):
+        return self._page('playlist', playlist_id, 0)
+
+    def album_tracks(self, album_id):
+        return self._page('album', album_id, 0)
+
+    def track(self, track_id):
+        time.sleep(LATENCY.spotify)
+        return {'name': f"track {track_id}", 'duration_ms': 180000, 'artists': [{'name': 'Stub Artist'}]}
+
+    def next(self, page):
+        return self._page(*page['next'])
+
+
+class StubCredentials:
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class FakeAudioSource(discord.AudioSource):
+    """Replaces the FFmpeg sources, no subprocess is started"""
+
+    opened = 0
+    closed = 0
+
+    def __init__(self, source, **kwargs):
+        FakeAudioSource.opened += 1
+        self.source = source
+        self.cleaned_up = False
+
+    def read(self):
+        return b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if not self.cleaned_up:
+            self.cleaned_up = True
+            FakeAudioSource.closed += 1
+
+
+class Recorder:
+    """Collects timings reported by the fake voice clients"""
+
+    def __init__(self):
+        self.first_audio = {}  # guild_id -> time the first song started
+        self.gaps = []  # seconds between one song ending and the next starting
+        self.tracks_played = 0
+
+
+class FakeVoiceClient:
+    """Plays a source for a fixed simulated duration, then fires the after callback like discord.py"""
+
+    def __init__(self, channel, recorder, track_seconds):
+        self.channel = channel
+        self.guild = channel.guild
+        self.recorder = recorder
+        self.track_seconds = track_seconds
+        self.source = None
+        self.after = None
+        self.handle = None
+        self.paused = False
+        self.connected = True
+        self.ended_at = None
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def play(self, source, *, after=None):
+        now = time.perf_counter()
+        self.recorder.first_audio.setdefault(self.guild.id, now)
+        if self.ended_at is not None:
+            self.recorder.gaps.append(now - self.ended_at)
+            self.ended_at = None
+        self.recorder.tracks_played += 1
+
+        self.source = source
+        self.after = after
+        self.handle = asyncio.get_event_loop().call_later(self.track_seconds, self._finish, None)
+
+    def _finish(self, error):
+        source, after = self.source, self.after
+        self.source = self.after = self.handle = None
+        self.ended_at = time.perf_counter()
+        if after is not None:
+            after(error)
+        if source is not None:
+            source.cleanup()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self._finish(None)
+
+    async def move_to(self, channel):
+        if self in self.channel.voice_clients:
+            self.channel.voice_clients.remove(self)
+        self.channel = channel
+        channel.voice_clients.append(self)
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.connected = False
+        if self in self.channel.voice_clients:
+            self.channel.voice_clients.remove(self)
+
+
+class FakeMember:
+    def __init__(self, member_id, name, voice_channel=None, bot=False):
+        self.id = member_id
+        self.display_name = name
+        self.name = name
+        self.bot = bot
+        self.voice = type('VoiceState', (), {'channel': voice_channel})() if voice_channel else None
+
+
+class FakePermissions:
+    send_messages = True
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"text-{channel_id}"
+        self.messages = []
+
+    def permissions_for(self, member):
+        return FakePermissions()
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content)
+        return FakeMessage(content)
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id, guild, recorder, track_seconds):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"voice-{channel_id}"
+        self.members = []
+        self.voice_clients = []
+        self.recorder = recorder
+        self.track_seconds = track_seconds
+
+    async def connect(self, **kwargs):
+        voice_client = FakeVoiceClient(self, self.recorder, self.track_seconds)
+        self.voice_clients.append(voice_client)
+        return voice_client
+
+
+class FakeGuild:
+    def __init__(self, guild_id, recorder, track_seconds):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.me = FakeMember(0, "RexTunes", bot=True)
+        self.text_channel = FakeTextChannel(guild_id * 10 + 1, self)
+        self.voice_channel = FakeVoiceChannel(guild_id * 10 + 2, self, recorder, track_seconds)
+        self.text_channels = [self.text_channel]
+        self.voice_channels = [self.voice_channel]
+        self.member = FakeMember(guild_id * 10 + 3, f"listener-{guild_id}", self.voice_channel)
+        self.voice_channel.members.append(self.member)
+
+    def get_channel(self, channel_id):
+        for channel in self.text_channels + self.voice_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+
+class FakeClient:
+    """Enough of discord.Client for MusicPlayer and the command handlers"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.guilds_by_id = {}
+        self.channels = {}
+
+    def add_guild(self, guild):
+        self.guilds_by_id[guild.id] = guild
+        for channel in guild.text_channels + guild.voice_channels:
+            self.channels[channel.id] = channel
+
+    @property
+    def guilds(self):
+        return list(self.guilds_by_id.values())
+
+    def get_guild(self, guild_id):
+        return self.guilds_by_id.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def is_closed(self):
+        return False
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        if self.done:
+            raise discord.errors.InteractionResponded(self.interaction)
+        self.done = True
+        self.interaction.messages.append(content)
+
+    async def defer(self, **kwargs):
+        if self.done:
+            raise discord.errors.InteractionResponded(self.interaction)
+        self.done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.messages.append(content)
+        return FakeMessage(content)
+
+
+class FakeInteraction:
+    """Stand-in for discord.Interaction as used by the slash command handlers"""
+
+    def __init__(self, client, guild):
+        self.client = client
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = guild.text_channel
+        self.channel_id = guild.text_channel.id
+        self.user = guild.member
+        self.messages = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def original_response(self):
+        return FakeMessage(self.messages[0] if self.messages else None)
+
+    async def edit_original_response(self, content=None, **kwargs):
+        self.messages.append(content)
@@ -0,0 +1,234 @@
+"""
+Offline load test for MusicPlayer and the slash command handlers.
+
+Drives many guilds at once through /play and /queue using fake voice clients,
+interactions and channels, with stubbed YouTube, yt-dlp and Spotify backends,
+and reports time to first audio, inter-track gaps, /queue latency,
+event loop lag and memory per guild.
+
+    python benchmarks/loadtest.py --guilds 50 --songs 5
+    python benchmarks/loadtest.py --guilds 500 --playlist-tracks 300 --json results.json
+
+Exits with status 1 if the median inter-track gap exceeds --max-gap-p50-ms.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+# The bot modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from discord import app_commands
+
+import fakes
+
+# Guild ID the slash commands are registered against
+BENCH_GUILD_ID = 1
+
+
+def install_stubs():
+    """Swap every network-facing dependency for its local stub"""
+    import spotipy
+    import yt_dlp
+    import spotify
+    import music_player
+
+    yt_dlp.YoutubeDL = fakes.StubYoutubeDL
+    music_player.YoutubeSearch = fakes.StubYoutubeSearch
+    spotipy.Spotify = fakes.StubSpotify
+    spotify.SpotifyClientCredentials = fakes.StubCredentials
+    discord.FFmpegPCMAudio = fakes.FakeAudioSource
+    discord.FFmpegOpusAudio = fakes.FakeAudioSource
+
+    # Keep the run self-contained
+    os.environ.setdefault("spot_id", "bench")
+    os.environ.setdefault("spot_secret", "bench")
+    os.environ.pop("redis_url", None)
+    os.environ.setdefault("extractor_warmup_url", "")
+
+
+def summarize(values):
+    """p50/p95/p99/max of a list of seconds, in milliseconds"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+async def run(args):
+    from music_player import MusicPlayer
+    from command_handler import register_commands
+
+    loop = asyncio.get_running_loop()
+    recorder = fakes.Recorder()
+    client = fakes.FakeClient(loop)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    memory_baseline = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+
+    music_player = MusicPlayer()
+    tree = app_commands.CommandTree(discord.Client(intents=discord.Intents.default()))
+    register_commands(tree, client, music_player, [BENCH_GUILD_ID])
+
+    def command(name):
+        return tree.get_command(name, guild=discord.Object(id=BENCH_GUILD_ID)).callback
+
+    play, show_queue = command("play"), command("queue")
+    lag_task = asyncio.create_task(music_player.loop_monitor.run())
+
+    guilds = [fakes.FakeGuild(index + 1, recorder, args.track_seconds) for index in range(args.guilds)]
+    for guild in guilds:
+        client.add_guild(guild)
+
+    # Every guild asks for music at the same moment
+    started = {}
+
+    async def start_guild(guild):
+        started[guild.id] = time.perf_counter()
+        if args.playlist_tracks:
+            await play(fakes.FakeInteraction(client, guild), song_title=f"https://open.spotify.com/playlist/bench{guild.id}")
+            return
+        for number in range(args.songs):
+            await play(fakes.FakeInteraction(client, guild), song_title=f"guild {guild.id} song {number}")
+
+    setup_started = time.perf_counter()
+    await asyncio.gather(*(start_guild(guild) for guild in guilds))
+    setup_seconds = time.perf_counter() - setup_started
+
+    memory_after_setup = tracemalloc.get_traced_memory()[0] if args.trace_memory else 0
+
+    # Keep polling /queue while the songs play out
+    expected_tracks = args.guilds * (args.playlist_tracks or args.songs)
+    queue_latencies = []
+    deadline = time.perf_counter() + args.max_seconds
+    while recorder.tracks_played < expected_tracks and time.perf_counter() < deadline:
+        for guild in guilds[::max(1, len(guilds) // args.queue_samples)]:
+            before = time.perf_counter()
+            await show_queue(fakes.FakeInteraction(client, guild))
+            queue_latencies.append(time.perf_counter() - before)
+        await asyncio.sleep(args.queue_interval)
+
+    resources = music_player.resource_counts()
+
+    # Tear every guild down, anything still counted afterwards has leaked
+    for guild in guilds:
+        await music_player.disconnect_guild(guild.id)
+    await asyncio.sleep(0)
+    resources_after_teardown = music_player.resource_counts()
+
+    lag_task.cancel()
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    time_to_first_audio = [
+        recorder.first_audio[guild_id] - started[guild_id]
+        for guild_id in started if guild_id in recorder.first_audio
+    ]
+    return {
+        'config': vars(args),
+        'setup_seconds': setup_seconds,
+        'guilds_playing': len(time_to_first_audio),
+        'tracks_played': recorder.tracks_played,
+        'tracks_expected': expected_tracks,
+        'time_to_first_audio': summarize(time_to_first_audio),
+        'inter_track_gap': summarize(recorder.gaps),
+        'queue_latency': summarize(queue_latencies),
+        'event_loop_lag_ms': {key: value * 1000 for key, value in music_player.loop_monitor.snapshot().items() if key != 'samples'},
+        'memory_per_guild_kb': (memory_after_setup - memory_baseline) / 1024 / args.guilds if args.trace_memory else None,
+        'youtube_searches': fakes.StubYoutubeSearch.calls,
+        'extractions': fakes.StubYoutubeDL.calls,
+        'resolver': {
+            'matched': music_player.resolver.matched,
+            'unmatched': music_player.resolver.unmatched
+        },
+        'extractor': {
+            'average_latency': music_player.metrics.extract_seconds.average(),
+            'rejected': music_player.extractors.rejected
+        },
+        'resources': resources,
+        'resources_after_teardown': resources_after_teardown
+    }
+
+
+def print_report(report):
+    print(f"\nGuilds playing: {report['guilds_playing']}/{report['config']['guilds']}, "
+          f"tracks played: {report['tracks_played']}/{report['tracks_expected']}, "
+          f"setup: {report['setup_seconds']:.2f}s")
+    for name in ('time_to_first_audio', 'inter_track_gap', 'queue_latency'):
+        stats = report[name]
+        if stats:
+            print(f"{name:>20}: p50 {stats['p50_ms']:8.1f}ms  p95 {stats['p95_ms']:8.1f}ms  "
+                  f"p99 {stats['p99_ms']:8.1f}ms  max {stats['max_ms']:8.1f}ms  (n={stats['count']})")
+        else:
+            print(f"{name:>20}: no samples")
+    lag = report['event_loop_lag_ms']
+    print(f"{'event_loop_lag':>20}: last {lag['last']:.1f}ms  average {lag['average']:.1f}ms  max {lag['max']:.1f}ms")
+    if report['memory_per_guild_kb'] is not None:
+        print(f"{'memory_per_guild':>20}: {report['memory_per_guild_kb']:.1f} KiB")
+    print(f"{'backend calls':>20}: {report['youtube_searches']} searches, {report['extractions']} extractions")
+    extractor = report['extractor']
+    print(f"{'extractor':>20}: average latency {extractor['average_latency'] * 1000:.1f}ms  "
+          f"rejected {extractor['rejected']}")
+    resolver = report['resolver']
+    print(f"{'resolver':>20}: {resolver['matched']} matched, {resolver['unmatched']} unmatched")
+    for name in ('resources', 'resources_after_teardown'):
+        print(f"{name:>20}: " + ", ".join(f"{key} {value}" for key, value in report[name].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for RexTunes")
+    parser.add_argument("--guilds", type=int, default=50, help="Number of simulated guilds")
+    parser.add_argument("--songs", type=int, default=5, help="Songs queued per guild with /play")
+    parser.add_argument("--playlist-tracks", type=int, default=0, help="Play a Spotify playlist of this size instead of single songs")
+    parser.add_argument("--track-seconds", type=float, default=1.0, help="Simulated length of every track")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Seconds per stubbed YouTube search")
+    parser.add_argument("--extract-latency", type=float, default=0.1, help="Seconds per stubbed yt-dlp extraction")
+    parser.add_argument("--spotify-latency", type=float, default=0.05, help="Seconds per stubbed Spotify API page")
+    parser.add_argument("--queue-interval", type=float, default=0.5, help="Seconds between /queue polling rounds")
+    parser.add_argument("--queue-samples", type=int, default=10, help="Guilds polled with /queue per round")
+    parser.add_argument("--max-seconds", type=float, default=120, help="Stop waiting for playback after this long")
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false", help="Skip tracemalloc memory accounting")
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--max-gap-p50-ms", type=float, default=750, help="Fail if the median inter-track gap is longer than this")
+    args = parser.parse_args()
+
+    fakes.LATENCY.search = args.search_latency
+    fakes.LATENCY.extract = args.extract_latency
+    fakes.LATENCY.spotify = args.spotify_latency
+    fakes.StubSpotify.playlist_size = args.playlist_tracks or 100
+
+    install_stubs()
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # A track change waiting on the look-ahead rate limit shows up as a gap close to a whole second
+    gap = report['inter_track_gap']
+    if gap and gap['p50_ms'] > args.max_gap_p50_ms:
+        print(f"FAIL: inter_track_gap p50 {gap['p50_ms']:.1f}ms is over {args.max_gap_p50_ms:g}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
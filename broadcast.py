@@ -0,0 +1,165 @@
+import threading
+
+import discord
+
+
+class Broadcast:
+    """
+    One upstream audio source shared by every guild playing the same track.
+    Frames are kept in a ring buffer and each listener reads it through its own cursor.
+    The listener furthest ahead pulls the next frame from upstream, the rest replay it
+    from the ring, so the track is decoded and encoded once however many guilds hear it.
+    """
+
+    def __init__(self, hub, key, source, capacity):
+        self.hub = hub
+        self.key = key
+        self.source = source
+        self.capacity = capacity
+        self.frames = [None] * capacity
+        self.head = 0  # Sequence number of the next frame to be read from upstream
+        self.ended = False
+        self.producing = False  # A listener is reading upstream outside the lock
+        self.listeners = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    @property
+    def joinable(self):
+        """Whether a new listener can still hear the track from its first frame"""
+        return not self.closed and self.head < self.capacity
+
+    def read(self, cursor):
+        """Return frame number cursor, b'' once the track ended, or None if it left the ring"""
+        with self.condition:
+            while True:
+                if cursor < self.head - self.capacity:
+                    return None
+                if cursor < self.head:
+                    return self.frames[cursor % self.capacity]
+                if self.ended or self.closed:
+                    return b''
+                if not self.producing:
+                    self.producing = True
+                    break
+                # Another listener is already fetching this frame
+                self.condition.wait()
+
+        try:
+            frame = self.source.read()
+        except Exception as e:
+            print(f"Broadcast source for {self.key} failed: {e}")
+            frame = b''
+
+        with self.condition:
+            self.producing = False
+            if frame:
+                self.frames[self.head % self.capacity] = frame
+                self.head += 1
+            else:
+                self.ended = True
+            self.condition.notify_all()
+        return frame if frame else b''
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    @property
+    def _process(self):
+        return getattr(self.source, '_process', None)
+
+    def release(self):
+        """A listener finished, the upstream is closed with the last one"""
+        with self.condition:
+            self.listeners -= 1
+            if self.listeners > 0 or self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.hub.finished(self)
+        try:
+            self.source.cleanup()
+        except Exception as e:
+            print(f"Error cleaning up broadcast source for {self.key}: {e}")
+
+
+class BroadcastListener(discord.AudioSource):
+    """One guild's view of a Broadcast, reading from its own position in the ring"""
+
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+        self.cursor = 0
+        self.overrun = False  # Fell further behind than the ring holds
+        self.released = False
+
+    def read(self):
+        frame = self.broadcast.read(self.cursor)
+        if frame is None:
+            # Ending here makes playback resume the track at this position on its own stream
+            self.overrun = True
+            return b''
+        if frame:
+            self.cursor += 1
+        return frame
+
+    def is_opus(self):
+        return self.broadcast.is_opus()
+
+    @property
+    def _process(self):
+        return self.broadcast._process
+
+    def cleanup(self):
+        if not self.released:
+            self.released = True
+            self.broadcast.release()
+
+
+class BroadcastHub:
+    """
+    Broadcasts by track. A guild starting a track that another guild started less
+    than a ring buffer ago joins that broadcast, otherwise a new one is opened.
+    """
+
+    def __init__(self, buffer_frames):
+        self.buffer_frames = buffer_frames
+        self.broadcasts = {}  # key -> newest broadcast of that track
+        self.live = set()  # Every broadcast with listeners, including ones too far along to join
+        self.lock = threading.Lock()
+        self.shared = 0  # Listeners that joined an existing broadcast
+
+    def subscribe(self, key, open_source):
+        """Return a listener for key, calling open_source() only if no broadcast can be joined"""
+        with self.lock:
+            broadcast = self.broadcasts.get(key)
+            if broadcast is not None and broadcast.joinable:
+                with broadcast.condition:
+                    if broadcast.joinable:
+                        broadcast.listeners += 1
+                        self.shared += 1
+                        return BroadcastListener(broadcast)
+
+        source = open_source()
+        broadcast = Broadcast(self, key, source, self.buffer_frames)
+        broadcast.listeners = 1
+        with self.lock:
+            # Replaces a broadcast too far along to join, its listeners keep playing it
+            self.broadcasts[key] = broadcast
+            self.live.add(broadcast)
+        return BroadcastListener(broadcast)
+
+    def finished(self, broadcast):
+        with self.lock:
+            self.live.discard(broadcast)
+            if self.broadcasts.get(broadcast.key) is broadcast:
+                del self.broadcasts[broadcast.key]
+
+    def snapshot(self):
+        """Broadcasts running and the listeners they serve"""
+        with self.lock:
+            broadcasts = list(self.live)
+        return {
+            'broadcasts': len(broadcasts),
+            'listeners': sum(broadcast.listeners for broadcast in broadcasts),
+            'shared': self.shared
+        }
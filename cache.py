@@ -0,0 +1,185 @@
+import json
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Search results rarely change, stream URLs are signed and expire
+SEARCH_TTL = 7 * 24 * 3600
+DEFAULT_STREAM_TTL = 30 * 60
+# Refresh stream URLs a little before YouTube stops accepting them
+STREAM_EXPIRY_MARGIN = 5 * 60
+# Negative entries: videos that cannot be played and searches without a match are not retried for a while
+UNPLAYABLE_TTL = 6 * 3600
+NO_MATCH_TTL = 3600
+# Lifetime of entries promoted from the shared tier
+TTLS = {'search': SEARCH_TTL, 'unplayable': UNPLAYABLE_TTL, 'nomatch': NO_MATCH_TTL}
+
+
+def video_id_from_url(url):
+    """Extract the video ID from a YouTube watch URL"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.hostname == "youtu.be":
+        return parsed.path.lstrip("/") or None
+    ids = parse_qs(parsed.query).get("v")
+    return ids[0] if ids else None
+
+
+def stream_url_ttl(stream_url):
+    """Seconds a stream URL stays usable, based on its signed expire= parameter"""
+    expires = parse_qs(urlparse(stream_url).query).get("expire")
+    if not expires:
+        return DEFAULT_STREAM_TTL
+    try:
+        return max(0, int(expires[0]) - int(time.time()) - STREAM_EXPIRY_MARGIN)
+    except ValueError:
+        return DEFAULT_STREAM_TTL
+
+
+class LRUCache:
+    """In-process LRU cache with an optional expiry per entry"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    """Shared cache tier stored in Redis so results survive restarts and are reused across processes"""
+
+    def __init__(self, url, prefix="rextunes:"):
+        if aioredis is None:
+            raise RuntimeError("redis package is not installed")
+        self.client = aioredis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key):
+        try:
+            raw = await self.client.get(self.prefix + key)
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            print(f"Redis cache read error: {e}")
+            return None
+
+    async def set(self, key, value, ttl=None):
+        try:
+            if ttl is not None and ttl <= 0:
+                return
+            await self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+        except Exception as e:
+            print(f"Redis cache write error: {e}")
+
+
+class TrackCache:
+    """
+    Layered cache for YouTube lookups.
+    Maps search queries to video info and video IDs to stream URLs,
+    checking the in-process LRU before the optional shared tier, a RedisCache or
+    the Redis state backend. Stream URLs are signed for the IP address that extracted
+    them, so they stay in this process and only searches and negative entries are shared.
+    """
+
+    def __init__(self, max_size=2048, redis_url=None, remote=None):
+        self.local = LRUCache(max_size)
+        self.remote = remote
+        if remote is None and redis_url:
+            try:
+                self.remote = RedisCache(redis_url)
+            except Exception as e:
+                print(f"Redis cache disabled: {e}")
+
+    async def _get(self, key, shared=True):
+        value = self.local.get(key)
+        if value is not None or self.remote is None or not shared:
+            return value
+
+        value = await self.remote.get(key)
+        if value is not None:
+            # Promote into the local tier
+            self.local.set(key, value, TTLS[key.split(":", 1)[0]])
+        return value
+
+    async def _set(self, key, value, ttl, shared=True):
+        if ttl <= 0:
+            return
+        self.local.set(key, value, ttl)
+        if self.remote is not None and shared:
+            await self.remote.set(key, value, ttl)
+
+    async def get_search(self, query):
+        """Return {'id', 'title', 'duration'} for a search query if cached"""
+        return await self._get("search:" + query.strip().lower())
+
+    async def set_search(self, query, info):
+        await self._set("search:" + query.strip().lower(), info, SEARCH_TTL)
+
+    async def get_stream(self, video_id):
+        """Return {'url', 'title', 'duration', 'id'} for a video if its stream URL is still valid"""
+        if not video_id:
+            return None
+        return await self._get("stream:" + video_id, shared=False)
+
+    async def set_stream(self, video_id, data):
+        if not video_id:
+            return
+        await self._set("stream:" + video_id, data, stream_url_ttl(data["url"]), shared=False)
+
+    async def get_no_match(self, query):
+        """Whether a search query recently found nothing"""
+        return await self._get("nomatch:" + query.strip().lower()) is not None
+
+    async def set_no_match(self, query):
+        await self._set("nomatch:" + query.strip().lower(), {}, NO_MATCH_TTL)
+
+    async def get_unplayable(self, video_id):
+        """Return why a video cannot be played if that is known, otherwise None"""
+        if not video_id:
+            return None
+        entry = await self._get("unplayable:" + video_id)
+        return entry["reason"] if entry is not None else None
+
+    async def set_unplayable(self, video_id, reason):
+        if not video_id:
+            return
+        await self._set("unplayable:" + video_id, {'reason': reason}, UNPLAYABLE_TTL)
+
+    async def invalidate_stream(self, video_id):
+        """Forget a stream URL that turned out to be unplayable"""
+        self.local.delete("stream:" + video_id)
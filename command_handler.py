@@ -1,19 +1,45 @@
 import discord
 from discord import app_commands
 import asyncio
-import random
+import functools
+import time
+from track import format_duration
 
-def register_commands(tree, client, music_player, guild_id):
-    """Register all slash commands with the command tree"""
+# Number of songs shown per /queue page
+QUEUE_PAGE_SIZE = 10
+# Most songs /add searches for in one go
+MAX_BULK_SONGS = 25
+
+def register_commands(tree, client, music_player, guild_ids=None):
+    """Register all slash commands with the command tree, in guild_ids or globally when there are none"""
+    
+    # An empty list registers a command globally
+    command_guilds = [discord.Object(id=guild_id) for guild_id in guild_ids or ()]
+    
+    def instrumented(func):
+        """Time a slash command handler and trace it when tracing is enabled"""
+        @functools.wraps(func)
+        async def wrapper(interaction, *args, **kwargs):
+            started = time.perf_counter()
+            with music_player.tracer.span(f"/{func.__name__}", guild=interaction.guild_id):
+                try:
+                    return await func(interaction, *args, **kwargs)
+                finally:
+                    music_player.metrics.command_seconds.observe(time.perf_counter() - started, command=func.__name__)
+        return wrapper
     
     @tree.command(
         name="play",
-        description="Play a song or Spotify playlist",
-        guild=discord.Object(id=guild_id)
+        description="Play a song or Spotify playlist, album or track",
+        guilds=command_guilds
     )
-    @app_commands.describe(song_title="Enter song title, YouTube URL, or Spotify playlist URL")
+    @app_commands.describe(song_title="Enter song title, YouTube URL, or Spotify playlist, album or track URL")
+    @instrumented
     async def play(interaction: discord.Interaction, song_title: str):
         try:
+            if not await music_player.claim_guild(interaction.guild_id):
+                await interaction.response.send_message("Another RexTunes instance is already playing in this server!")
+                return
             # Connect to voice channel first
             if not await music_player.connect_to_voice(interaction):
                 await interaction.response.send_message("You need to join a voice channel first!")
@@ -22,15 +48,16 @@ def register_commands(tree, client, music_player, guild_id):
             # Always defer the response first to prevent timeout issues
             await interaction.response.defer()
                 
-            if "https://open.spotify.com/playlist/" in song_title:
-                # For playlists
+            if music_player.sp.is_spotify_url(song_title):
+                # For Spotify playlists, albums and tracks
                 success, message = await music_player.play_playlist(interaction, song_title)
             else:
                 # For single songs
                 success, message = await music_player.play_song(interaction, song_title)
                 
-            # Use followup for all responses
-            await interaction.followup.send(message)
+            # Use followup for all responses, playlists send and edit their own reply
+            if message:
+                await interaction.followup.send(message)
                 
         except Exception as e:
             print(f"Error in play command: {e}")
@@ -42,47 +69,18 @@ def register_commands(tree, client, music_player, guild_id):
     @tree.command(
         name="stop",
         description="Stops the player and disconnects the bot",
-        guild=discord.Object(id=guild_id)
+        guilds=command_guilds
     )
+    @instrumented
     async def stop(interaction: discord.Interaction):
         try:
             guild_id = interaction.guild_id
-            music_player.text_channels[guild_id] = interaction.channel_id
-            if guild_id in music_player.voice_clients:
-                # Stop playback
-                if music_player.voice_clients[guild_id].is_playing():
-                    music_player.voice_clients[guild_id].stop()
-                
+            if music_player.get_voice_client(guild_id):
                 # Send response first before disconnecting
                 await interaction.response.send_message("Leaving ;-;")
                 
-                # Cancel any background playlist processing tasks
-                if hasattr(music_player, 'background_tasks') and guild_id in music_player.background_tasks:
-                    try:
-                        # Mark for cancellation (our task checks this flag)
-                        task = music_player.background_tasks[guild_id]
-                        if not task.done() and not task.cancelled():
-                            task.cancel()
-                        print(f"Cancelled background playlist processing for guild {guild_id}")
-                    except Exception as task_error:
-                        print(f"Error cancelling background task: {task_error}")
-                
-                # Then disconnect
-                await music_player.voice_clients[guild_id].disconnect()
-                
-                # Clean up resources
-                del music_player.voice_clients[guild_id]
-                
-                # Clear the queue
-                if guild_id in music_player.queues:
-                    music_player.queues[guild_id] = []
-                    
-                # Clear current song reference
-                if guild_id in music_player.current_songs:
-                    del music_player.current_songs[guild_id]
-                # Clear the text channel reference
-                if guild_id in music_player.text_channels:
-                    del music_player.text_channels[guild_id]
+                # Stops playback, cancels playlist loading and prefetching, then disconnects
+                await music_player.disconnect_guild(guild_id)
             else:
                 await interaction.response.send_message("Not connected to a voice channel!")
         except Exception as e:
@@ -95,13 +93,16 @@ def register_commands(tree, client, music_player, guild_id):
     @tree.command(
         name="pause",
         description="Pauses the player",
-        guild=discord.Object(id=guild_id)
+        guilds=command_guilds
     )
+    @instrumented
     async def pause(interaction: discord.Interaction):
         try:
             guild_id = interaction.guild_id
-            if guild_id in music_player.voice_clients and music_player.voice_clients[guild_id].is_playing():
-                music_player.voice_clients[guild_id].pause()
+            voice_client = music_player.get_voice_client(guild_id)
+            if voice_client and voice_client.is_playing():
+                voice_client.pause()
+                music_player.idle.stopped(guild_id)
                 await interaction.response.send_message("Paused playback.")
             else:
                 await interaction.response.send_message("Nothing is playing right now!")
@@ -115,13 +116,16 @@ def register_commands(tree, client, music_player, guild_id):
     @tree.command(
         name="resume",
         description="Resumes the player",
-        guild=discord.Object(id=guild_id)
+        guilds=command_guilds
     )
+    @instrumented
     async def resume(interaction: discord.Interaction):
         try:
             guild_id = interaction.guild_id
-            if guild_id in music_player.voice_clients and music_player.voice_clients[guild_id].is_paused():
-                music_player.voice_clients[guild_id].resume()
+            voice_client = music_player.get_voice_client(guild_id)
+            if voice_client and voice_client.is_paused():
+                voice_client.resume()
+                music_player.idle.playing(guild_id)
                 await interaction.response.send_message("Resuming playback.")
             else:
                 await interaction.response.send_message("Nothing is paused right now!")
@@ -135,31 +139,26 @@ def register_commands(tree, client, music_player, guild_id):
     @tree.command(
         name="skip",
         description="Skips the current song",
-        guild=discord.Object(id=guild_id)
+        guilds=command_guilds
     )
+    @instrumented
     async def skip(interaction: discord.Interaction):
         try:
             guild_id = interaction.guild_id
             
             # Check if connected to voice
-            if guild_id not in music_player.voice_clients:
+            if not music_player.get_voice_client(guild_id):
                 await interaction.response.send_message("I'm not connected to a voice channel!")
                 return
             
-            # Check if we have a queue for this guild
-            if guild_id not in music_player.queues or not music_player.queues[guild_id]:
+            # Stop current playback, play_next picks up the next song
+            if not music_player.skip(guild_id):
                 await interaction.response.send_message("No songs in queue to skip to!")
                 return
                 
             # Acknowledge the skip request
             await interaction.response.send_message("Skipping to next song...")
             
-            # Stop current playback
-            if music_player.voice_clients[guild_id].is_playing():
-                music_player.voice_clients[guild_id].stop()
-                
-            # The play_next function will be automatically called by the 'after' parameter
-            
         except Exception as e:
             print(f"Error in skip function: {e}")
             try:
@@ -170,83 +169,74 @@ def register_commands(tree, client, music_player, guild_id):
     @tree.command(
         name="queue",
         description="Shows the current song queue",
-        guild=discord.Object(id=guild_id)
+        guilds=command_guilds
     )
-    async def queue(interaction: discord.Interaction):
+    @app_commands.describe(page="Page of the queue to show")
+    @instrumented
+    async def queue(interaction: discord.Interaction, page: int = 1):
         try:
-            # Defer response to avoid timeout
-            await interaction.response.defer()
-            
             guild_id = interaction.guild_id
+            session = music_player.sessions.get(guild_id)
+            queue = music_player.get_queue(guild_id)
+            current = session.current_song if session else None
             
             # Check if queue exists
-            if guild_id not in music_player.queues or not music_player.queues[guild_id]:
-                await interaction.followup.send("The queue is empty!")
+            if not queue and not current:
+                await interaction.response.send_message("The queue is empty!")
                 return
-                
-            # Get current song info
-            current_title = "Unknown song"
-            if guild_id in music_player.current_songs:
-                _, current_title = await music_player.search_youtube(music_player.current_songs[guild_id])
+            
+            # Everything shown comes from metadata stored at enqueue time, no lookups needed
+            total_pages = max(1, -(-len(queue) // QUEUE_PAGE_SIZE))
+            page = min(max(page, 1), total_pages)
+            start = (page - 1) * QUEUE_PAGE_SIZE
             
             # Begin building queue message
+            current_title = current.display_title if current else "Nothing"
             queue_message = f"**Currently Playing:** {current_title}\n\n**Queue:**\n"
             
-            # Process up to 10 songs in queue to avoid timeout
             queue_list = []
-            position = 1
-            
-            # Process songs in batches to avoid timeouts
-            songs_to_process = min(5, len(music_player.queues[guild_id]))
+            for position, track in enumerate(queue.slice(start, start + QUEUE_PAGE_SIZE), start=start + 1):
+                line = f"{position}. {track.display_title[:80]} [{format_duration(track.duration)}]"
+                if track.requester:
+                    line += f" - {track.requester}"
+                queue_list.append(line)
+            queue_message += "\n".join(queue_list) if queue_list else "Nothing queued"
             
-            for i in range(songs_to_process):
-                song_url = music_player.queues[guild_id][i]
-                try:
-                    _, title = await music_player.search_youtube(song_url)
-                    if title:
-                        queue_list.append(f"{position}. {title}")
-                    else:
-                        queue_list.append(f"{position}. Unknown song")
-                except Exception as e:
-                    print(f"Error getting queue item title: {e}")
-                    queue_list.append(f"{position}. Unknown song")
-                position += 1
-                
-            # Add the list to the message
-            queue_message += "\n".join(queue_list)
-            
-            # Add footer if there are more songs
-            if len(music_player.queues[guild_id]) > 10:
-                queue_message += f"\n\n...and {len(music_player.queues[guild_id]) - 10} more songs"
+            # Add footer with the page and remaining play time
+            total_seconds = sum(track.duration or 0 for track in queue)
+            unknown = sum(1 for track in queue if track.duration is None)
+            queue_message += f"\n\nPage {page}/{total_pages} - {len(queue)} songs, {format_duration(total_seconds)} remaining"
+            if unknown:
+                queue_message += f" (+{unknown} songs of unknown length)"
                 
             # Send the queue information
-            await interaction.followup.send(queue_message)
+            await interaction.response.send_message(queue_message)
                 
         except Exception as e:
             print(f"Error in queue command: {e}")
             try:
-                await interaction.followup.send(f"Failed to get queue: {str(e)}")
+                await interaction.response.send_message(f"Failed to get queue: {str(e)}")
             except:
                 # If all else fails, try again with a new message
                 try:
-                    await interaction.channel.send(f"Failed to show queue: {str(e)}")
+                    await interaction.followup.send(f"Failed to show queue: {str(e)}")
                 except:
                     pass
     @tree.command(
         name="shuffle",
         description="Shuffles the current playlist",
-        guild=discord.Object(id=guild_id)
+        guilds=command_guilds
     )
+    @instrumented
     async def shuffle(interaction: discord.Interaction):
         try:
             guild_id = interaction.guild_id
-            # Check if queue exists
-            if guild_id not in music_player.queues or not music_player.queues[guild_id]:
-                await interaction.followup.send("The queue is empty!")
+            # Shuffle fails if the queue is empty
+            if not music_player.shuffle_queue(guild_id):
+                await interaction.response.send_message("The queue is empty!")
                 return
-            random.shuffle(music_player.queues[guild_id])
-            # Acknowledge the skip request
-            await interaction.response.send_message("Shuffling the queue....")
+            # Acknowledge the shuffle request
+            await interaction.response.send_message("Shuffling the queue.... Use /unshuffle to undo.")
         except Exception as e:
             print(f"Error in shuffle command: {e}")
             try:
@@ -256,4 +246,153 @@ def register_commands(tree, client, music_player, guild_id):
                 try:
                     await interaction.channel.send(f"Failed to shuffle playlist: {str(e)}")
                 except:
-                    pass
\ No newline at end of file
+                    pass
+
+    @tree.command(
+        name="unshuffle",
+        description="Restores the queue order from before the last shuffle",
+        guilds=command_guilds
+    )
+    @instrumented
+    async def unshuffle(interaction: discord.Interaction):
+        try:
+            guild_id = interaction.guild_id
+            if not music_player.unshuffle_queue(guild_id):
+                await interaction.response.send_message("There is no shuffle to undo!")
+                return
+            await interaction.response.send_message("Restored the original queue order.")
+        except Exception as e:
+            print(f"Error in unshuffle command: {e}")
+            try:
+                await interaction.response.send_message(f"Failed to unshuffle the queue: {str(e)}")
+            except discord.errors.InteractionResponded:
+                await interaction.followup.send(f"Failed to unshuffle the queue: {str(e)}")
+
+    @tree.command(
+        name="playnext",
+        description="Play a song right after the current one",
+        guilds=command_guilds
+    )
+    @app_commands.describe(song_title="Enter song title or YouTube URL")
+    @instrumented
+    async def playnext(interaction: discord.Interaction, song_title: str):
+        try:
+            if not await music_player.claim_guild(interaction.guild_id):
+                await interaction.response.send_message("Another RexTunes instance is already playing in this server!")
+                return
+            if not await music_player.connect_to_voice(interaction):
+                await interaction.response.send_message("You need to join a voice channel first!")
+                return
+            if music_player.sp.is_spotify_url(song_title):
+                await interaction.response.send_message("Use /play for Spotify links!")
+                return
+            await interaction.response.defer()
+            success, message = await music_player.play_song(interaction, song_title, play_next=True)
+            await interaction.followup.send(message)
+        except Exception as e:
+            print(f"Error in playnext command: {e}")
+            try:
+                await interaction.followup.send(f"An error occurred: {str(e)}")
+            except Exception as inner_e:
+                print(f"Failed to send error message: {inner_e}")
+
+    @tree.command(
+        name="add",
+        description="Queue several songs at once",
+        guilds=command_guilds
+    )
+    @app_commands.describe(songs=f"Up to {MAX_BULK_SONGS} song titles or YouTube URLs, separated by ;")
+    @instrumented
+    async def add(interaction: discord.Interaction, songs: str):
+        try:
+            queries = [query.strip() for query in songs.split(";") if query.strip()]
+            if not queries:
+                await interaction.response.send_message("Give me some songs, separated by ;")
+                return
+            if len(queries) > MAX_BULK_SONGS:
+                await interaction.response.send_message(f"I can only add {MAX_BULK_SONGS} songs at once!")
+                return
+            if any(music_player.sp.is_spotify_url(query) for query in queries):
+                await interaction.response.send_message("Use /play for Spotify links!")
+                return
+            if not await music_player.claim_guild(interaction.guild_id):
+                await interaction.response.send_message("Another RexTunes instance is already playing in this server!")
+                return
+            if not await music_player.connect_to_voice(interaction):
+                await interaction.response.send_message("You need to join a voice channel first!")
+                return
+            await interaction.response.defer()
+            success, message = await music_player.play_many(interaction, queries)
+            await interaction.followup.send(message)
+        except Exception as e:
+            print(f"Error in add command: {e}")
+            try:
+                await interaction.followup.send(f"An error occurred: {str(e)}")
+            except Exception as inner_e:
+                print(f"Failed to send error message: {inner_e}")
+
+    @tree.command(
+        name="remove",
+        description="Removes a song or a range of songs from the queue",
+        guilds=command_guilds
+    )
+    @app_commands.describe(start="Queue position to remove", end="Last position to remove, for a range")
+    @instrumented
+    async def remove(interaction: discord.Interaction, start: int, end: int = None):
+        try:
+            removed = music_player.remove_range(interaction.guild_id, start, end or start)
+            if not removed:
+                await interaction.response.send_message("There are no songs at that position!")
+                return
+            if len(removed) == 1:
+                await interaction.response.send_message(f"Removed {removed[0].display_title} from the queue.")
+            else:
+                await interaction.response.send_message(f"Removed {len(removed)} songs from the queue.")
+        except Exception as e:
+            print(f"Error in remove command: {e}")
+            try:
+                await interaction.response.send_message(f"Failed to remove songs: {str(e)}")
+            except discord.errors.InteractionResponded:
+                await interaction.followup.send(f"Failed to remove songs: {str(e)}")
+
+    @tree.command(
+        name="move",
+        description="Moves a song to another position in the queue",
+        guilds=command_guilds
+    )
+    @app_commands.describe(source="Queue position of the song", destination="Position to move it to")
+    @instrumented
+    async def move(interaction: discord.Interaction, source: int, destination: int):
+        try:
+            track = music_player.move_track(interaction.guild_id, source, destination)
+            if track is None:
+                await interaction.response.send_message("There is no song at that position!")
+                return
+            position = min(destination, len(music_player.get_queue(interaction.guild_id)))
+            await interaction.response.send_message(f"Moved {track.display_title} to position {position}.")
+        except Exception as e:
+            print(f"Error in move command: {e}")
+            try:
+                await interaction.response.send_message(f"Failed to move the song: {str(e)}")
+            except discord.errors.InteractionResponded:
+                await interaction.followup.send(f"Failed to move the song: {str(e)}")
+
+    @tree.command(
+        name="dedupe",
+        description="Removes repeated songs from the queue",
+        guilds=command_guilds
+    )
+    @instrumented
+    async def dedupe(interaction: discord.Interaction):
+        try:
+            removed = music_player.dedupe_queue(interaction.guild_id)
+            if not removed:
+                await interaction.response.send_message("No repeated songs in the queue!")
+                return
+            await interaction.response.send_message(f"Removed {len(removed)} repeated songs from the queue.")
+        except Exception as e:
+            print(f"Error in dedupe command: {e}")
+            try:
+                await interaction.response.send_message(f"Failed to dedupe the queue: {str(e)}")
+            except discord.errors.InteractionResponded:
+                await interaction.followup.send(f"Failed to dedupe the queue: {str(e)}")
@@ -0,0 +1,84 @@
+import asyncio
+import queue
+import threading
+
+import yt_dlp
+
+
+class ExtractorBusy(Exception):
+    """Raised when too many extractions are already waiting to run"""
+
+
+class ExtractorPool:
+    """
+    Dedicated threads for yt-dlp extraction. Every thread owns its YoutubeDL,
+    since one instance is not safe to share, and warms it at startup so the
+    player JS and signature functions are already cached when songs arrive.
+    """
+
+    def __init__(self, options, size=4, max_pending=32, warmup_url=None):
+        self.options = dict(options)
+        self.size = size
+        self.max_pending = max_pending
+        self.warmup_url = warmup_url
+        self.jobs = queue.Queue()
+        self.in_flight = 0
+        self.rejected = 0  # Extractions turned away with ExtractorBusy
+        self.lock = threading.Lock()
+        self.threads = []
+        for index in range(size):
+            thread = threading.Thread(target=self._worker, name=f"yt-extract-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    @property
+    def queue_depth(self):
+        """Extractions waiting for a free worker"""
+        return self.jobs.qsize()
+
+    def _worker(self):
+        ytdl = yt_dlp.YoutubeDL(self.options)
+        if self.warmup_url:
+            try:
+                ytdl.extract_info(self.warmup_url, download=False)
+            except Exception as e:
+                print(f"Extractor warm-up failed: {e}")
+
+        while True:
+            url, future, loop = self.jobs.get()
+            if future.cancelled():
+                continue
+            with self.lock:
+                self.in_flight += 1
+            try:
+                data = ytdl.extract_info(url, download=False)
+                error = None
+            except Exception as e:
+                data, error = None, e
+            with self.lock:
+                self.in_flight -= 1
+            loop.call_soon_threadsafe(self._resolve, future, data, error)
+
+    @staticmethod
+    def _resolve(future, data, error):
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(data)
+
+    async def extract(self, url, interactive=True):
+        """
+        Run extract_info for url on a worker thread.
+        Background work is turned away at half the pending limit so /play keeps headroom.
+        """
+        limit = self.max_pending if interactive else self.max_pending // 2
+        if self.queue_depth + self.in_flight >= limit:
+            self.rejected += 1
+            raise ExtractorBusy(f"{self.queue_depth} extractions already waiting")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.jobs.put((url, future, loop))
+        return await future
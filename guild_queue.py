@@ -0,0 +1,318 @@
+import random
+from collections import Counter, deque
+
+# How many entries are pulled from the tree into the head buffer at a time
+HEAD_BUFFER_SIZE = 32
+
+
+class _Node:
+    """Node of an implicit treap, ordered by position rather than by key"""
+
+    __slots__ = ('track', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, track):
+        self.track = track
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node, count):
+    """Split a tree into (first count entries, the rest)"""
+    if node is None:
+        return None, None
+    if _size(node.left) >= count:
+        left, node.left = _split(node.left, count)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, count - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+
+def _merge(left, right):
+    """Join two trees, every entry of left comes before every entry of right"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _build(tracks):
+    """Build a treap from an ordered sequence in O(n) using a Cartesian tree stack"""
+    stack = []
+    for track in tracks:
+        node = _Node(track)
+        last = None
+        # Nodes popped here are complete, so their sizes can be finalised
+        while stack and stack[-1].priority < node.priority:
+            last = stack.pop()
+            _update(last)
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+
+    root = None
+    while stack:
+        root = stack.pop()
+        _update(root)
+    return root
+
+
+def _iter_tracks(node):
+    """In-order traversal without recursion"""
+    stack = []
+    while stack or node:
+        while node:
+            stack.append(node)
+            node = node.left
+        node = stack.pop()
+        yield node.track
+        node = node.right
+
+
+class GuildQueue:
+    """
+    Song queue for one guild.
+    Entries are kept in three parts, played in this order: a "play next" lane,
+    a small head buffer that makes dequeuing O(1) amortised, and an implicit
+    treap that gives O(log n) insert, remove and move at any position.
+    """
+
+    def __init__(self, tracks=()):
+        self.lane = deque()
+        self.head = deque()
+        self.root = _build(tracks)
+        self._before_shuffle = None
+        self.version = 0  # Bumped on every change, so snapshots can tell an untouched queue apart
+        self.popped = 0  # Entries taken by popleft, so snapshots can tell plain dequeues apart from other changes
+
+    def __len__(self):
+        return len(self.lane) + len(self.head) + _size(self.root)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        yield from self.lane
+        yield from self.head
+        yield from _iter_tracks(self.root)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return self.slice(start, stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+        return self.slice(index, index + 1)[0]
+
+    def slice(self, start, stop):
+        """Return entries start..stop as a list, walking only the part that is needed"""
+        result = []
+        for part in (self.lane, self.head):
+            if start < len(part):
+                result.extend(list(part)[start:stop])
+            start = max(0, start - len(part))
+            stop = max(0, stop - len(part))
+        if stop > start and self.root:
+            middle, after = _split(self.root, stop)
+            before, wanted = _split(middle, start)
+            result.extend(_iter_tracks(wanted))
+            self.root = _merge(_merge(before, wanted), after)
+        return result
+
+    def append(self, track):
+        self.version += 1
+        self.root = _merge(self.root, _Node(track))
+
+    def extend(self, tracks):
+        self.version += 1
+        self.root = _merge(self.root, _build(tracks))
+
+    def insert_next(self, track):
+        """Queue a track in the priority lane so it plays before everything else"""
+        self.version += 1
+        self.lane.append(track)
+
+    def popleft(self):
+        """Remove and return the next track to play"""
+        if self.lane:
+            track = self.lane.popleft()
+        else:
+            if not self.head:
+                # Refill the buffer in one split so most dequeues never touch the tree
+                chunk, self.root = _split(self.root, HEAD_BUFFER_SIZE)
+                self.head.extend(_iter_tracks(chunk))
+            if not self.head:
+                raise IndexError("pop from an empty queue")
+            track = self.head.popleft()
+        self.version += 1
+        self.popped += 1
+        return track
+
+    def insert(self, index, track):
+        """Insert a track so it ends up at position index"""
+        self.version += 1
+        index = max(0, min(index, len(self)))
+        if index <= len(self.lane):
+            self.lane.insert(index, track)
+            return
+        index -= len(self.lane)
+        if index <= len(self.head) and self.head:
+            self.head.insert(index, track)
+            return
+        index -= len(self.head)
+        left, right = _split(self.root, index)
+        self.root = _merge(_merge(left, _Node(track)), right)
+
+    def remove(self, index):
+        """Remove and return the track at position index"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+        self.version += 1
+        if index < len(self.lane):
+            track = self.lane[index]
+            del self.lane[index]
+            return track
+        index -= len(self.lane)
+        if index < len(self.head):
+            track = self.head[index]
+            del self.head[index]
+            return track
+        index -= len(self.head)
+        left, rest = _split(self.root, index)
+        node, right = _split(rest, 1)
+        self.root = _merge(left, right)
+        return node.track
+
+    def _filter(self, keep):
+        """Keep only the entries keep(track) is true for, in one rebuild of the tree"""
+        self.version += 1
+        before = len(self)
+        self.lane = deque(track for track in self.lane if keep(track))
+        kept = [track for track in list(self.head) + list(_iter_tracks(self.root)) if keep(track)]
+        self.head.clear()
+        self.root = _build(kept)
+        return before - len(self)
+
+    def discard(self, tracks, within=None):
+        """
+        Remove every entry that is one of tracks, returns how many were removed.
+        With within, only the first within entries are searched and each match is cut out
+        on its own, rather than rebuilding the whole tree for a few tracks near the head.
+        """
+        unwanted = {id(track) for track in tracks}
+        if within is None:
+            return self._filter(lambda track: id(track) not in unwanted)
+        found = [index for index, track in enumerate(self.slice(0, within)) if id(track) in unwanted]
+        for index in reversed(found):
+            self.remove(index)
+        return len(found)
+
+    def dedupe(self, key):
+        """Keep only the first entry for each key(track), returns the entries removed"""
+        seen = set()
+        removed = []
+
+        def keep(track):
+            value = key(track)
+            if value in seen:
+                removed.append(track)
+                return False
+            seen.add(value)
+            return True
+
+        self._filter(keep)
+        return removed
+
+    def remove_range(self, start, stop):
+        """Remove and return entries start..stop, cutting them out of the tree in one piece"""
+        start, stop = max(0, start), min(stop, len(self))
+        removed = []
+        if start >= stop:
+            return removed
+        self.version += 1
+        for part in (self.lane, self.head):
+            length = len(part)
+            if start < length:
+                entries = list(part)
+                removed.extend(entries[start:stop])
+                part.clear()
+                part.extend(entries[:start] + entries[stop:])
+            start = max(0, start - length)
+            stop = max(0, stop - length)
+        if stop > start and self.root:
+            middle, after = _split(self.root, stop)
+            before, wanted = _split(middle, start)
+            removed.extend(_iter_tracks(wanted))
+            self.root = _merge(before, after)
+        return removed
+
+    def move(self, source, destination):
+        """Move the track at position source to position destination"""
+        track = self.remove(source)
+        self.insert(destination, track)
+        return track
+
+    def shuffle(self):
+        """Shuffle everything outside the play-next lane, remembering the order for unshuffle"""
+        self.version += 1
+        tracks = list(self.head) + list(_iter_tracks(self.root))
+        self._before_shuffle = list(tracks)
+        random.shuffle(tracks)
+        self.head.clear()
+        self.root = _build(tracks)
+
+    def unshuffle(self):
+        """Restore the order from before the last shuffle, returns False if there is nothing to undo"""
+        if self._before_shuffle is None:
+            return False
+        current = list(self.head) + list(_iter_tracks(self.root))
+
+        # Keep songs still queued in their old order, songs added since the shuffle go last
+        remaining = Counter(id(track) for track in current)
+        restored = []
+        for track in self._before_shuffle:
+            if remaining[id(track)]:
+                remaining[id(track)] -= 1
+                restored.append(track)
+        for track in current:
+            if remaining[id(track)]:
+                remaining[id(track)] -= 1
+                restored.append(track)
+
+        self._before_shuffle = None
+        self.version += 1
+        self.head.clear()
+        self.root = _build(restored)
+        return True
+
+    def clear(self):
+        self.version += 1
+        self.lane.clear()
+        self.head.clear()
+        self.root = None
+        self._before_shuffle = None
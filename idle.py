@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+import math
+
+# How early a timer callback may fire relative to its slot, the loop's clock is not exact
+CLOCK_SLACK = 0.01
+
+
+class TimerWheel:
+    """
+    Deadlines grouped into fixed-width slots. Scheduling and cancelling are O(1)
+    and only one loop timer is armed, for the earliest slot that still holds a key,
+    so nothing wakes up while no deadline is due.
+    """
+
+    def __init__(self, callback, resolution=1.0):
+        self.callback = callback
+        self.resolution = resolution
+        self.slots = {}  # slot number -> keys due in that slot
+        self.deadlines = {}  # key -> slot number
+        self.pending = []  # heap of slot numbers, emptied slots are skipped lazily
+        self.handle = None
+        self.armed_slot = None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def schedule(self, key, delay):
+        """Call callback(key) after delay seconds, replacing any deadline key already had"""
+        loop = asyncio.get_running_loop()
+        self.cancel(key)
+        slot = math.ceil((loop.time() + delay) / self.resolution)
+        keys = self.slots.get(slot)
+        if keys is None:
+            keys = self.slots[slot] = set()
+            heapq.heappush(self.pending, slot)
+        keys.add(key)
+        self.deadlines[key] = slot
+        if self.armed_slot is None or slot < self.armed_slot:
+            self._arm(loop)
+
+    def cancel(self, key):
+        """Drop the deadline for key, returns whether there was one"""
+        slot = self.deadlines.pop(key, None)
+        if slot is None:
+            return False
+        keys = self.slots.get(slot)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.slots[slot]
+        return True
+
+    def _arm(self, loop):
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle = self.armed_slot = None
+        while self.pending and self.pending[0] not in self.slots:
+            heapq.heappop(self.pending)
+        if self.pending:
+            self.armed_slot = self.pending[0]
+            self.handle = loop.call_at(self.armed_slot * self.resolution, self._expire, loop)
+
+    def _expire(self, loop):
+        self.handle = self.armed_slot = None
+        now = loop.time() + CLOCK_SLACK
+        while self.pending and self.pending[0] * self.resolution <= now:
+            slot = heapq.heappop(self.pending)
+            for key in self.slots.pop(slot, ()):
+                # A callback earlier in this slot may have cancelled or rescheduled it
+                if self.deadlines.get(key) != slot:
+                    continue
+                del self.deadlines[key]
+                try:
+                    self.callback(key)
+                except Exception as e:
+                    print(f"Timer callback for {key} failed: {e}")
+        if self.handle is None:
+            self._arm(loop)
+
+
+class IdleManager:
+    """
+    Decide when to leave voice, driven only by voice state updates and playback events.
+    Keeps a count of humans in every channel the bot is in and disconnects once a channel
+    has been empty for alone_timeout seconds or nothing has played for idle_timeout seconds.
+    """
+
+    def __init__(self, on_expire, alone_timeout=30, idle_timeout=300):
+        self.on_expire = on_expire  # coroutine function called with (guild_id, reason)
+        self.alone_timeout = alone_timeout
+        self.idle_timeout = idle_timeout
+        self.wheel = TimerWheel(self._expired)
+        self.bot_channels = {}  # guild_id -> voice channel id the bot is in
+        self.human_counts = {}  # voice channel id -> humans in it
+        self.tasks = set()
+
+    def joined(self, guild_id, channel):
+        """The bot connected to or moved into a channel"""
+        previous = self.bot_channels.get(guild_id)
+        if previous is not None and previous != channel.id:
+            self.human_counts.pop(previous, None)
+        if previous != channel.id:
+            # Counted once on join, voice state updates keep it current from here
+            self.human_counts[channel.id] = sum(1 for member in channel.members if not member.bot)
+        self.bot_channels[guild_id] = channel.id
+        self._check_alone(guild_id)
+        if previous is None:
+            # Nothing plays yet, a request that fails after joining must not keep the bot in voice
+            self.stopped(guild_id)
+
+    def left(self, guild_id):
+        """The bot is no longer in voice in this guild"""
+        channel_id = self.bot_channels.pop(guild_id, None)
+        if channel_id is not None:
+            self.human_counts.pop(channel_id, None)
+        self.wheel.cancel(('alone', guild_id))
+        self.wheel.cancel(('idle', guild_id))
+
+    def voice_state_update(self, member, before, after):
+        """Feed a discord on_voice_state_update event into the channel counts"""
+        before_channel = before.channel.id if before.channel else None
+        after_channel = after.channel.id if after.channel else None
+        if before_channel == after_channel:
+            return
+
+        guild = member.guild
+        if member.bot:
+            if member.id == guild.me.id:
+                if after.channel:
+                    self.joined(guild.id, after.channel)
+                else:
+                    self.left(guild.id)
+            return
+
+        if before_channel in self.human_counts:
+            self.human_counts[before_channel] = max(0, self.human_counts[before_channel] - 1)
+        if after_channel in self.human_counts:
+            self.human_counts[after_channel] += 1
+        self._check_alone(guild.id)
+
+    def playing(self, guild_id):
+        """Something started playing, the guild is no longer idle"""
+        self.wheel.cancel(('idle', guild_id))
+
+    def stopped(self, guild_id):
+        """Nothing is playing since the bot joined, or playback ended or was paused: start the idle countdown"""
+        if guild_id in self.bot_channels and self.idle_timeout > 0:
+            self.wheel.schedule(('idle', guild_id), self.idle_timeout)
+
+    def _check_alone(self, guild_id):
+        channel_id = self.bot_channels.get(guild_id)
+        if channel_id is None:
+            return
+        if self.human_counts.get(channel_id, 0) == 0:
+            if ('alone', guild_id) not in self.wheel:
+                self.wheel.schedule(('alone', guild_id), self.alone_timeout)
+        else:
+            self.wheel.cancel(('alone', guild_id))
+
+    def _expired(self, key):
+        reason, guild_id = key
+        task = asyncio.create_task(self.on_expire(guild_id, reason))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def snapshot(self):
+        """Channels being watched and disconnect deadlines pending"""
+        return {
+            'channels': len(self.bot_channels),
+            'deadlines': len(self.wheel)
+        }
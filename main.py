@@ -4,108 +4,89 @@ from dotenv import load_dotenv
 from discord import app_commands
 from music_player import MusicPlayer
 from command_handler import register_commands
-import asyncio
 
-async def auto_disconnect_task(client, music_player):
-    """Background task to periodically check for empty voice channels"""
-    await client.wait_until_ready()
-    while not client.is_closed():
-        try:
-            await music_player.check_empty_voice_channels(client)
-        except Exception as e:
-            print(f"Error in auto-disconnect task: {e}")
-        
-        # Check every 30 seconds
-        await asyncio.sleep(30)
+
 def run_bot():
     # Load environment variables
     load_dotenv()
     TOKEN = os.getenv("token")
-    GUILD_ID = os.getenv("server_id")
+    # Comma-separated guilds to register commands in, or empty to register them globally
+    GUILD_IDS = [int(guild_id) for guild_id in os.getenv("server_id", "").split(",") if guild_id.strip()]
+    # "auto" lets Discord pick the shard count, a number fixes it, unset runs a single connection
+    SHARD_COUNT = os.getenv("shard_count", "").strip().lower()
+    # Shards this instance runs when several instances split the bot, all of them if unset
+    SHARD_IDS = [int(shard_id) for shard_id in os.getenv("shard_ids", "").split(",") if shard_id.strip()]
     
-    # Set up Discord client
+    # Set up Discord client, slash commands do not need the privileged message content intent
     intents = discord.Intents.default()
-    intents.message_content = True
-    client = discord.Client(intents=intents)
+    if SHARD_COUNT:
+        client = discord.AutoShardedClient(
+            intents=intents,
+            shard_count=None if SHARD_COUNT == "auto" else int(SHARD_COUNT),
+            shard_ids=SHARD_IDS or None
+        )
+    else:
+        client = discord.Client(intents=intents)
     tree = app_commands.CommandTree(client)
     
     # Initialize music player
     music_player = MusicPlayer()
+    music_player.shards.attach(client)
     
     # Register commands with the command tree
-    register_commands(tree, client, music_player, GUILD_ID)
+    register_commands(tree, client, music_player, GUILD_IDS)
+    
+    started = False
+
+    async def start_background():
+        """Sync commands and start the process-wide monitors once, however often READY fires"""
+        nonlocal started
+        if started:
+            return
+        started = True
+        if GUILD_IDS:
+            for guild_id in GUILD_IDS:
+                await tree.sync(guild=discord.Object(id=guild_id))
+        else:
+            # Global commands can take up to an hour to show up in every guild
+            await tree.sync()
+        # Start measuring event loop lag
+        client.loop.create_task(music_player.loop_monitor.run())
+        # Report CPU cost per concurrent stream
+        client.loop.create_task(music_player.cpu_monitor.run())
+        # Serve metrics if metrics_port or metrics_textfile is configured
+        await music_player.start_exporters()
+
+    @client.event
+    async def on_shard_ready(shard_id):
+        # Only dispatched by AutoShardedClient, commands work as soon as the first shard is up
+        music_player.shards.ready(shard_id)
+        await start_background()
 
     @client.event
     async def on_ready():
-        # Sync for a single guild
-        await tree.sync(guild=discord.Object(id=GUILD_ID))
-        # For all guilds: await tree.sync()
-        print(f"{client.user} is now ready.")
-        # Start the auto-disconnect task
-        client.loop.create_task(auto_disconnect_task(client, music_player))
-        # Add this to your main bot file
+        if not SHARD_COUNT:
+            music_player.shards.ready(0)
+        print(f"{client.user} is now ready with {len(client.guilds)} guilds on {music_player.shards.shard_count} shards.")
+        await start_background()
+        # Every shard is up, so each guild in the last snapshot can be found again.
+        # This also starts renewing guild leases and, with shared state, taking over stopped instances' guilds
+        await music_player.restore_sessions(client)
 
     @client.event
     async def on_voice_state_update(member, before, after):
         """Handle voice state updates (users joining/leaving voice channels)"""
-        # Skip if this update is for a bot
-        if member.bot:
-            return
-            
-        # Check if the user left a voice channel
-        if before.channel and after.channel != before.channel:
-            # Get the guild ID
-            guild_id = before.channel.guild.id
-            
-            # Check if our bot is in this voice channel
-            if guild_id in music_player.voice_clients and music_player.voice_clients[guild_id].channel == before.channel:
-                # Count human members in the channel
-                human_members = sum(1 for m in before.channel.members if not m.bot)
-                
-                # If no human members left in the channel, disconnect
-                if human_members == 0:
-                    print(f"All users left voice channel {before.channel.name}, disconnecting...")
-                    
-                    try:
-                        # Try to send a message before disconnecting
-                        if guild_id in music_player.text_channels:
-                            text_channel = client.get_channel(music_player.text_channels[guild_id])
-                            if text_channel:
-                                await text_channel.send("Everyone paitao me :(")
-                        
-                        # Cancel any background playlist processing tasks
-                        if hasattr(music_player, 'background_tasks') and guild_id in music_player.background_tasks:
-                            try:
-                                task = music_player.background_tasks[guild_id]
-                                if not task.done() and not task.cancelled():
-                                    task.cancel()
-                                print(f"Cancelled background playlist processing for guild {guild_id}")
-                            except Exception as task_error:
-                                print(f"Error cancelling background task: {task_error}")
-                        
-                        # Stop playback if playing
-                        voice_client = music_player.voice_clients[guild_id]
-                        if voice_client.is_playing():
-                            voice_client.stop()
-                        
-                        # Disconnect from voice channel
-                        await voice_client.disconnect()
-                        
-                        # Clean up resources
-                        del music_player.voice_clients[guild_id]
-                        
-                        # Clear the queue
-                        if guild_id in music_player.queues:
-                            music_player.queues[guild_id] = []
-                            
-                        # Clear current song reference
-                        if guild_id in music_player.current_songs:
-                            del music_player.current_songs[guild_id]
-                            
-                    except Exception as e:
-                        print(f"Error disconnecting from empty voice channel: {e}")
+        # Keeps the idle manager's member counts current, it disconnects when everyone has left.
+        # The bot's own session is released if it was disconnected
+        await music_player.voice_state_update(member, before, after)
+
     # Run the client
-    client.run(TOKEN)
+    try:
+        client.run(TOKEN)
+    finally:
+        # The client has closed, stop the audio worker processes so the interpreter can exit
+        if music_player.worker_pool is not None:
+            music_player.worker_pool.shutdown()
 
 if __name__ == "__main__":
-    run_bot()
\ No newline at end of file
+    run_bot()
@@ -0,0 +1,471 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import contextvars
+import functools
+import math
+import os
+import time
+
+from aiohttp import web
+
+# Kernel clock ticks per second, used to convert /proc CPU times to seconds
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def process_cpu_seconds(pid):
+    """CPU time used so far by a child process, or None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The process name may contain spaces, so split after its closing bracket
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def open_fd_count():
+    """File descriptors open in this process, or None where /proc is unavailable"""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+class EventLoopLagMonitor:
+    """
+    Measure how late the event loop wakes up compared to when it was asked to.
+    Any blocking call on the loop shows up here as lag.
+    """
+
+    def __init__(self, interval=0.5, warn_threshold=0.25):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.samples = 0
+
+    @property
+    def average_lag(self):
+        return self.total_lag / self.samples if self.samples else 0.0
+
+    def snapshot(self):
+        """Return the current lag figures in seconds"""
+        return {
+            'last': self.last_lag,
+            'max': self.max_lag,
+            'average': self.average_lag,
+            'samples': self.samples
+        }
+
+    async def run(self):
+        """Sample loop lag forever; run this as a background task"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.samples += 1
+
+            if lag > self.warn_threshold:
+                print(f"Event loop lag of {lag * 1000:.0f}ms detected")
+
+
+class StreamCpuMonitor:
+    """
+    Report the CPU used per concurrent audio stream, split between the FFmpeg
+    children and this process, where discord.py encodes PCM to Opus.
+    """
+
+    def __init__(self, get_sources, mode, interval=30):
+        self.get_sources = get_sources
+        self.mode = mode
+        self.interval = interval
+        self.last_wall = time.monotonic()
+        self.last_process = time.process_time()
+        self.last_children = {}
+        self.last_report = None
+
+    def sample(self):
+        """Measure CPU used since the previous sample, returns None if nothing was playing"""
+        now = time.monotonic()
+        process_now = time.process_time()
+        wall = max(now - self.last_wall, 1e-6)
+        process_delta = process_now - self.last_process
+        self.last_wall, self.last_process = now, process_now
+
+        children = {}
+        ffmpeg_delta = 0.0
+        for source in self.get_sources():
+            # Sources wrapped for position tracking keep the FFmpeg source as original
+            process = getattr(getattr(source, 'original', source), '_process', None)
+            pid = getattr(process, 'pid', None)
+            # A broadcast process is shared by several streams and is only counted once
+            cpu = process_cpu_seconds(pid) if pid and pid not in children else None
+            if cpu is None:
+                continue
+            children[pid] = cpu
+            ffmpeg_delta += cpu - self.last_children.get(pid, 0.0)
+        self.last_children = children
+
+        streams = len(self.get_sources())
+        if not streams:
+            return None
+        self.last_report = {
+            'mode': self.mode,
+            'streams': streams,
+            'ffmpeg_cpu_percent_per_stream': 100 * ffmpeg_delta / wall / streams,
+            'process_cpu_percent_per_stream': 100 * process_delta / wall / streams
+        }
+        return self.last_report
+
+    async def run(self):
+        """Print a CPU report every interval while anything is playing"""
+        while True:
+            await asyncio.sleep(self.interval)
+            report = self.sample()
+            if report:
+                print(
+                    f"[{report['mode']}] {report['streams']} streams: "
+                    f"{report['ffmpeg_cpu_percent_per_stream']:.1f}% FFmpeg + "
+                    f"{report['process_cpu_percent_per_stream']:.1f}% bot CPU per stream"
+                )
+
+
+def resident_memory_bytes():
+    """Resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError, AttributeError):
+        return None
+
+
+# Default histogram buckets for latencies, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Current span of the running task, spans started inside it become its children
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Gauge:
+    """
+    Value that goes up and down, or is read from function at scrape time.
+    With labels, function returns a mapping of label values to values.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function=None, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labels = tuple(labels)
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        value = self.function() if self.function else self.value
+        if value is None:
+            return
+        if not self.labels:
+            yield self.name, "", value
+            return
+        for key, labelled in sorted(value.items()):
+            if labelled is not None:
+                key = key if isinstance(key, tuple) else (key,)
+                yield self.name, _format_labels(self.labels, key), labelled
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values = {}  # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe how long the block took"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        entry = self.values.get(tuple(labels.get(name, "") for name in self.labels))
+        return entry[2] if entry else 0
+
+    def average(self, **labels):
+        entry = self.values.get(tuple(labels.get(name, "") for name in self.labels))
+        return entry[1] / entry[2] if entry else 0.0
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, ('le', _format_value(bound))), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, key), total
+            yield f"{self.name}_count", _format_labels(self.labels, key), count
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, function=None, labels=()):
+        return self.register(Gauge(name, documentation, function, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{labels} {_format_value(value)}")
+            except Exception as e:
+                print(f"Could not collect metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class PlayerMetrics:
+    """The metrics the music player and slash commands record"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        registry = self.registry
+        self.search_seconds = registry.histogram("rextunes_search_seconds", "YouTube title search latency")
+        self.extract_seconds = registry.histogram("rextunes_extract_seconds", "yt-dlp stream extraction latency")
+        self.time_to_first_audio = registry.histogram(
+            "rextunes_time_to_first_audio_seconds", "From a play request in an idle guild to audio starting"
+        )
+        self.inter_track_gap = registry.histogram(
+            "rextunes_inter_track_gap_seconds", "Silence between one track ending and the next starting"
+        )
+        self.command_seconds = registry.histogram(
+            "rextunes_command_seconds", "Slash command handler latency", labels=('command',)
+        )
+        self.tracks_started = registry.counter("rextunes_tracks_started_total", "Tracks that started playing")
+        self.retries = registry.counter("rextunes_retries_total", "Stream extraction retries before playback")
+        self.failures = registry.counter("rextunes_failures_total", "Failed operations", labels=('stage',))
+        self.cache_requests = registry.counter(
+            "rextunes_cache_requests_total", "Search and stream cache lookups", labels=('kind', 'result')
+        )
+        self.stream_reconnects = registry.counter(
+            "rextunes_stream_reconnects_total", "Streams re-extracted and resumed after breaking off mid-song"
+        )
+        self.reconnect_seconds = registry.histogram(
+            "rextunes_reconnect_seconds", "Time to re-extract and restart a stream that broke off"
+        )
+        self.stream_stall_seconds = registry.histogram(
+            "rextunes_stream_stall_seconds", "Reads from a playing stream that blocked for longer than a frame"
+        )
+
+    def gauge(self, name, documentation, function, labels=()):
+        """Register a gauge read from player state at scrape time"""
+        return self.registry.gauge(name, documentation, function, labels)
+
+
+class Span:
+    """One timed operation in a trace"""
+
+    __slots__ = ('name', 'attributes', 'started', 'duration', 'children', 'error')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started = time.time()
+        self.duration = None
+        self.children = []
+        self.error = None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'attributes': self.attributes,
+            'started': self.started,
+            'duration_ms': self.duration * 1000 if self.duration is not None else None,
+            'error': self.error,
+            'children': [child.to_dict() for child in self.children]
+        }
+
+
+class Tracer:
+    """
+    Optional per-interaction trace spans. Spans nest through a context variable,
+    so work done for a slash command shows up under that command's span.
+    """
+
+    def __init__(self, enabled=False, keep=200):
+        self.enabled = enabled
+        self.traces = collections.deque(maxlen=keep)
+
+    @contextlib.contextmanager
+    def span(self, name, root=False, **attributes):
+        """Time a block as a span, root=True starts a new trace instead of nesting"""
+        if not self.enabled:
+            yield None
+            return
+        parent = None if root else _current_span.get()
+        span = Span(name, attributes)
+        if parent is not None:
+            parent.children.append(span)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            if parent is None:
+                self.traces.append(span)
+
+    def recent(self):
+        return [span.to_dict() for span in self.traces]
+
+
+def traced(name, root=False):
+    """Run an async method inside a span of its object's tracer"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name, root):
+                return await func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """Serves /metrics, and /traces when tracing is on, over HTTP"""
+
+    def __init__(self, registry, tracer=None, host="127.0.0.1", port=9108):
+        self.registry = registry
+        self.tracer = tracer
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def _metrics(self, request):
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def _traces(self, request):
+        return web.json_response(self.tracer.recent() if self.tracer else [])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_get("/traces", self._traces)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+class TextfileExporter:
+    """Writes the metrics to a file for node_exporter's textfile collector"""
+
+    def __init__(self, registry, path, interval=15):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+
+    def write(self, text):
+        # Write then rename so the collector never reads a half-written file
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, self.path)
+
+    async def run(self):
+        """Rewrite the file every interval; run this as a background task"""
+        while True:
+            try:
+                # Gauges read player state, so they are rendered on the loop and only the file I/O is moved off it
+                text = self.registry.render()
+                await asyncio.get_running_loop().run_in_executor(None, self.write, text)
+            except OSError as e:
+                print(f"Could not write metrics file {self.path}: {e}")
+            await asyncio.sleep(self.interval)
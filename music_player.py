@@ -2,35 +2,478 @@ import asyncio
 import json
 import discord
 import os
-import yt_dlp
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
 from youtube_search import YoutubeSearch
-from spotify import Spotify
+from spotify import Spotify, PlaylistIncomplete
+from cache import TrackCache, video_id_from_url, stream_url_ttl
+from track import Track, parse_duration, format_duration
+from guild_queue import GuildQueue
+from session import GuildSession, IDLE, STARTING, PLAYING
+from playback import TrackedSource, FRAME_SECONDS
+from broadcast import BroadcastHub
+from audio_cache import AudioFileCache, CachedOpusSource, MAX_CACHED_SECONDS
+from audio_workers import AudioWorkerPool
+from metrics import (
+    EventLoopLagMonitor, StreamCpuMonitor, PlayerMetrics, Tracer, MetricsServer, TextfileExporter,
+    open_fd_count, traced
+)
+from resolver import PlaylistResolver
+from idle import IdleManager
+from shards import ShardMonitor
+from snapshots import SessionSnapshots, SqliteStore
+from state import create_state, GuildLeases
+from extractor import ExtractorPool, ExtractorBusy
+from resilience import CircuitBreaker, CircuitOpen, Unplayable, backoff_delay, is_unplayable
+
+# Songs named in a skip summary, the rest are only counted
+SUMMARY_TITLES = 5
+
+# Why a song was not started when /skip came in while it was being looked up
+SKIPPED = "skipped"
+
+
+def skip_summary(skipped):
+    """One line naming the songs that were skipped since the last one started, with why"""
+    names = [f"{track.display_title} ({reason})" for track, reason in skipped[:SUMMARY_TITLES]]
+    if len(skipped) > SUMMARY_TITLES:
+        names.append(f"and {len(skipped) - SUMMARY_TITLES} more")
+    songs = "song" if len(skipped) == 1 else "songs"
+    return f"Skipped {len(skipped)} {songs} that couldn't be played: {', '.join(names)}"
+
+
+def incomplete_summary(error):
+    """One line saying how much of a playlist was queued before Spotify failed on a later page"""
+    total = f" of {error.total}" if error.total else ""
+    return f"⚠️ Loaded {error.loaded}{total} tracks from the playlist: Spotify error, the rest is missing."
+
+
+class PlaylistReply:
+    """The reply to a playlist /play, edited as the first song starts and more pages are queued"""
+
+    # Discord rate limits edits, so progress while pages load is shown at most this often
+    EDIT_INTERVAL = 2.0
+
+    def __init__(self, interaction, added, loading):
+        self.interaction = interaction
+        self.added = added  # Songs from the playlist waiting in the queue
+        self.loading = loading  # More pages are still being fetched
+        self.now_playing = None
+        self.status = None  # Shown instead of the song playing, e.g. while the first one is looked up
+        self.warning = None  # Shown last, e.g. when Spotify failed before the whole playlist was loaded
+        self.last_edit = 0.0
+
+    def render(self):
+        lines = []
+        if self.now_playing:
+            lines.append(f"Playing: {self.now_playing}")
+        elif self.status:
+            lines.append(self.status)
+        if self.added or self.loading:
+            lines.append(f"Added {self.added} songs to the queue.")
+        if self.loading:
+            lines.append("Loading the rest in the background...")
+        if self.warning:
+            lines.append(self.warning)
+        return "\n".join(lines)
+
+    async def update(self, force=True):
+        """Edit the reply to the current state, returns whether it was edited"""
+        now = time.perf_counter()
+        if not force and now - self.last_edit < self.EDIT_INTERVAL:
+            return False
+        self.last_edit = now
+        try:
+            await self.interaction.edit_original_response(content=self.render())
+            return True
+        except Exception as e:
+            # Interaction tokens expire after 15 minutes
+            print(f"Could not update playlist reply: {e}")
+            return False
+
 
 class MusicPlayer:
     def __init__(self):
-        self.queues = {}
-        self.voice_clients = {}
-        self.current_songs = {}  # Track currently playing songs
-        self.text_channels = {} # Track text channels 
-        self.background_tasks = {} # Track background playlist processing tasks
+        self.sessions = {}  # GuildSession per guild, holding its queue, voice client and tasks
+
+        # Number of upcoming queue entries to resolve while the current song plays
+        self.prefetch_depth = int(os.getenv("prefetch_depth", 2))
+
+        # One circuit breaker per upstream pauses background work while it keeps failing, /play still goes through
+        self.breakers = {
+            name: CircuitBreaker(
+                name,
+                failure_rate=float(os.getenv("breaker_failure_rate", 0.5)),
+                cooldown=float(os.getenv("breaker_cooldown", 30))
+            )
+            for name in ('search', 'extract', 'spotify')
+        }
 
         spot_id = os.getenv("spot_id")
         spot_secret = os.getenv("spot_secret")
-        self.sp = Spotify(spot_secret, spot_id)
+        self.sp = Spotify(spot_secret, spot_id, self.breakers['spotify'])
+        
+        # YouTube title search is blocking, so it runs on its own bounded thread pool
+        search_workers = int(os.getenv("search_workers", 4))
+        self.search_executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="yt-search")
+        self.search_semaphore = asyncio.Semaphore(search_workers)
+        self.search_timeout = float(os.getenv("search_timeout", 10))
+        
+        # Looks up queued Spotify tracks on YouTube as they near the front, shared by all guilds
+        self.resolver = PlaylistResolver(
+            self.search_youtube,
+            rate=float(os.getenv("resolver_rate", 5)),
+            breaker=self.breakers['search']
+        )
+        
+        # Tracks how long blocking work stalls the event loop
+        self.loop_monitor = EventLoopLagMonitor()
+        
+        # Leaves voice once everyone is gone or nothing has played for a while
+        self.idle = IdleManager(
+            self._idle_disconnect,
+            alone_timeout=float(os.getenv("alone_timeout", 30)),
+            idle_timeout=float(os.getenv("idle_timeout", 300))
+        )
+        
+        # Playback mode: "pcm" decodes in FFmpeg and encodes to Opus in Python,
+        # "opus" has FFmpeg output Opus directly, copying the stream untouched when volume is 1
+        self.audio_mode = os.getenv("audio_mode", "pcm").lower()
+        self.volume = float(os.getenv("volume", 0.25))
+        self.opus_bitrate = int(os.getenv("opus_bitrate", 96))
+        self.audio_workers = int(os.getenv("audio_workers", 0))
+        # Times a track that breaks off mid-song is re-extracted and resumed before it is skipped
+        self.max_reconnects = int(os.getenv("max_reconnects", 3))
+        # Songs skipped one after another before the player stops and waits for /skip
+        self.max_failures_in_a_row = int(os.getenv("max_failures_in_a_row", 10))
         
         # YT-DLP configuration
+        audio_format = "bestaudio[abr<=96]/bestaudio"
+        if self.audio_mode == "opus" or self.audio_workers > 0:
+            # Prefer YouTube's Opus/WebM formats so FFmpeg can pass them straight through
+            audio_format = "bestaudio[acodec=opus][abr<=160]/" + audio_format
         self.yt_dlp_options = {
-            "format": "bestaudio[abr<=96]/bestaudio",
+            "format": audio_format,
             "noplaylist": True,
             "youtube_include_dash_manifest": False,
             "youtube_include_hls_manifest": False,
         }
-        self.ytdl = yt_dlp.YoutubeDL(self.yt_dlp_options)
+        # yt-dlp keeps player JS and signature functions in cachedir, so they survive restarts
+        cache_dir = os.getenv("ytdl_cache_dir")
+        if cache_dir:
+            self.yt_dlp_options["cachedir"] = cache_dir
+        self.extractors = ExtractorPool(
+            self.yt_dlp_options,
+            size=int(os.getenv("extractor_workers", 4)),
+            max_pending=int(os.getenv("extractor_max_pending", 32)),
+            warmup_url=os.getenv("extractor_warmup_url", "https://www.youtube.com/watch?v=BaW_jenozKc")
+        )
+        
+        # Shared state lets several instances split guilds, each leasing the guilds it plays in
+        self.state = create_state(os.getenv("state_backend", "memory").lower(), os.getenv("redis_url"))
+        self.leases = GuildLeases(
+            self.state,
+            os.getenv("instance_id") or f"{socket.gethostname()}-{os.getpid()}",
+            float(os.getenv("lease_ttl", 30))
+        )
+        self.state_task = None
+        
+        # Cache search results and stream URLs, optionally shared through Redis
+        self.cache = TrackCache(
+            max_size=int(os.getenv("cache_size", 2048)),
+            redis_url=os.getenv("redis_url"),
+            remote=self.state if self.state.shared else None
+        )
         
         # FFmpeg options
         self.ffmpeg_options = {
             'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 15 -timeout 10000000',
-            'options': '-vn -filter:a "volume=0.25"'
+            'options': f'-vn -filter:a "volume={self.volume}"'
+        }
+        
+        # Optionally run FFmpeg and Opus packet reads in worker processes, one fixed worker per guild
+        self.worker_pool = AudioWorkerPool(self.audio_workers) if self.audio_workers > 0 else None
+        
+        # Optionally share one FFmpeg process between guilds that start the same track close together
+        self.broadcasts = None
+        if os.getenv("broadcast", "false").lower() == "true":
+            if self.audio_mode == "opus" or self.audio_workers > 0:
+                self.broadcasts = BroadcastHub(int(float(os.getenv("broadcast_buffer_seconds", 30)) / FRAME_SECONDS))
+            else:
+                # discord.py would still encode PCM frames once per listening guild
+                print("Broadcast mode needs audio_mode=opus or audio_workers, playing every guild on its own stream")
+        
+        # Optionally keep the Opus packets of played tracks on disk, so repeats skip extraction and FFmpeg
+        audio_cache_dir = os.getenv("audio_cache_dir")
+        self.audio_cache = AudioFileCache(
+            audio_cache_dir,
+            int(os.getenv("audio_cache_size_mb", 1024)) * 1024 * 1024
+        ) if audio_cache_dir else None
+        if self.audio_cache is not None and self.audio_mode != "opus" and self.audio_workers <= 0:
+            # Only Opus packets from FFmpeg can be stored, discord.py encodes PCM frames itself
+            print("The audio cache needs audio_mode=opus or audio_workers, tracks played now are not cached")
+
+        # Reports CPU spent per concurrent stream so playback modes can be compared
+        self.cpu_monitor = StreamCpuMonitor(
+            lambda: [session.active_source for session in self.sessions.values() if session.active_source],
+            self.audio_mode
+        )
+        
+        # Prometheus-style metrics, served over HTTP and/or written to a textfile once the bot is ready
+        self.metrics = PlayerMetrics()
+        self.tracer = Tracer(enabled=os.getenv("trace", "false").lower() == "true")
+        self.metrics.gauge("rextunes_active_guilds", "Guilds with a voice connection",
+                           lambda: sum(1 for session in self.sessions.values() if session.voice_client))
+        self.metrics.gauge("rextunes_queued_tracks", "Tracks waiting in all queues",
+                           lambda: sum(len(session.queue) for session in self.sessions.values()))
+        self.metrics.gauge("rextunes_longest_queue", "Tracks waiting in the longest queue",
+                           lambda: max((len(session.queue) for session in self.sessions.values()), default=0))
+        self.metrics.gauge("rextunes_event_loop_lag_seconds", "Most recent event loop lag sample",
+                           lambda: self.loop_monitor.last_lag)
+        self.metrics.gauge("rextunes_extractor_queue_depth", "Stream extractions waiting for a worker",
+                           lambda: self.extractors.queue_depth)
+        self.metrics.gauge("rextunes_extractor_in_flight", "Stream extractions running on a worker",
+                           lambda: self.extractors.in_flight)
+        self.metrics.gauge("rextunes_extractor_rejected", "Stream extractions turned away because too many were waiting",
+                           lambda: self.extractors.rejected)
+        self.metrics.gauge("rextunes_resolver_in_flight", "Queued Spotify tracks being looked up on YouTube",
+                           lambda: self.resolver.in_flight)
+        self.metrics.gauge("rextunes_resolver_lookups", "Queued Spotify tracks looked up on YouTube, by whether one matched",
+                           lambda: {'matched': self.resolver.matched, 'unmatched': self.resolver.unmatched}, labels=('result',))
+        self.metrics.gauge("rextunes_ffmpeg_processes", "FFmpeg processes owned by guild sessions, including ones in audio workers",
+                           self.ffmpeg_process_count)
+        self.metrics.gauge("rextunes_open_fds", "Open file descriptors", open_fd_count)
+        self.metrics.gauge("rextunes_idle_watched_channels", "Voice channels the bot is in and counts members of",
+                           lambda: self.idle.snapshot()['channels'])
+        self.metrics.gauge("rextunes_idle_pending_disconnects", "Guilds that leave voice when their alone or idle timer runs out",
+                           lambda: self.idle.snapshot()['deadlines'])
+        self.metrics.gauge("rextunes_circuit_breaker_state", "Upstream circuit breakers, 0 closed, 1 half-open, 2 open",
+                           lambda: {name: breaker.state for name, breaker in self.breakers.items()}, labels=('breaker',))
+        self.metrics.gauge("rextunes_circuit_breaker_trips", "Times each circuit breaker opened",
+                           lambda: {name: breaker.trips for name, breaker in self.breakers.items()}, labels=('breaker',))
+        
+        # Per-shard startup and load figures, main.py attaches the client once it exists
+        self.shards = ShardMonitor()
+        self.metrics.gauge("rextunes_shard_guilds", "Guilds served by each shard",
+                           self.shards.guild_counts, labels=('shard',))
+        self.metrics.gauge("rextunes_shard_voice_sessions", "Guilds with a voice connection on each shard",
+                           self.voice_sessions_per_shard, labels=('shard',))
+        self.metrics.gauge("rextunes_shard_ready_seconds", "Seconds from launch until each shard was ready",
+                           lambda: self.shards.ready_seconds, labels=('shard',))
+        self.metrics.gauge("rextunes_shard_memory_bytes", "Resident memory gained while each shard connected",
+                           lambda: self.shards.memory_bytes, labels=('shard',))
+        self.metrics.gauge("rextunes_shard_latency_seconds", "Gateway heartbeat latency of each shard",
+                           self.shards.latencies, labels=('shard',))
+        self.metrics.gauge("rextunes_shard_reconnects", "New gateway sessions each shard started after its first",
+                           lambda: dict(self.shards.reconnects), labels=('shard',))
+        if self.broadcasts is not None:
+            self.metrics.gauge("rextunes_broadcasts", "Tracks being broadcast",
+                               lambda: self.broadcasts.snapshot()['broadcasts'])
+            self.metrics.gauge("rextunes_broadcast_listeners", "Guilds listening to a broadcast",
+                               lambda: self.broadcasts.snapshot()['listeners'])
+        if self.worker_pool is not None:
+            self.metrics.gauge("rextunes_audio_worker_streams", "Streams each audio worker process is playing",
+                               lambda: dict(enumerate(self.worker_pool.stream_counts())), labels=('worker',))
+        if self.audio_cache is not None:
+            self.metrics.gauge("rextunes_audio_cache_bytes", "Bytes of Opus audio cached on disk",
+                               lambda: self.audio_cache.snapshot()['bytes'])
+            self.metrics.gauge("rextunes_audio_cache_files", "Tracks cached on disk",
+                               lambda: self.audio_cache.snapshot()['files'])
+            self.metrics.gauge("rextunes_audio_cache_recording", "Tracks being written to the audio cache as they play",
+                               lambda: self.audio_cache.snapshot()['recording'])
+        self.metrics.gauge("rextunes_guild_leases", "Guilds leased to this instance",
+                           lambda: len(self.leases.held))
+        self.metrics.gauge("rextunes_guild_leases_lost", "Guild leases taken over by another instance",
+                           lambda: self.leases.lost)
+        self.exporters_started = False
+        
+        # Optionally snapshot every guild's queue and position, so a restart picks up where it stopped.
+        # A shared state backend always holds them, so another instance can take a guild over
+        snapshot_path = os.getenv("snapshot_path")
+        snapshot_store = self.state if self.state.shared else SqliteStore(snapshot_path) if snapshot_path else None
+        self.snapshots = SessionSnapshots(
+            snapshot_store,
+            float(os.getenv("snapshot_interval", 15))
+        ) if snapshot_store else None
+        self.snapshot_task = None
+        self.extracting = {}  # video id -> extraction in flight
+
+    async def start_exporters(self):
+        """Start the configured metrics endpoint and textfile exporter, only once"""
+        if self.exporters_started:
+            return
+        self.exporters_started = True
+        port = os.getenv("metrics_port")
+        if port:
+            server = MetricsServer(self.metrics.registry, self.tracer, os.getenv("metrics_host", "127.0.0.1"), int(port))
+            try:
+                await server.start()
+            except OSError as e:
+                print(f"Could not start metrics server: {e}")
+        path = os.getenv("metrics_textfile")
+        if path:
+            exporter = TextfileExporter(self.metrics.registry, path, float(os.getenv("metrics_textfile_interval", 15)))
+            asyncio.create_task(exporter.run())
+
+    async def restore_sessions(self, client):
+        """Take over the guilds from the last snapshot and carry on playing, then keep snapshotting"""
+        if self.state_task is not None:
+            return
+        if self.snapshots is not None:
+            await self._take_over(client)
+            self.snapshot_task = asyncio.create_task(self.snapshots.run(lambda: self.sessions))
+        self.state_task = asyncio.create_task(self._watch_leases(client))
+
+    async def _take_over(self, client):
+        """Lease and restore the saved sessions no other instance is playing"""
+        try:
+            guild_ids = await self.snapshots.store.guilds()
+            if self.state.shared:
+                # Guilds on other instances' shards are theirs to restore
+                guild_ids = [guild_id for guild_id in guild_ids if client.get_guild(guild_id) is not None]
+            guild_ids = [guild_id for guild_id in guild_ids if guild_id not in self.sessions]
+            claimed = await asyncio.gather(*(self.leases.claim(guild_id) for guild_id in guild_ids))
+            guild_ids = [guild_id for guild_id, ok in zip(guild_ids, claimed) if ok]
+            saved_sessions = await self.snapshots.load(guild_ids if self.state.shared else None)
+        except Exception as e:
+            print(f"Could not load saved sessions: {e}")
+            return
+
+        # Voice connections are opened a few at a time
+        semaphore = asyncio.Semaphore(8)
+
+        async def restore(saved):
+            async with semaphore:
+                try:
+                    restored = await self._restore_session(client, saved)
+                except Exception as e:
+                    print(f"Could not restore guild {saved.guild_id}: {e}")
+                    restored = False
+                if not restored and saved.guild_id not in self.sessions:
+                    await self.leases.release(saved.guild_id)
+                return restored
+
+        if saved_sessions:
+            restored = await asyncio.gather(*(restore(saved) for saved in saved_sessions))
+            print(f"Restored {sum(restored)} of {len(saved_sessions)} sessions from {self.snapshots.store.name}")
+
+    async def _watch_leases(self, client):
+        """Keep this instance's leases alive, leave guilds taken over elsewhere and pick up orphaned ones"""
+        while True:
+            await asyncio.sleep(self.leases.ttl / 3)
+            try:
+                active = {guild_id for guild_id, session in self.sessions.items() if session.voice_client}
+                for guild_id in await self.leases.renew(active):
+                    print(f"Another instance took over guild {guild_id}, leaving it")
+                    await self._hand_over(guild_id)
+                if self.state.shared and self.snapshots is not None:
+                    # Sessions of an instance that stopped renewing become free once its leases expire
+                    await self._take_over(client)
+            except Exception as e:
+                print(f"Lease upkeep failed: {e}")
+
+    async def _hand_over(self, guild_id):
+        """Drop a guild another instance now owns, leaving its saved session and voice connection alone"""
+        self.idle.left(guild_id)
+        if self.snapshots is not None:
+            await self.snapshots.forget(guild_id, stored=False)
+        session = self.sessions.pop(guild_id, None)
+        if session:
+            await session.close(disconnect=False)
+
+    async def claim_guild(self, guild_id):
+        """Lease a guild before playing in it, False if another instance is already playing there"""
+        return await self.leases.claim(guild_id)
+
+    async def _restore_session(self, client, saved):
+        """Rebuild one guild's session from a SavedSession, using the stored metadata as it is"""
+        guild = client.get_guild(saved.guild_id)
+        channel = guild.get_channel(saved.voice_channel_id) if guild else None
+        if channel is None:
+            return False
+        session = self.sessions.get(saved.guild_id)
+        if session is not None and session.voice_client is not None:
+            # Someone started playing here since the bot came back
+            return False
+        # Connect first, so a failed connection leaves no session behind holding the queue and lease
+        voice_client = await channel.connect()
+        session = self.get_session(saved.guild_id)
+        if session.text_channel_id is None:
+            session.text_channel_id = saved.text_channel_id
+        session.queue.extend(saved.queue)
+        session.voice_client = voice_client
+        self.idle.joined(saved.guild_id, channel)
+
+        track = saved.current_song
+        if track is not None and track.resolved:
+            try:
+                # Only the stream URL is fetched again, the track itself is already matched
+                data = {}
+                player = self._cached_source(track, start_at=saved.position)
+                if player is None:
+                    data = await self.extract_stream(track.url)
+                    if not data or 'url' not in data:
+                        raise ValueError("no stream URL found")
+                    player = self.create_source(data, saved.guild_id, start_at=saved.position)
+            except Exception as e:
+                print(f"Could not resume {track.display_title}: {e}")
+                await self.play_next(saved.guild_id, client.loop, client)
+                return True
+            session.current_song = track
+            self._start_playback(session, track, player, client.loop, client, start_at=saved.position, duration=data.get('duration'))
+            if saved.paused:
+                session.voice_client.pause()
+                self.idle.stopped(saved.guild_id)
+            self.schedule_prefetch(saved.guild_id)
+            text_channel = guild.get_channel(session.text_channel_id) if session.text_channel_id else None
+            if text_channel:
+                try:
+                    await text_channel.send(f"I'm back! Carrying on with {track.display_title} from {format_duration(saved.position)}.")
+                except Exception as e:
+                    print(f"Could not announce restored session: {e}")
+        elif session.queue:
+            await self.play_next(saved.guild_id, client.loop, client)
+        return True
+
+    def voice_sessions_per_shard(self):
+        """Guilds with a voice connection, counted per shard"""
+        counts = {}
+        for guild_id, session in self.sessions.items():
+            if session.voice_client:
+                shard_id = self.shards.shard_for(guild_id)
+                counts[shard_id] = counts.get(shard_id, 0) + 1
+        return counts
+
+    def get_session(self, guild_id):
+        """Return the GuildSession for a guild, creating it if needed"""
+        session = self.sessions.get(guild_id)
+        if session is None:
+            session = self.sessions[guild_id] = GuildSession(guild_id)
+        return session
+
+    def get_voice_client(self, guild_id):
+        """Return the guild's voice client, or None if the bot is not in voice there"""
+        session = self.sessions.get(guild_id)
+        return session.voice_client if session else None
+
+    def ffmpeg_process_count(self):
+        """Running FFmpeg processes, counting ones shared by broadcast listeners once"""
+        processes = set()
+        for session in self.sessions.values():
+            processes.update(session.processes())
+        # Worker-backed sources have no process in the bot, each stream runs one FFmpeg in its worker
+        streams = sum(self.worker_pool.stream_counts()) if self.worker_pool is not None else 0
+        return len(processes) + streams
+
+    def resource_counts(self):
+        """Live sessions, tasks and FFmpeg processes, for spotting leaks on long-running bots"""
+        return {
+            'sessions': len(self.sessions),
+            'session_tasks': sum(session.task_count() for session in self.sessions.values()),
+            'ffmpeg_processes': self.ffmpeg_process_count(),
+            'loop_tasks': len(asyncio.all_tasks()),
+            'open_fds': open_fd_count()
         }
     
     async def connect_to_voice(self, interaction):
@@ -44,486 +487,1171 @@ class MusicPlayer:
             voice_channel = interaction.client.get_channel(voice_client_id)
             
             guild_id = interaction.guild_id
+            session = self.get_session(guild_id)
             
             # If already connected to a different channel, move to the new one
-            if guild_id in self.voice_clients:
+            if session.voice_client and session.voice_client.is_connected():
                 # If already in the right channel, we're good
-                if self.voice_clients[guild_id].channel.id == voice_client_id:
+                if session.voice_client.channel.id == voice_client_id:
                     return True
-                # Otherwise, disconnect to reconnect to the new channel    
-                await self.voice_clients[guild_id].disconnect()
+                # Moving keeps the connection, so the bot is never seen leaving voice
+                await session.voice_client.move_to(voice_channel)
+                self.idle.joined(guild_id, voice_channel)
+                return True
+            if session.voice_client:
+                # A connection that dropped without a voice state update, clear it before connecting again
+                await session.voice_client.disconnect(force=True)
                 
             # Connect to the voice channel
-            voice_client = await voice_channel.connect()
-            self.voice_clients[guild_id] = voice_client
+            session.voice_client = await voice_channel.connect()
+            self.idle.joined(guild_id, voice_channel)
             return True
             
         except Exception as e:
             print(f"Voice connection error: {e}")
             return False
     
+    @traced("search_youtube")
     async def search_youtube(self, search_term):
-        """Search YouTube for a song"""
+        """Search YouTube for a song and return it as a Track, or None if nothing was found"""
         if not search_term:
-            return None, None
+            return None
             
         try:
             if search_term.startswith("https://www.youtube.com/watch?v="):
                 # Direct URL provided
                 song_url = search_term
                 try:
-                    loop = asyncio.get_event_loop()
-                    data = await loop.run_in_executor(None, lambda: self.ytdl.extract_info(song_url, download=False))
-                    title = data.get('title', song_url)
-                    return song_url, title
+                    data = await self.extract_stream(song_url)
+                    return Track(song_url, data.get('title', song_url), data.get('duration'))
+                except ExtractorBusy:
+                    raise
                 except Exception as e:
                     print(f"Error extracting info from URL: {e}")
-                    return None, None
+                    return None
             else:
                 # Search by title
                 try:
-                    yt = YoutubeSearch(search_term, max_results=1).to_json()
-                    search_results = json.loads(yt)['videos']
+                    cached = await self.cache.get_search(search_term)
+                    self.metrics.cache_requests.inc(kind='search', result='hit' if cached else 'miss')
+                    if cached:
+                        return Track(f"https://www.youtube.com/watch?v={cached['id']}", cached['title'], cached.get('duration'))
+                    # Searches that recently found nothing are not repeated
+                    if await self.cache.get_no_match(search_term):
+                        self.metrics.cache_requests.inc(kind='no_match', result='hit')
+                        return None
+                    
+                    search_results = await self._run_search(search_term)
                     
                     if not search_results:
-                        return None, None
+                        await self.cache.set_no_match(search_term)
+                        return None
                         
                     song_id = str(search_results[0]['id'])
                     song_url = f"https://www.youtube.com/watch?v={song_id}"
                     title = search_results[0]['title']
-                    return song_url, title
+                    duration = parse_duration(search_results[0].get('duration'))
+                    await self.cache.set_search(search_term, {
+                        'id': song_id,
+                        'title': title,
+                        'duration': duration
+                    })
+                    return Track(song_url, title, duration)
+                except asyncio.TimeoutError:
+                    print(f"YouTube search timed out after {self.search_timeout}s: {search_term}")
+                    self.metrics.failures.inc(stage='search')
+                    return None
                 except Exception as e:
                     print(f"YouTube search error: {e}")
-                    return None, None
+                    self.metrics.failures.inc(stage='search')
+                    return None
+        except ExtractorBusy:
+            raise
         except Exception as e:
             print(f"Search YouTube error: {e}")
-            return None, None
+            return None
             
+    async def _run_search(self, search_term):
+        """
+        Run a YouTube title search on the search executor without blocking the event loop.
+        Waiting for a free slot counts towards search_timeout. The thread of a search that timed out
+        keeps running until its own request timeout, so its slot is only freed once it is done.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.search_timeout
+        with self.metrics.search_seconds.time():
+            await asyncio.wait_for(self.search_semaphore.acquire(), timeout=self.search_timeout)
+            try:
+                future = self.search_executor.submit(
+                    lambda: YoutubeSearch(search_term, max_results=1, retries=1, timeout=self.search_timeout).to_json()
+                )
+            except Exception:
+                self.search_semaphore.release()
+                raise
+            future.add_done_callback(lambda done: loop.call_soon_threadsafe(self._search_finished, done))
+            yt = await asyncio.wait_for(asyncio.wrap_future(future), timeout=max(0, deadline - loop.time()))
+        return json.loads(yt)['videos']
+
+    def _search_finished(self, future):
+        """
+        Free the slot of a search thread and tell the search breaker how YouTube answered.
+        Only the search call itself counts, waiting for a slot or giving up on a slow one is local congestion.
+        """
+        self.search_semaphore.release()
+        if not future.cancelled():
+            self.breakers['search'].record(future.exception() is None)
+
+    @traced("extract_stream")
+    async def extract_stream(self, song_url, interactive=True):
+        """
+        Resolve a YouTube URL to its stream URL and metadata, reusing cached results.
+        Raises ExtractorBusy when the extractor pool is full and Unplayable for videos known not to play.
+        Background callers pass interactive=False and get CircuitOpen while extraction keeps failing.
+        """
+        video_id = video_id_from_url(song_url)
+        cached = await self.cache.get_stream(video_id)
+        self.metrics.cache_requests.inc(kind='stream', result='hit' if cached else 'miss')
+        if cached:
+            return cached
+        reason = await self.cache.get_unplayable(video_id)
+        if reason:
+            self.metrics.cache_requests.inc(kind='unplayable', result='hit')
+            raise Unplayable(reason)
+
+        # Guilds asking for the same video at once share a single extraction
+        pending = self.extracting.get(video_id)
+        if pending is None:
+            if not interactive and not self.breakers['extract'].allow():
+                raise CircuitOpen("stream extraction is failing, background extractions are paused")
+            pending = asyncio.ensure_future(self._extract(song_url, video_id, interactive))
+            self.extracting[video_id] = pending
+            pending.add_done_callback(lambda _: self.extracting.pop(video_id, None))
+        # Shielded so one caller giving up does not cancel it for the others
+        return await asyncio.shield(pending)
+
+    async def _extract(self, song_url, video_id, interactive):
+        """Run a stream extraction and cache the fields playback needs"""
+        breaker = self.breakers['extract']
+        try:
+            with self.metrics.extract_seconds.time():
+                data = await self.extractors.extract(song_url, interactive)
+        except ExtractorBusy:
+            self.metrics.failures.inc(stage='extract')
+            raise
+        except Exception as e:
+            self.metrics.failures.inc(stage='extract')
+            if is_unplayable(e):
+                # YouTube answered, it is this video that cannot be played
+                breaker.record(True)
+                await self.cache.set_unplayable(video_id, str(e))
+                raise Unplayable(str(e)) from e
+            breaker.record(False)
+            raise
+        breaker.record(True)
+        if not data or 'url' not in data:
+            return None
+
+        # Keep only what playback needs, the full extractor result is large
+        info = {
+            'id': data.get('id', video_id),
+            'url': data['url'],
+            'title': data.get('title', song_url),
+            'duration': parse_duration(data.get('duration')),
+            'acodec': data.get('acodec')
+        }
+        await self.cache.set_stream(info['id'], info)
+        return info
+
     async def play_playlist(self, interaction, playlist_url):
-        """Play or add songs from a playlist using batch processing"""
+        """
+        Play or add songs from a Spotify playlist, album or track using batch processing.
+        Replies as soon as the first page is queued and edits the reply as playback starts
+        and the remaining pages load, so it returns (True, None) once it has replied.
+        """
+        requested_at = time.perf_counter()
         guild_id = interaction.guild_id
-        
-        # Initialize queue if it doesn't exist
-        if guild_id not in self.queues:
-            self.queues[guild_id] = []
-        if guild_id not in self.text_channels:
-            self.text_channels[guild_id] = interaction.channel_id
+        session = self.get_session(guild_id)
+        if session.text_channel_id is None:
+            session.text_channel_id = interaction.channel_id
+        idle = False
+        starter = None
             
         try:
-            # Get playlist info in List([track_name, artist_name])
-            playlist_info = self.sp.get_playlist_info(playlist_url)
-            
-            if not playlist_info:
-                return False, "Couldn't find or access that playlist!"
-            
-            # Define batch size for initial loading
-            initial_batch_size = 5
+            # Stream [track_name, artist, seconds] page by page
+            songs = self.sp.iter_tracks(playlist_url)
+            requester = interaction.user.display_name
             
-            # Process first batch to start playback quickly
-            first_batch = playlist_info[:initial_batch_size]
-            remaining_songs = playlist_info[initial_batch_size:]
-            
-            # Process first batch
-            added_songs = []
-            for song in first_batch:
-                # Form search query - song name + artist name
-                search_query = f"{song[0]} {song[1]['name']}"
-                song_url, title = await self.search_youtube(search_query)
-                
-                if not song_url:
-                    continue
-                    
-                added_songs.append((song_url, title))
+            # Queue the first page straight away, tracks are only searched on YouTube as they near the front
+            initial_batch_size = 100
+            first_batch = []
+            incomplete = None
+            try:
+                async for name, artist, duration in songs:
+                    first_batch.append(Track.unresolved(name, artist['name'], duration, requester))
+                    if len(first_batch) >= initial_batch_size:
+                        break
+            except PlaylistIncomplete as e:
+                # The first page had few playable tracks and the next one failed, play what there is
+                incomplete = e
             
-            if not added_songs:
-                return False, "Couldn't find any songs from that playlist!"
+            if not first_batch:
+                return False, "Couldn't find or access that playlist!"
             
-            # Start a background task to process remaining songs
-            asyncio.create_task(self._process_remaining_playlist_songs(
-                remaining_songs, 
-                guild_id, 
-                interaction.client
-            ))
+            more_pending = incomplete is None and len(first_batch) >= initial_batch_size
+            reply = PlaylistReply(interaction, len(first_batch), more_pending)
+            if incomplete is not None:
+                reply.warning = incomplete_summary(incomplete)
+            session.queue.extend(first_batch)
             
             # Check if already playing music
-            if guild_id in self.voice_clients and self.voice_clients[guild_id].is_playing():
-                # Add first batch songs to queue
-                for song_url, title in added_songs:
-                    self.queues[guild_id].append(song_url)
-                    
-                return True, f"Added {len(added_songs)} songs from the playlist to queue. Processing {len(remaining_songs)} more songs in the background..."
+            idle = not session.busy
+            if idle:
+                # Claimed before the first await, so requests arriving meanwhile queue behind the playlist
+                session.state = STARTING
+                reply.status = "Finding the first song..."
             else:
-                # Play first song immediately
-                first_song_url, first_title = added_songs[0]
-                
-                # Add remaining songs from first batch to queue
-                for song_url, title in added_songs[1:]:
-                    self.queues[guild_id].append(song_url)
-                
-                # Play first song
-                await self.play_immediate(guild_id, first_song_url, interaction.client)
-                
-                return True, f"Playing: {first_title}\nAdded {len(added_songs) - 1} songs to the queue. Processing {len(remaining_songs)} more songs in the background..."
+                self.schedule_prefetch(guild_id)
+            await interaction.followup.send(reply.render())
+            
+            # Start the first song and keep queueing the remaining pages in the background, both edit the reply
+            if idle:
+                starter = session.spawn(self._start_playlist(session, interaction, reply, first_batch, requested_at))
+            if more_pending:
+                session.background_task = session.spawn(self._process_remaining_playlist_songs(
+                    songs, 
+                    session, 
+                    interaction.client,
+                    requester,
+                    reply
+                ))
+            return True, None
                 
         except Exception as e:
             print(f"Error in play_playlist function: {e}")
+            if idle and starter is None and session.state == STARTING:
+                # Nothing will start the playlist, give the guild back
+                session.state = IDLE
+                self._carry_on(session, interaction.client)
             return False, f"Error playing the playlist: {str(e)}"
 
-    async def _process_remaining_playlist_songs(self, remaining_songs, guild_id, client):
-        """Process remaining playlist songs in background"""
+    @traced("start_playlist", root=True)
+    async def _start_playlist(self, session, interaction, reply, first_batch, requested_at):
+        """
+        Play the first song of a freshly queued playlist that YouTube can match.
+        play_playlist marked the guild STARTING, it is handed on to play_immediate or set back to IDLE.
+        """
+        guild_id = session.guild_id
+        client = interaction.client
+        # The first track usually matches on its own, only when it does not are the next few looked up at once
+        width = 1
+        position = 0
+        first_track = None
+        lookups = []
+        handed_off = False
         try:
-            # Get reference to text channel for status updates
-            text_channel = None
-            if guild_id in self.text_channels:
-                channel_id = self.text_channels[guild_id]
-                text_channel = client.get_channel(channel_id)
+            while first_track is None and position < len(first_batch) and not session.closed:
+                # The earliest track of the batch that YouTube matches plays first, wherever the batch sits in the queue
+                head = first_batch[position:position + width]
+                position += len(head)
+                lookups = [
+                    session.spawn(self.resolver.resolve_track(track, interactive=True))
+                    for track in head
+                ]
+                skipped = []
+                for track, lookup in zip(head, lookups):
+                    if await lookup:
+                        first_track = track
+                        break
+                    skipped.append(track)
+                # Tracks without a match are dropped, later lookups carry on for the look-ahead window
+                reply.added -= session.queue.discard(skipped)
+                if first_track is not None:
+                    if session.queue.discard([first_track]):
+                        reply.added -= 1
+                    else:
+                        # Removed from the queue while it was looked up, try the next one
+                        first_track = None
+                width = self.prefetch_depth + 1
             
-            # Process songs in smaller batches to avoid overwhelming resources
-            batch_size = 10
-            total_remaining = len(remaining_songs)
-            processed_count = 0
-            is_cancelled = False
+            if session.closed:
+                return
+            if first_track is None:
+                reply.status = "Couldn't find any songs from that playlist!"
+            else:
+                reply.now_playing = first_track.display_title
+                # play_immediate marks the guild STARTING again before its first await
+                handed_off = True
+                session.state = IDLE
+                if await self.play_immediate(guild_id, first_track, client):
+                    self.metrics.time_to_first_audio.observe(time.perf_counter() - requested_at)
+                    # Let the lookups still running finish so the look-ahead does not search them again
+                    await asyncio.gather(*lookups, return_exceptions=True)
+                    self.schedule_prefetch(guild_id)
+                else:
+                    # The first song failed to start, carry on with the next one
+                    await self.play_next(guild_id, client.loop, client)
+                    current = session.current_song
+                    reply.now_playing = current.display_title if current else None
+                    reply.added = len(session.queue)
+        except ExtractorBusy:
+            # Nothing is left queued when the extractors are too busy to start the playlist
+            if session.background_task is not None:
+                session.background_task.cancel()
+                session.background_task = None
+            session.queue.discard(first_batch)
+            reply.now_playing = None
+            reply.added = 0
+            reply.loading = False
+            reply.status = "I'm busy loading other songs right now, please try again in a moment!"
+        finally:
+            if not handed_off and session.state == STARTING:
+                session.state = IDLE
+                session.skip_pending = False
+                if session.advance_waiters:
+                    session.advance.set()
+                # Play what other requests queued while the playlist was looked up
+                self._carry_on(session, client)
+        await reply.update()
+
+    @traced("process_remaining_playlist_songs")
+    async def _process_remaining_playlist_songs(self, remaining_songs, session, client, requester=None, reply=None):
+        """
+        Queue the rest of a playlist as its pages arrive; the tracks are resolved once they near the front.
+        The /play reply is edited with the running count if one is given.
+        """
+        guild_id = session.guild_id
+        text_channel = None
+        try:
+            # Get reference to text channel for status updates
+            if session.text_channel_id:
+                text_channel = client.get_channel(session.text_channel_id)
             
-            # Track the task in a class attribute if not already there
-            if not hasattr(self, 'background_tasks'):
-                self.background_tasks = {}
+            added_count = 0
+            completed = True
+            batch = []
             
-            # Store the task for this guild
-            self.background_tasks[guild_id] = asyncio.current_task()
+            async def flush():
+                # Appending a page at a time keeps queue rebuilds rare on huge playlists
+                session.queue.extend(batch)
+                if reply is not None:
+                    reply.added += len(batch)
+                    await reply.update(force=False)
+                batch.clear()
+                # Until the first song starts, its own lookups cover the head of the queue
+                if session.current_song is not None:
+                    self.schedule_prefetch(guild_id)
             
-            # Process in batches
-            for i in range(0, len(remaining_songs), batch_size):
-                # Multiple checks to ensure we should still be processing
-                if any([
-                    # Bot disconnected or not in voice clients dict
-                    guild_id not in self.voice_clients,
-                    # Voice client exists but is not connected
-                    guild_id in self.voice_clients and not self.voice_clients[guild_id].is_connected(),
-                    # Queue for this guild has been deleted
-                    guild_id not in self.queues,
-                    # Explicit cancellation flag
-                    is_cancelled
-                ]):
+            async for name, artist, duration in remaining_songs:
+                # Stop once the session is closed or the bot lost its voice connection
+                if session.closed or not session.connected:
                     print(f"Voice client disconnected for guild {guild_id}, stopping playlist processing")
-                    if guild_id in self.background_tasks:
-                        del self.background_tasks[guild_id]
-                    return
-                    
-                # Get current batch
-                current_batch = remaining_songs[i:i+batch_size]
-                
-                # Process batch
-                batch_added = 0
-                for song in current_batch:
-                    # Double-check connection hasn't been lost during song processing
-                    if guild_id not in self.voice_clients or not self.voice_clients[guild_id].is_connected():
-                        is_cancelled = True
-                        break
-                        
-                    # Form search query - song name + artist name
-                    search_query = f"{song[0]} {song[1]['name']}"
-                    song_url, title = await self.search_youtube(search_query)
-                    
-                    if song_url:
-                        # Add to queue only if queue still exists
-                        if guild_id in self.queues:
-                            self.queues[guild_id].append(song_url)
-                            batch_added += 1
-                    
-                    # Small delay to avoid rate limiting
-                    await asyncio.sleep(0.5)
-                
-                processed_count += len(current_batch)
-                
-                # Stop if cancelled
-                if is_cancelled:
-                    print(f"Playlist processing cancelled for guild {guild_id}")
+                    completed = False
                     break
-                    
-                # Optional: Send progress update to channel every few batches
-                if text_channel and (i + batch_size) % (batch_size * 3) == 0:
-                    # Make sure the channel still exists and is accessible
-                    try:
-                        progress_percent = int((processed_count / total_remaining) * 100)
-                        await text_channel.send(f"Playlist loading progress: {progress_percent}% ({processed_count}/{total_remaining})")
-                    except Exception as channel_error:
-                        print(f"Could not send progress update: {channel_error}")
-                
-                # Wait a bit between batches to avoid overwhelming resources
-                await asyncio.sleep(2)
+                batch.append(Track.unresolved(name, artist['name'], duration, requester))
+                added_count += 1
+                if len(batch) >= 100:
+                    await flush()
+            if completed and batch:
+                await flush()
             
-            # Notify when complete (only if not cancelled and channel is available)
-            if not is_cancelled and text_channel:
+            # Notify when complete, in the /play reply if it can still be edited
+            if completed and reply is not None:
+                reply.loading = False
+                if await reply.update():
+                    return
+            if completed and text_channel and added_count:
                 try:
-                    await text_channel.send(f"✅ Finished loading all {total_remaining} remaining songs from the playlist!")
+                    await text_channel.send(f"✅ Finished loading {added_count} remaining songs from the playlist!")
                 except Exception as notification_error:
                     print(f"Could not send completion notification: {notification_error}")
-                    
-            # Clean up task reference
-            if guild_id in self.background_tasks:
-                del self.background_tasks[guild_id]
+            elif not completed:
+                print(f"Playlist processing cancelled for guild {guild_id}")
                 
+        except PlaylistIncomplete as e:
+            self.metrics.failures.inc(stage='playlist')
+            # Queue what arrived before the page that failed, then say how much is missing
+            if batch:
+                await flush()
+            message = incomplete_summary(e)
+            if reply is not None:
+                reply.loading = False
+                reply.warning = message
+                if await reply.update():
+                    return
+            if text_channel:
+                try:
+                    await text_channel.send(message)
+                except Exception as notification_error:
+                    print(f"Could not send playlist error notification: {notification_error}")
         except Exception as e:
             print(f"Error processing remaining playlist songs: {e}")
+            self.metrics.failures.inc(stage='playlist')
             # Try to notify in text channel about the error
             if text_channel:
                 try:
                     await text_channel.send("⚠️ Encountered an error while processing the full playlist. Some songs might be missing.")
                 except:
                     pass
-            
-            # Clean up task reference even on error
-            if guild_id in self.background_tasks:
-                del self.background_tasks[guild_id]
+        finally:
+            # Clean up task reference
+            if session.background_task is asyncio.current_task():
+                session.background_task = None
         
-    async def play_immediate(self, guild_id, song_url, client):
-        """Immediately play a song without interaction"""
+    def get_queue(self, guild_id):
+        """Return the GuildQueue for a guild, an empty one if it has no session"""
+        session = self.sessions.get(guild_id)
+        return session.queue if session else GuildQueue()
+
+    def skip(self, guild_id):
+        """Stop the current song so the next one starts, returns False if there is nothing to skip to"""
+        session = self.sessions.get(guild_id)
+        if not session or not session.voice_client or not session.queue:
+            return False
+
+        # Only the current song stops, the look-ahead for the next one is kept so it starts without a gap.
+        # play_next is called automatically by the 'after' callback
+        if session.state == STARTING:
+            # Nothing plays while a song starts or reconnects, it is dropped once ready instead
+            session.skip_pending = True
+        elif session.voice_client.is_playing() or session.voice_client.is_paused():
+            session.voice_client.stop()
+        elif session.state == IDLE and session.player_task is not None:
+            # The player stopped after a run of failures, have it try the next song
+            self._request_advance(session)
+        return True
+
+    def shuffle_queue(self, guild_id):
+        """Shuffle a guild's queue, returns False if it is empty"""
+        session = self.sessions.get(guild_id)
+        if not session or not session.queue:
+            return False
+        session.queue.shuffle()
+
+        # The look-ahead window now points at different songs
+        self._queue_changed(session)
+        return True
+
+    def unshuffle_queue(self, guild_id):
+        """Undo the last shuffle, returns False if there was nothing to undo"""
+        session = self.sessions.get(guild_id)
+        if not session or not session.queue or not session.queue.unshuffle():
+            return False
+        self._queue_changed(session)
+        return True
+
+    def remove_range(self, guild_id, start, stop):
+        """Remove queue positions start..stop, counted from 1 and inclusive, returns the tracks removed"""
+        session = self.sessions.get(guild_id)
+        if not session or start < 1 or stop < start:
+            return []
+        removed = session.queue.remove_range(start - 1, stop)
+        if removed:
+            self._queue_changed(session)
+        return removed
+
+    def move_track(self, guild_id, source, destination):
+        """Move the track at queue position source to destination, counted from 1, returns it or None"""
+        session = self.sessions.get(guild_id)
+        if not session or not 1 <= source <= len(session.queue) or destination < 1:
+            return None
+        track = session.queue.move(source - 1, destination - 1)
+        self._queue_changed(session)
+        return track
+
+    @staticmethod
+    def _dedupe_key(track):
+        # Spotify tracks not looked up yet can only be told apart by their search
+        if track.resolved:
+            return video_id_from_url(track.url) or track.url
+        return ('query', track.query.lower())
+
+    def dedupe_queue(self, guild_id):
+        """Drop queued repeats of the same video, keeping the first, returns the tracks removed"""
+        session = self.sessions.get(guild_id)
+        if not session:
+            return []
+        removed = session.queue.dedupe(self._dedupe_key)
+        if removed:
+            self._queue_changed(session)
+        return removed
+
+    def _queue_changed(self, session):
+        """
+        Point look-ahead work at the queue after it was edited. Work for songs still in the
+        window is kept, the pre-opened source is only closed if its song is no longer next.
+        """
+        prepared = session.prepared
+        if prepared is not None and (not session.queue or session.queue[0] is not prepared[0]):
+            session.prepared = None
+            try:
+                prepared[1].cleanup()
+            except Exception as e:
+                print(f"Error cleaning up prepared source: {e}")
+        self.schedule_prefetch(session.guild_id)
+
+    def schedule_prefetch(self, guild_id):
+        """Resolve the next few queued songs in the background while the current one plays"""
+        session = self.sessions.get(guild_id)
+        if not session or session.closed or not session.voice_client:
+            return
+
+        window = session.queue.slice(0, self.prefetch_depth)
+        tasks = session.prefetched
+
+        # Drop look-ahead work for songs that are no longer near the head of the queue
+        for track in list(tasks.keys()):
+            if track not in window:
+                tasks.pop(track).cancel()
+
+        for track in window:
+            if track not in tasks:
+                tasks[track] = asyncio.create_task(self._prefetch_song(session, track))
+
+    async def _prefetch_song(self, session, track):
+        """
+        Resolve and extract a queued song, and pre-open FFmpeg if it is up next.
+        A song found to be unplayable is taken out of the queue before it reaches the head.
+        """
         try:
-            # Get song info
-            loop = asyncio.get_event_loop()
-            data = await loop.run_in_executor(None, lambda: self.ytdl.extract_info(song_url, download=False))
-            
-            if not data or 'url' not in data:
-                print(f"No valid URL found for {song_url}")
-                return False
-                
-            # Store current song for reference
-            self.current_songs[guild_id] = song_url
-            
-            # Create audio player
-            source_url = data['url']
-            player = discord.FFmpegPCMAudio(source_url, **self.ffmpeg_options)
-            
-            # Play the song
-            self.voice_clients[guild_id].play(
-                player, 
-                after=lambda e: asyncio.run_coroutine_threadsafe(
-                    self.play_next(guild_id, client.loop, client), 
-                    client.loop
+            # Spotify tracks are only looked up on YouTube once they reach the look-ahead window
+            if not await self.resolver.resolve_track(track):
+                # Only a search that found nothing is final, errors are tried again at the head
+                if track.query and await self.cache.get_no_match(track.query):
+                    self._drop_unplayable(session, track, "no YouTube match")
+                return None
+            # A track in the audio cache plays from disk, there is nothing to extract ahead of time
+            if self.audio_cache is not None and self._audio_cache_key(track) in self.audio_cache:
+                return None
+            data = await self.extract_stream(track.url, interactive=False)
+        except (ExtractorBusy, CircuitOpen):
+            # play_next extracts it on demand if the pool is still busy or YouTube still failing by then
+            return None
+        except Unplayable:
+            self._drop_unplayable(session, track, "unavailable on YouTube")
+            return None
+        except Exception as e:
+            print(f"Prefetch failed for {track.display_title}: {e}")
+            return None
+
+        if not data or 'url' not in data:
+            return None
+
+        # Only the head of the queue gets an FFmpeg process, so at most one sits idle per guild.
+        # A broadcast listener is not opened early, it would fall behind the ring before playing.
+        queue = session.queue
+        if self.broadcasts is None and not session.closed and queue and queue[0] is track and session.prepared is None:
+            try:
+                player = self.create_source(data, session.guild_id)
+                session.prepared = (track, player)
+            except Exception as e:
+                print(f"Could not pre-open audio source for {track.url}: {e}")
+        return data
+
+    def _drop_unplayable(self, session, track, reason):
+        """Remove a song the look-ahead found cannot play, it is reported when the next song starts"""
+        session.prefetched.pop(track, None)
+        # The look-ahead only works on the head of the queue, so only that part is searched
+        if session.closed or not session.queue.discard([track], within=self.prefetch_depth):
+            return
+        print(f"Dropping {track.display_title} from the queue ahead of time: {reason}")
+        session.skipped.append((track, reason))
+        # The look-ahead window moves on to the songs behind it
+        self.schedule_prefetch(session.guild_id)
+
+    async def _take_prefetched(self, session, track):
+        """Return (data, player) prepared for track, or (None, None) if nothing was prefetched"""
+        task = session.prefetched.pop(track, None)
+        data = None
+        if task is not None and not task.done() and not track.resolved:
+            # An unresolved look-ahead may sit behind the search rate limit or an open breaker,
+            # play_next resolves the head itself as an interactive lookup instead
+            task.cancel()
+        elif task is not None:
+            try:
+                # A pending task is still further along than starting a fresh extraction.
+                # Shielded, so the player task being cancelled is told apart from the look-ahead being cancelled
+                data = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    task.cancel()
+                    raise
+                data = None
+
+        player = None
+        prepared, session.prepared = session.prepared, None
+        if prepared is not None:
+            prepared_track, prepared_player = prepared
+            if prepared_track is track and data is not None:
+                player = prepared_player
+            else:
+                prepared_player.cleanup()
+        return data, player
+
+    def _audio_cache_key(self, track):
+        """Audio cache key for a track, the stored packets depend on the volume and bitrate they were encoded with"""
+        return f"{video_id_from_url(track.url)}-v{self.volume:g}-b{self.opus_bitrate}"
+
+    def _cached_source(self, track, start_at=None):
+        """Open a track from the audio cache, or return None if it is not cached"""
+        if self.audio_cache is None or not track.resolved:
+            return None
+        player = self.audio_cache.open(self._audio_cache_key(track), start_at)
+        self.metrics.cache_requests.inc(kind='audio', result='hit' if player else 'miss')
+        return player
+
+    def _audio_recorder(self, track, player):
+        """Start recording a track into the audio cache if it is Opus and short enough to keep"""
+        if self.audio_cache is None or track is None or isinstance(player, CachedOpusSource):
+            return None
+        # PCM sources are encoded by discord.py, only Opus from FFmpeg can be stored as played
+        if not player.is_opus() or not track.duration or track.duration > MAX_CACHED_SECONDS:
+            return None
+        return self.audio_cache.recorder(self._audio_cache_key(track))
+
+    def create_source(self, data, guild_id=None, start_at=None):
+        """
+        Create the audio source for extracted stream data, optionally starting start_at seconds in.
+        In broadcast mode a track played from the start joins any broadcast of it other guilds began recently.
+        """
+        if self.broadcasts is not None and not start_at:
+            return self.broadcasts.subscribe(data.get('id') or data['url'], lambda: self._open_source(data, guild_id))
+        return self._open_source(data, guild_id, start_at)
+
+    def _open_source(self, data, guild_id=None, start_at=None):
+        """Start FFmpeg for extracted stream data according to the playback mode"""
+        passthrough = self.volume == 1.0 and data.get('acodec') == 'opus'
+        before_options = self.ffmpeg_options['before_options']
+        if start_at:
+            # Seeking on the input lets FFmpeg request the stream from that offset
+            before_options += f" -ss {start_at:.2f}"
+        if self.worker_pool is not None and guild_id is not None:
+            # Worker processes always hand back Opus, so nothing is encoded in this process
+            return self.worker_pool.create_source(
+                guild_id,
+                data['url'],
+                before_options,
+                '-vn' if passthrough else self.ffmpeg_options['options'],
+                codec='copy' if passthrough else 'libopus',
+                bitrate=self.opus_bitrate
+            )
+        if self.audio_mode == "opus":
+            if passthrough:
+                # Nothing to change, so FFmpeg only remuxes the Opus packets
+                return discord.FFmpegOpusAudio(
+                    data['url'],
+                    codec='copy',
+                    before_options=before_options,
+                    options='-vn'
                 )
+            # Volume is applied and encoded to Opus inside FFmpeg rather than in Python
+            return discord.FFmpegOpusAudio(
+                data['url'],
+                bitrate=self.opus_bitrate,
+                before_options=before_options,
+                options=self.ffmpeg_options['options']
             )
-            return True
+        return discord.FFmpegPCMAudio(data['url'], before_options=before_options, options=self.ffmpeg_options['options'])
+
+    def _start_playback(self, session, track, player, bot_loop, client, start_at=0.0, duration=None):
+        """
+        Start playing track's source in a guild, queueing play_next for when it finishes.
+        duration is the length yt-dlp extracted for the stream, a Spotify length may differ from it.
+        """
+        # Only a track played from the start can be stored whole
+        recorder = None if start_at else self._audio_recorder(track, player)
+        tracked = TrackedSource(
+            player, start_at, duration, on_stall=self.metrics.stream_stall_seconds.observe, recorder=recorder
+        )
+        session.active_source = tracked
+
+        def after(error):
+            if session.active_source is tracked:
+                session.active_source = None
+            broke_off = track is not None and (error is not None or tracked.ended_early())
+            if recorder is not None:
+                # Skipped, stopped or broken-off tracks are incomplete and not kept
+                recorder.finish(tracked.ended and not broke_off)
+            if broke_off:
+                # The stream broke off mid-song, pick it up again instead of skipping
+                coroutine = self._resume_track(session.guild_id, track, tracked.position, bot_loop, client)
+            else:
+                session.track_ended_at = time.perf_counter()
+                coroutine = self.play_next(session.guild_id, bot_loop, client)
+            asyncio.run_coroutine_threadsafe(coroutine, bot_loop)
+
+        try:
+            session.voice_client.play(tracked, after=after)
+        except Exception:
+            # The voice client never took the source, so after will not run to clean it up
+            if session.active_source is tracked:
+                session.active_source = None
+            if recorder is not None:
+                recorder.finish(False)
+            player.cleanup()
+            raise
+        session.state = PLAYING
+        if not start_at:
+            # A new track, rather than a resumed one
+            session.resume_attempts = 0
+            self.metrics.tracks_started.inc()
+            if session.track_ended_at is not None:
+                self.metrics.inter_track_gap.observe(time.perf_counter() - session.track_ended_at)
+                session.track_ended_at = None
+        self.idle.playing(session.guild_id)
+
+    @traced("resume_track", root=True)
+    async def _resume_track(self, guild_id, track, position, bot_loop, client):
+        """Re-extract a stream that ended early and carry on playing from the same position"""
+        session = self.sessions.get(guild_id)
+        if not session or session.closed or session.current_song is not track:
+            return
+
+        session.resume_attempts += 1
+        if session.resume_attempts > self.max_reconnects or not session.connected:
+            print(f"Giving up on {track.display_title} after {session.resume_attempts - 1} reconnects")
+            self.metrics.failures.inc(stage='reconnect')
+            await self.play_next(guild_id, bot_loop, client)
+            return
+
+        print(f"Stream for {track.display_title} broke off at {format_duration(position)}, reconnecting...")
+        self.metrics.stream_reconnects.inc()
+        started = time.perf_counter()
+        # Nothing plays while it reconnects, so new songs queue behind it and /skip is kept for when it is back
+        session.state = STARTING
+        data = {}
+        try:
+            player = self._cached_source(track, start_at=position)
+            if player is None:
+                # The old URL may have expired, so always fetch a fresh one
+                await self.cache.invalidate_stream(video_id_from_url(track.url))
+                data = await self.extract_stream(track.url)
+                if not data or 'url' not in data:
+                    raise ValueError("no stream URL found")
+                player = self.create_source(data, guild_id, start_at=position)
+        except Exception as e:
+            print(f"Could not reconnect {track.display_title}: {e}")
+            self.metrics.failures.inc(stage='reconnect')
+            self._resume_stopped(session)
+            await self.play_next(guild_id, bot_loop, client)
+            return
+
+        if session.closed or not session.connected or session.current_song is not track:
+            player.cleanup()
+            self._resume_stopped(session)
+            return
+        if session.skip_pending:
+            # /skip came while it reconnected, move on instead of resuming
+            player.cleanup()
+            self._resume_stopped(session)
+            await self.play_next(guild_id, bot_loop, client)
+            return
+        try:
+            self._start_playback(session, track, player, bot_loop, client, start_at=position, duration=data.get('duration'))
+        except Exception as e:
+            print(f"Could not resume {track.display_title}: {e}")
+            self.metrics.failures.inc(stage='reconnect')
+            self._resume_stopped(session)
+            await self.play_next(guild_id, bot_loop, client)
+            return
+        self.metrics.reconnect_seconds.observe(time.perf_counter() - started)
+
+    @staticmethod
+    def _resume_stopped(session):
+        """A reconnect that did not resume leaves the guild idle, so play_next can take over"""
+        session.skip_pending = False
+        if session.state == STARTING:
+            session.state = IDLE
+
+    @traced("play_immediate")
+    async def play_immediate(self, guild_id, track, client):
+        """Immediately play a Track without interaction"""
+        session = self.sessions.get(guild_id)
+        if not session or not session.voice_client:
+            return False
+        try:
+            return await self._start_requested(session, track, client) is None
+        except ExtractorBusy:
+            raise
         except Exception as e:
             print(f"Error in play_immediate: {e}")
+            self.metrics.failures.inc(stage='playback')
             return False
-        
-    async def play_song(self, interaction, song_url):
-        """Play a song in a voice channel"""
+
+    async def _start_requested(self, session, track, client):
+        """
+        Start a requested track in a guild where nothing plays, returns None once it plays or why it could not.
+        The guild is STARTING before the first await, so requests that arrive meanwhile are queued behind it.
+        """
+        session.state = STARTING
+        session.current_song = track
+        reason = "no stream found"
+        try:
+            data = {}
+            player = self._cached_source(track)
+            if player is None:
+                # Get song info
+                data = await self.extract_stream(track.url)
+
+                if not data or 'url' not in data:
+                    print(f"No valid URL found for {track.url}")
+                    return reason
+
+                # Create audio player
+                player = self.create_source(data, session.guild_id)
+
+            # A /skip while it was looked up drops it before it plays
+            if session.skip_pending or session.closed or not session.connected:
+                reason = SKIPPED if session.skip_pending else "voice disconnected"
+                player.cleanup()
+                return reason
+
+            # Play the song
+            self._start_playback(session, track, player, client.loop, client, duration=data.get('duration'))
+            reason = None
+            return None
+        finally:
+            session.skip_pending = False
+            if reason is not None and session.state == STARTING:
+                session.state = IDLE
+                session.current_song = None
+                if session.advance_waiters:
+                    session.advance.set()
+
+    def _carry_on(self, session, client):
+        """After a requested song did not start, play what other requests queued while it was tried"""
+        if session.queue and session.voice_client and not session.closed and not session.busy:
+            session.spawn(self.play_next(session.guild_id, client.loop, client))
+
+    async def play_song(self, interaction, song_url, play_next=False):
+        """Play a song in a voice channel, with play_next it goes before the rest of the queue"""
+        requested_at = time.perf_counter()
         guild_id = interaction.guild_id
-        
-        # Initialize queue if it doesn't exist
-        if guild_id not in self.queues:
-            self.queues[guild_id] = []
-        if guild_id not in self.text_channels:
-            self.text_channels[guild_id] = interaction.channel_id
+        session = self.get_session(guild_id)
+        if session.text_channel_id is None:
+            session.text_channel_id = interaction.channel_id
         
         try:
             # Get song info
-            song_url, title = await self.search_youtube(song_url)
-            if not song_url:
+            track = await self.search_youtube(song_url)
+            if not track:
                 return False, "Couldn't find that song!"
+            track.requester = interaction.user.display_name
             
             # Check if already playing
-            if guild_id in self.voice_clients and self.voice_clients[guild_id].is_playing():
+            if session.busy:
                 # Add to queue if already playing
-                self.queues[guild_id].append(song_url)
-                return True, f"Added to queue: {title}"
-            else:
-                # Play immediately and track current song
-                self.current_songs[guild_id] = song_url
-                
-                # Get song audio URL
-                loop = asyncio.get_event_loop()
-                data = await loop.run_in_executor(None, lambda: self.ytdl.extract_info(song_url, download=False))
-                
-                if not data or 'url' not in data:
-                    return False, "Error processing that song!"
-                    
-                source_url = data['url']
-                player = discord.FFmpegPCMAudio(source_url, **self.ffmpeg_options)
-                
-                # Play the song
-                self.voice_clients[guild_id].play(
-                    player, 
-                    after=lambda e: asyncio.run_coroutine_threadsafe(
-                        self.play_next(guild_id, interaction.client.loop, interaction.client), 
-                        interaction.client.loop
-                    )
-                )
-                return True, f"Playing: {title}"
+                if play_next:
+                    session.queue.insert_next(track)
+                    self._queue_changed(session)
+                    return True, f"Playing next: {track.display_title}"
+                session.queue.append(track)
+                self.schedule_prefetch(guild_id)
+                return True, f"Added to queue: {track.display_title}"
+
+            # Play immediately, the guild counts as busy until it started or failed
+            reason = await self._start_requested(session, track, interaction.client)
+            if reason is None:
+                self.metrics.time_to_first_audio.observe(time.perf_counter() - requested_at)
+                self.schedule_prefetch(guild_id)
+                return True, f"Playing: {track.display_title}"
+            self._carry_on(session, interaction.client)
+            if reason == SKIPPED:
+                return True, f"Skipped: {track.display_title}"
+            return False, "Error processing that song!"
+        except ExtractorBusy:
+            self._carry_on(session, interaction.client)
+            return False, "I'm busy loading other songs right now, please try again in a moment!"
         except Exception as e:
             print(f"Error in play function: {e}")
+            self._carry_on(session, interaction.client)
             return False, f"Error playing the song: {str(e)}"
     
+    async def play_many(self, interaction, queries):
+        """Search several songs at once and queue them in the order given, starting the first if nothing is playing"""
+        requested_at = time.perf_counter()
+        guild_id = interaction.guild_id
+        session = self.get_session(guild_id)
+        if session.text_channel_id is None:
+            session.text_channel_id = interaction.channel_id
+
+        # Searches run concurrently, bounded by the search pool
+        results = await asyncio.gather(*(self.search_youtube(query) for query in queries), return_exceptions=True)
+        tracks = []
+        missing = []
+        for query, result in zip(queries, results):
+            if isinstance(result, Track):
+                result.requester = interaction.user.display_name
+                tracks.append(result)
+            else:
+                missing.append(query)
+        if not tracks:
+            return False, "Couldn't find any of those songs!"
+
+        lines = []
+        if session.busy:
+            session.queue.extend(tracks)
+            self.schedule_prefetch(guild_id)
+        else:
+            first_track = tracks.pop(0)
+            try:
+                started = await self.play_immediate(guild_id, first_track, interaction.client)
+            except ExtractorBusy:
+                self._carry_on(session, interaction.client)
+                return False, "I'm busy loading other songs right now, please try again in a moment!"
+            # Queued once the first song is underway, so a busy extractor leaves nothing to take back out
+            session.queue.extend(tracks)
+            if started:
+                self.metrics.time_to_first_audio.observe(time.perf_counter() - requested_at)
+                self.schedule_prefetch(guild_id)
+                lines.append(f"Playing: {first_track.display_title}")
+            else:
+                # The first song failed to start, carry on with the next one
+                await self.play_next(guild_id, interaction.client.loop, interaction.client)
+                if session.current_song is not None:
+                    lines.append(f"Playing: {session.current_song.display_title}")
+                # Any number of them may have been started or skipped, only count the ones still waiting
+                queued = {id(track) for track in session.queue}
+                tracks = [track for track in tracks if id(track) in queued]
+        lines.append(f"Added {len(tracks)} songs to the queue.")
+        if missing:
+            lines.append(f"Couldn't find: {', '.join(missing)}")
+        return True, "\n".join(lines)
+
     async def play_next(self, guild_id, bot_loop, client):
-        """Play the next song in the queue"""
-        # Clear current song reference
-        if guild_id in self.current_songs:
-            del self.current_songs[guild_id]
-                
-        # Check if queue exists and has songs
-        if guild_id in self.queues and self.queues[guild_id] and guild_id in self.voice_clients:
+        """
+        Have the guild's player task move on to the next song it can play, and wait until it has.
+        A request made while it is already moving on is answered by that same transition.
+        """
+        session = self.sessions.get(guild_id)
+        if not session or session.closed:
+            return
+        if session.player_task is None or session.player_task.done():
+            session.player_task = session.spawn(self._run_player(session, client))
+        await self._request_advance(session)
+
+    def _request_advance(self, session):
+        """Wake the player task, returning a future resolved once the next song started or the queue ran out"""
+        waiter = asyncio.get_running_loop().create_future()
+        session.advance_waiters.append(waiter)
+        if session.state != STARTING:
+            session.advance.set()
+        return waiter
+
+    async def _run_player(self, session, client):
+        """
+        A guild's player task. Each time it is woken it works through the queue until a song
+        starts or the queue runs out, so a run of songs that fail is a loop rather than recursion.
+        """
+        while not session.closed:
+            await session.advance.wait()
+            session.advance.clear()
             try:
-                # Get the next song from queue
-                next_song = self.queues[guild_id].pop(0)
-                self.current_songs[guild_id] = next_song
-                    
-                # Get guild from client
-                guild = client.get_guild(guild_id)
-                if not guild:
-                    print(f"Could not find guild with ID {guild_id}")
-                    return
-                        
-                # Find a text channel to notify about the next song
-                text_channel = None
-                if guild_id in self.text_channels:
-                    channel_id = self.text_channels[guild_id]
-                    text_channel = client.get_channel(channel_id)
-                    # If channel no longer exists or bot doesn't have permissions, log it
-                    if text_channel is None or not text_channel.permissions_for(guild.me).send_messages:
-                        print(f"Cannot send to original channel {channel_id}, looking for alternative")
-                        text_channel = None
-                if text_channel == None:
-                    for channel in guild.text_channels:
-                        if channel.permissions_for(guild.me).send_messages:
-                            text_channel = channel
-                            break
-                    
-                # Get song info - Add retry mechanism
-                retry_count = 0
-                max_retries = 3
-                success = False
-                
-                while retry_count < max_retries and not success:
-                    try:
-                        loop = asyncio.get_event_loop()
-                        data = await loop.run_in_executor(None, lambda: self.ytdl.extract_info(next_song, download=False))
-                        
-                        if data and 'url' in data:
-                            success = True
-                        else:
-                            retry_count += 1
-                            print(f"Retry {retry_count} for {next_song} - no URL found")
-                            await asyncio.sleep(1)  # Short delay between retries
-                    except Exception as e:
-                        retry_count += 1
-                        print(f"Retry {retry_count} for {next_song} - error: {e}")
-                        await asyncio.sleep(1)  # Short delay between retries
-                        
-                if not success:
-                    print(f"Failed to get URL for {next_song} after {max_retries} retries")
-                    if text_channel:
-                        await text_channel.send(f"Failed to play song, skipping to next one")
-                    # Try playing the next one in queue
-                    await self.play_next(guild_id, bot_loop, client)
-                    return
-                    
-                source_url = data['url']
-                title = data.get('title', next_song)
-                    
-                # Create and play the audio source with improved error handling
-                try:
-                    player = discord.FFmpegPCMAudio(source_url, **self.ffmpeg_options)
-                    
-                    # Double check that voice client is still connected
-                    if guild_id in self.voice_clients and self.voice_clients[guild_id].is_connected():
-                        self.voice_clients[guild_id].play(
-                            player, 
-                            after=lambda e: asyncio.run_coroutine_threadsafe(
-                                self.play_next(guild_id, bot_loop, client), 
-                                bot_loop
-                            )
-                        )
-                        
-                        # Notify about the new song
-                        if text_channel:
-                            await text_channel.send(f"Now playing: {title}")
-                    else:
-                        print(f"Voice client disconnected for guild {guild_id}")
-                except Exception as e:
-                    print(f"Error playing audio: {e}")
-                    if text_channel:
-                        await text_channel.send(f"Error playing this song, skipping to next")
-                    # Try playing the next one in queue
-                    await self.play_next(guild_id, bot_loop, client)
-            
-            except Exception as e:
-                print(f"Error in play_next function: {e}")
-                # Try to get a channel to notify
-                try:
-                    guild = client.get_guild(guild_id)
-                    if guild:
-                        text_channel = None
-                        for channel in guild.text_channels:
-                            if channel.permissions_for(guild.me).send_messages:
-                                text_channel = channel
-                                break
-                        
-                        if text_channel:
-                            await text_channel.send(f"Failed to play next song: {str(e)}")
-                except Exception as inner_e:
-                    print(f"Error notifying about failure: {inner_e}")
-    async def check_empty_voice_channels(self, client):
+                await self._advance(session, client)
+            finally:
+                waiters, session.advance_waiters = session.advance_waiters, []
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+
+    def _notify_channel(self, session, guild, client):
+        """The text channel for "Now playing" messages, or another one the bot can write to"""
+        if session.text_channel_id:
+            channel_id = session.text_channel_id
+            text_channel = client.get_channel(channel_id)
+            # If channel no longer exists or bot doesn't have permissions, log it
+            if text_channel is not None and text_channel.permissions_for(guild.me).send_messages:
+                return text_channel
+            print(f"Cannot send to original channel {channel_id}, looking for alternative")
+        for channel in guild.text_channels:
+            if channel.permissions_for(guild.me).send_messages:
+                return channel
+        return None
+
+    # Each track change is its own trace rather than part of whatever started playback
+    @traced("play_next", root=True)
+    async def _advance(self, session, client):
         """
-        Check if the bot is alone in any voice channels and disconnect if so.
-        This should be called periodically.
+        Start the next song in the queue that can be played. Songs that fail are skipped and
+        reported in one message along with the song that does start. After max_failures_in_a_row
+        failures the rest of the queue is left for /skip, in case YouTube itself is failing.
         """
-        # Create a list of guild IDs to avoid modifying dictionary during iteration
-        guild_ids = list(self.voice_clients.keys())
+        guild_id = session.guild_id
+        session.state = STARTING
+        session.current_song = None
+        guild = client.get_guild(guild_id)
+        if not guild:
+            print(f"Could not find guild with ID {guild_id}")
+            session.state = IDLE
+            return
+        text_channel = self._notify_channel(session, guild, client)
+
+        started = None
+        failures = 0
+        try:
+            while session.queue and session.voice_client and failures < self.max_failures_in_a_row:
+                next_song = session.queue.popleft()
+                session.current_song = next_song
+                reason = await self._start_track(session, next_song, client)
+                session.skip_pending = False
+                if reason is None:
+                    started = next_song
+                    break
+                session.current_song = None
+                if session.closed or not session.connected:
+                    print(f"Voice client disconnected for guild {guild_id}")
+                    break
+                if reason == SKIPPED:
+                    continue
+                print(f"Skipping {next_song.display_title}: {reason}")
+                session.skipped.append((next_song, reason))
+                failures += 1
+        except Exception as e:
+            print(f"Error in play_next function: {e}")
+            self.metrics.failures.inc(stage='playback')
+        finally:
+            if started is None and session.state == STARTING:
+                session.state = IDLE
+
+        if session.closed:
+            return
+        lines = []
+        if session.skipped:
+            lines.append(skip_summary(session.skipped))
+            session.skipped = []
+        if started is not None:
+            lines.append(f"Now playing: {started.display_title}")
+        elif failures >= self.max_failures_in_a_row and session.queue:
+            lines.append(f"Stopped after {failures} songs in a row failed to play, use /skip to try the next one.")
+        if started is None and session.voice_client:
+            # Queue finished, leave if nothing else gets played for a while
+            self.idle.stopped(guild_id)
+        if lines and text_channel:
+            try:
+                await text_channel.send("\n".join(lines))
+            except Exception as e:
+                print(f"Error notifying about the next song: {e}")
+
+    async def _start_track(self, session, next_song, client):
+        """Resolve, extract and start one queued song, returns None once it plays or why it could not"""
+        guild_id = session.guild_id
+        # Use the look-ahead result if this song was prefetched
+        data, player = await self._take_prefetched(session, next_song)
         
-        for guild_id in guild_ids:
+        # A song that sat in the look-ahead window for hours has a URL that is about to expire
+        if data is not None and stream_url_ttl(data['url']) == 0:
+            if player is not None:
+                player.cleanup()
+            data = player = None
+            await self.cache.invalidate_stream(video_id_from_url(next_song.url))
+        
+        # A Spotify track that never reached the look-ahead window still needs a YouTube match
+        if not next_song.resolved and not await self.resolver.resolve_track(next_song, interactive=True):
+            self.metrics.failures.inc(stage='resolve')
+            return "no YouTube match"
+        
+        # A track played before comes straight off disk, with no extraction or FFmpeg
+        if player is None:
+            player = self._cached_source(next_song)
+            if player is not None and data is None:
+                data = {}
+        
+        # Get song info, backing off between attempts unless the video can never play
+        attempts = 0
+        max_attempts = 3
+        success = data is not None
+        reason = "no stream found"
+        
+        while attempts < max_attempts and not success:
             try:
-                # Get the voice client for this guild
-                voice_client = self.voice_clients.get(guild_id)
-                if not voice_client or not voice_client.is_connected():
-                    continue
-                
-                # Get the voice channel
-                channel = voice_client.channel
-                
-                # Count members in the voice channel (excluding bots)
-                human_members = sum(1 for member in channel.members if not member.bot)
+                data = await self.extract_stream(next_song.url)
+                success = bool(data and 'url' in data)
+                error = "no URL found"
+            except Unplayable as e:
+                print(f"{next_song.url} cannot be played: {e}")
+                reason = "unavailable on YouTube"
+                break
+            except Exception as e:
+                error = f"error: {e}"
+            attempts += 1
+            if not success and attempts < max_attempts:
+                self.metrics.retries.inc()
+                delay = backoff_delay(attempts - 1)
+                print(f"Retry {attempts} for {next_song.url} in {delay:.1f}s - {error}")
+                await asyncio.sleep(delay)
                 
-                # If no human members are in the channel, disconnect
-                if human_members == 0:
-                    print(f"No users in voice channel {channel.name} ({channel.id}), disconnecting...")
-                    
-                    # Try to send a message before disconnecting
-                    if guild_id in self.text_channels:
-                        try:
-                            text_channel = client.get_channel(self.text_channels[guild_id])
-                            if text_channel:
-                                await text_channel.send("Leaving voice channel because everyone left!")
-                        except Exception as e:
-                            print(f"Failed to send leave message: {e}")
-                    
-                    # Cancel any background playlist processing tasks
-                    if hasattr(self, 'background_tasks') and guild_id in self.background_tasks:
-                        try:
-                            task = self.background_tasks[guild_id]
-                            if not task.done() and not task.cancelled():
-                                task.cancel()
-                            print(f"Cancelled background playlist processing for guild {guild_id}")
-                        except Exception as task_error:
-                            print(f"Error cancelling background task: {task_error}")
-                    
-                    # Stop playback if playing
-                    if voice_client.is_playing():
-                        voice_client.stop()
-                    
-                    # Disconnect from voice channel
-                    await voice_client.disconnect()
-                    
-                    # Clean up resources
-                    del self.voice_clients[guild_id]
-                    
-                    # Clear the queue
-                    if guild_id in self.queues:
-                        self.queues[guild_id] = []
-                        
-                    # Clear current song reference
-                    if guild_id in self.current_songs:
-                        del self.current_songs[guild_id]
-                        
+        if not success:
+            print(f"Failed to get URL for {next_song.url} after {attempts} attempts")
+            self.metrics.failures.inc(stage='playback')
+            return reason
+            
+        # Fill in anything the search result did not know
+        next_song.title = next_song.title or data.get('title')
+        next_song.duration = next_song.duration or data.get('duration')
+            
+        # Create and play the audio source
+        try:
+            if player is None:
+                player = self.create_source(data, guild_id)
+            
+            # Double check that voice client is still connected
+            if session.closed or not session.connected:
+                player.cleanup()
+                return "voice disconnected"
+            # A /skip while it was looked up drops it before it plays
+            if session.skip_pending:
+                player.cleanup()
+                return SKIPPED
+            self._start_playback(session, next_song, player, asyncio.get_running_loop(), client, duration=data.get('duration'))
+        except Exception as e:
+            print(f"Error playing audio: {e}")
+            self.metrics.failures.inc(stage='playback')
+            return "playback error"
+        
+        # Start resolving the songs after this one
+        self.schedule_prefetch(guild_id)
+        return None
+
+    async def disconnect_guild(self, guild_id, message=None):
+        """Leave voice in a guild and release its session"""
+        self.idle.left(guild_id)
+        session = self.sessions.pop(guild_id, None)
+        if session:
+            await session.close(message)
+        if self.snapshots is not None:
+            try:
+                await self.snapshots.forget(guild_id)
             except Exception as e:
-                print(f"Error checking empty voice channel for guild {guild_id}: {e}")
\ No newline at end of file
+                print(f"Could not delete the saved session of guild {guild_id}: {e}")
+        await self.leases.release(guild_id)
+
+    async def voice_state_update(self, member, before, after):
+        """
+        Keep the idle manager's member counts current, and release the session of a guild
+        the bot was disconnected from, say kicked by a moderator.
+        """
+        self.idle.voice_state_update(member, before, after)
+        guild = member.guild
+        if member.id == guild.me.id and before.channel is not None and after.channel is None:
+            if guild.id in self.sessions:
+                print(f"Disconnected from voice in guild {guild.id}, releasing its session")
+                await self.disconnect_guild(guild.id)
+
+    async def _idle_disconnect(self, guild_id, reason):
+        """Called by the idle manager when a disconnect deadline passes"""
+        voice_client = self.get_voice_client(guild_id)
+        if not voice_client:
+            return
+        try:
+            if reason == 'alone':
+                # The counts come from events, confirm before leaving
+                if any(not member.bot for member in voice_client.channel.members):
+                    return
+                print(f"No users in voice channel {voice_client.channel.name}, disconnecting...")
+                await self.disconnect_guild(guild_id, "Everyone paitao me :(")
+            else:
+                if voice_client.is_playing():
+                    return
+                print(f"Nothing played in guild {guild_id} for {self.idle.idle_timeout:.0f}s, disconnecting...")
+                await self.disconnect_guild(guild_id, "Leaving voice channel since nothing is playing.")
+        except Exception as e:
+            print(f"Error disconnecting idle guild {guild_id}: {e}")
@@ -0,0 +1,63 @@
+import time
+
+import discord
+
+# Length of one frame handed to the voice client, in seconds
+FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+# A stream that stops more than this many seconds before the end of the track broke off
+EARLY_END_MARGIN = 5
+# A single read blocking for longer than this counts as a stall
+STALL_THRESHOLD = 0.5
+
+
+class TrackedSource(discord.AudioSource):
+    """
+    Wraps the source being played to follow the playback position and record stalls,
+    so a stream that breaks off mid-song can be resumed from where it stopped.
+    """
+
+    def __init__(self, original, start_at=0.0, duration=None, on_stall=None, recorder=None):
+        self.original = original
+        self.start_at = start_at  # Offset the stream was opened at, in seconds
+        self.duration = duration  # Length of the extracted stream, None if unknown
+        self.frames = 0
+        self.ended = False  # The stream itself ran out, rather than playback being stopped
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.on_stall = on_stall
+        self.recorder = recorder  # Receives every packet when the track is being written to the audio cache
+
+    @property
+    def position(self):
+        """Seconds into the track that have been played"""
+        return self.start_at + self.frames * FRAME_SECONDS
+
+    def ended_early(self):
+        """Whether the stream ended well before its extracted length"""
+        return self.ended and self.duration is not None and self.position < self.duration - EARLY_END_MARGIN
+
+    def read(self):
+        started = time.perf_counter()
+        data = self.original.read()
+        waited = time.perf_counter() - started
+
+        # The first read includes FFmpeg connecting, only waits after that are stalls
+        if self.frames and waited >= STALL_THRESHOLD:
+            self.stalls += 1
+            self.stall_seconds += waited
+            if self.on_stall:
+                self.on_stall(waited)
+
+        if data:
+            self.frames += 1
+            if self.recorder is not None:
+                self.recorder.write(data)
+        else:
+            self.ended = True
+        return data
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
@@ -0,0 +1,119 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+# yt-dlp errors for videos that will never play, retrying them only wastes extractions
+UNPLAYABLE_MARKERS = (
+    "video unavailable",
+    "private video",
+    "has been removed",
+    "not available in your country",
+    "not made this video available",
+    "confirm your age",
+    "members-only",
+    "copyright",
+    "account associated with this video has been terminated",
+    "unsupported url",
+)
+
+
+def is_unplayable(error):
+    """Whether an extraction error means the video itself can never be played"""
+    text = str(error).lower()
+    return any(marker in text for marker in UNPLAYABLE_MARKERS)
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Seconds to wait before retry number attempt + 1, random up to an exponentially growing bound"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Unplayable(Exception):
+    """A video known to fail, from the negative cache or a permanent extraction error"""
+
+
+class CircuitOpen(Exception):
+    """Background work was turned away because an upstream is failing"""
+
+
+class CircuitBreaker:
+    """
+    Outcomes of the calls to one upstream over a sliding window. Once enough of them fail the
+    breaker opens and background work waits, then after cooldown seconds a single probe call
+    decides whether it closes again. Interactive calls always go through and still count.
+    """
+
+    # Also the values of the rextunes_circuit_breaker_state metric
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name, window=60, min_calls=10, failure_rate=0.5, cooldown=30):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.outcomes = deque()  # (time, succeeded) within the window
+        self.failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_started = None  # When the half-open probe was let through
+        self.trips = 0
+
+    def _open(self, now):
+        if self.state != self.OPEN:
+            print(f"Circuit breaker {self.name} opened, pausing background calls for {self.cooldown:.0f}s")
+        self.state = self.OPEN
+        self.opened_at = now
+        self.probe_started = None
+        self.trips += 1
+
+    def _close(self):
+        print(f"Circuit breaker {self.name} closed, background calls resume")
+        self.state = self.CLOSED
+        self.probe_started = None
+        self.outcomes.clear()
+        self.failures = 0
+
+    def record(self, succeeded):
+        """Count the outcome of a call that reached the upstream"""
+        now = time.monotonic()
+        if self.state != self.CLOSED:
+            # While open, whatever gets through works as a probe
+            if succeeded:
+                self._close()
+            elif self.state == self.HALF_OPEN:
+                self._open(now)
+            return
+
+        self.outcomes.append((now, succeeded))
+        if not succeeded:
+            self.failures += 1
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            if not self.outcomes.popleft()[1]:
+                self.failures -= 1
+        if len(self.outcomes) >= self.min_calls and self.failures >= self.failure_rate * len(self.outcomes):
+            self._open(now)
+
+    def allow(self):
+        """Whether background work may call the upstream now"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.cooldown:
+                return False
+            self.state = self.HALF_OPEN
+        # One probe at a time, a probe that never reported back is replaced after a cooldown
+        if self.probe_started is None or now - self.probe_started >= self.cooldown:
+            self.probe_started = now
+            return True
+        return False
+
+    async def wait(self):
+        """Wait until background work may call the upstream"""
+        while not self.allow():
+            if self.state == self.OPEN:
+                await asyncio.sleep(max(0.1, self.cooldown - (time.monotonic() - self.opened_at)))
+            else:
+                await asyncio.sleep(1)
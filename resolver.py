@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Async token bucket that limits how many lookups start per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                # Sleep just long enough for the next token to drip in
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PlaylistResolver:
+    """
+    Resolve Spotify tracks to YouTube URLs just before they are needed,
+    rate limited so long playlists never flood YouTube with searches.
+    Background lookups also pause while the search circuit breaker is open.
+    """
+
+    def __init__(self, search, rate=5.0, burst=10, breaker=None):
+        self.search = search
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker
+        self.in_flight = 0  # Lookups waiting on a search
+        self.matched = 0
+        self.unmatched = 0  # Lookups that found nothing or failed
+
+    async def _search(self, query, interactive):
+        # Someone is waiting on interactive lookups, only background look-ahead is rate limited
+        if not interactive:
+            if self.breaker is not None:
+                await self.breaker.wait()
+            await self.bucket.acquire()
+
+        self.in_flight += 1
+        try:
+            track = await self.search(query)
+        except Exception as e:
+            print(f"Error resolving {query}: {e}")
+            track = None
+        finally:
+            self.in_flight -= 1
+        if track is None:
+            self.unmatched += 1
+        else:
+            self.matched += 1
+        return track
+
+    async def resolve_track(self, track, interactive=False):
+        """Look up an unresolved Track on YouTube and fill in its URL, returns whether it was found"""
+        if track.resolved:
+            return True
+        found = await self._search(track.query, interactive)
+        if found is None:
+            return False
+        track.url = found.url
+        track.duration = track.duration or found.duration
+        track.query = None
+        return True
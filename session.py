@@ -0,0 +1,136 @@
+import asyncio
+
+from guild_queue import GuildQueue
+
+# States of a guild's player task, see MusicPlayer._run_player
+IDLE = 'idle'  # Nothing playing, waits for a song to be requested
+STARTING = 'starting'  # A song is being looked up and started or reconnected, new requests queue behind it
+PLAYING = 'playing'  # A song is playing or paused
+
+
+def _running_process(source):
+    """The running FFmpeg process behind an audio source, or None"""
+    process = getattr(getattr(source, 'original', source), '_process', None)
+    return process if process is not None and process.poll() is None else None
+
+
+class GuildSession:
+    """
+    Everything the player holds for one guild: its queue, voice connection, the song
+    playing, background tasks and audio sources. close() is the only teardown path.
+    """
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.queue = GuildQueue()
+        self.voice_client = None
+        self.current_song = None  # Track playing right now
+        self.text_channel_id = None  # Channel that gets "Now playing" messages
+        self.background_task = None  # Loads the rest of a playlist
+        self.prefetched = {}  # queued Track -> look-ahead resolution and extraction task
+        self.prepared = None  # (Track, pre-opened source) for the head of the queue
+        self.active_source = None  # Source the voice client is playing
+        self.track_ended_at = None  # When the last track finished, for measuring the gap to the next
+        self.resume_attempts = 0  # Reconnects made for the current track
+        self.state = IDLE
+        self.skip_pending = False  # /skip came while a song was starting, it is dropped instead of played
+        self.player_task = None  # Moves through the queue whenever a song ends or is skipped
+        self.advance = asyncio.Event()  # Set to have the player task start the next song
+        self.advance_waiters = []  # Futures resolved once it has, or the queue ran out
+        self.skipped = []  # (Track, reason) dropped since the last "Now playing", reported together
+        self.tasks = set()  # Every other task started for this guild
+        self.closed = False
+
+    @property
+    def connected(self):
+        return self.voice_client is not None and self.voice_client.is_connected()
+
+    @property
+    def busy(self):
+        """Whether a song is playing, paused or being started, so new songs should be queued"""
+        if self.state == STARTING:
+            return True
+        voice_client = self.voice_client
+        return voice_client is not None and (voice_client.is_playing() or voice_client.is_paused())
+
+    def spawn(self, coro):
+        """Start a task that is cancelled when the session closes"""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def cancel_prefetch(self):
+        """Discard look-ahead work and any pre-opened FFmpeg process"""
+        for task in self.prefetched.values():
+            task.cancel()
+        self.prefetched.clear()
+
+        prepared, self.prepared = self.prepared, None
+        if prepared is not None:
+            try:
+                prepared[1].cleanup()
+            except Exception as e:
+                print(f"Error cleaning up prepared source: {e}")
+
+    def task_count(self):
+        """Tasks still running for this guild"""
+        running = sum(1 for task in self.tasks if not task.done())
+        return running + sum(1 for task in self.prefetched.values() if not task.done())
+
+    def processes(self):
+        """FFmpeg processes this guild plays from or holds open, broadcasts share theirs with other guilds"""
+        sources = [self.active_source]
+        if self.prepared is not None:
+            sources.append(self.prepared[1])
+        processes = (_running_process(source) for source in sources if source is not None)
+        return {process for process in processes if process is not None}
+
+    async def close(self, message=None, disconnect=True):
+        """
+        Leave voice and release everything; safe to call more than once.
+        With disconnect=False playback stops but the voice connection is only dropped locally,
+        for guilds another instance has taken over and is already connected in.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        voice_client = self.voice_client
+
+        # Try to send a message before disconnecting
+        if message and voice_client and self.text_channel_id:
+            try:
+                text_channel = voice_client.guild.get_channel(self.text_channel_id)
+                if text_channel:
+                    await text_channel.send(message)
+            except Exception as e:
+                print(f"Failed to send leave message: {e}")
+
+        # Cancel background playlist processing and anything else still running
+        current = asyncio.current_task()
+        for task in list(self.tasks):
+            if task is not current:
+                task.cancel()
+        self.background_task = None
+        self.cancel_prefetch()
+        waiters, self.advance_waiters = self.advance_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+        # Clear the queue before stopping so play_next finds nothing to play
+        self.queue.clear()
+        self.current_song = None
+
+        if voice_client:
+            try:
+                if voice_client.is_playing() or voice_client.is_paused():
+                    voice_client.stop()
+                if disconnect:
+                    await voice_client.disconnect()
+                else:
+                    voice_client.cleanup()
+            except Exception as e:
+                print(f"Error disconnecting from guild {self.guild_id}: {e}")
+        self.voice_client = None
+        self.active_source = None
@@ -0,0 +1,66 @@
+import time
+from collections import Counter
+
+from metrics import resident_memory_bytes
+
+
+def shard_for(guild_id, shard_count):
+    """The shard Discord routes a guild's gateway events through"""
+    return (guild_id >> 22) % shard_count if shard_count else 0
+
+
+class ShardMonitor:
+    """
+    Startup time, guilds and memory for each gateway shard.
+    Shards identify one after another, so the memory the process gained between one
+    shard becoming ready and the next is counted against the shard that just connected.
+    """
+
+    def __init__(self):
+        self.launched_at = time.perf_counter()
+        self.last_memory = resident_memory_bytes()
+        self.client = None
+        self.ready_seconds = {}  # shard id -> seconds from launch until its first READY
+        self.memory_bytes = {}  # shard id -> resident memory gained while it connected
+        self.reconnects = Counter()  # shard id -> READY events after the first, i.e. new gateway sessions
+
+    def attach(self, client):
+        self.client = client
+
+    @property
+    def shard_count(self):
+        count = getattr(self.client, 'shard_count', None)
+        return count or 1
+
+    def shard_for(self, guild_id):
+        return shard_for(guild_id, self.shard_count)
+
+    def ready(self, shard_id):
+        """Record a shard finishing its READY, reports startup figures the first time"""
+        if shard_id in self.ready_seconds:
+            self.reconnects[shard_id] += 1
+            print(f"Shard {shard_id} started a new gateway session")
+            return
+        elapsed = time.perf_counter() - self.launched_at
+        memory = resident_memory_bytes()
+        gained = memory - self.last_memory if memory is not None and self.last_memory is not None else None
+        self.last_memory = memory
+        self.ready_seconds[shard_id] = elapsed
+        self.memory_bytes[shard_id] = gained
+        memory_note = f", +{gained / 1048576:.1f} MiB" if gained is not None else ""
+        print(f"Shard {shard_id} ready after {elapsed:.1f}s with {self.guild_counts().get(shard_id, 0)} guilds{memory_note}")
+
+    def guild_counts(self):
+        """Guilds per shard"""
+        if self.client is None:
+            return {}
+        return dict(Counter(guild.shard_id or 0 for guild in self.client.guilds))
+
+    def latencies(self):
+        """Gateway heartbeat latency per shard, in seconds"""
+        if self.client is None:
+            return {}
+        latencies = getattr(self.client, 'latencies', None)
+        if latencies is None:
+            return {0: self.client.latency}
+        return dict(latencies)
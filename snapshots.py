@@ -0,0 +1,233 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from track import Track
+
+# Queue entries near the head are rewritten on every snapshot even when the queue did not
+# change, since the look-ahead fills in their YouTube match in place
+HEAD_ROWS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    guild_id INTEGER PRIMARY KEY,
+    voice_channel_id INTEGER NOT NULL,
+    text_channel_id INTEGER,
+    position REAL NOT NULL DEFAULT 0,
+    paused INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    guild_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,  -- -1 is the song playing, the queue follows in ascending order
+    url TEXT,
+    title TEXT,
+    duration INTEGER,
+    requester TEXT,
+    source TEXT,
+    query TEXT,
+    PRIMARY KEY (guild_id, position)
+) WITHOUT ROWID;
+"""
+
+
+def _track_row(guild_id, position, track):
+    return (guild_id, position, track.url, track.title, track.duration, track.requester, track.source, track.query)
+
+
+class SavedSession:
+    """A guild session as stored by the last snapshot"""
+
+    def __init__(self, guild_id, voice_channel_id, text_channel_id, position, paused):
+        self.guild_id = guild_id
+        self.voice_channel_id = voice_channel_id
+        self.text_channel_id = text_channel_id
+        self.position = position  # Seconds into current_song
+        self.paused = paused
+        self.current_song = None
+        self.queue = []
+
+
+class SqliteStore:
+    """
+    Saved sessions in a local SQLite file, written on a dedicated thread.
+    Only this process reads it back, so it survives restarts but not a move to another node.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshots")
+        self.connection = None  # Only used on the executor thread
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def _write(self, session_rows, rewrites, head_rows, dequeued, removed):
+        connection = self._connect()
+        with connection:
+            for guild_id in removed:
+                connection.execute("DELETE FROM sessions WHERE guild_id = ?", (guild_id,))
+                connection.execute("DELETE FROM tracks WHERE guild_id = ?", (guild_id,))
+            connection.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)", session_rows)
+            for guild_id, rows in rewrites.items():
+                connection.execute("DELETE FROM tracks WHERE guild_id = ?", (guild_id,))
+                connection.executemany("INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            for guild_id, (count, head) in dequeued.items():
+                if count:
+                    connection.execute(
+                        "DELETE FROM tracks WHERE guild_id = ? AND position >= ? AND position < ?",
+                        (guild_id, head - count, head)
+                    )
+            connection.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", head_rows)
+
+    def _load(self, guild_ids):
+        connection = self._connect()
+        saved = {}
+        for guild_id, voice_channel_id, text_channel_id, position, paused, _ in connection.execute(
+            "SELECT * FROM sessions"
+        ):
+            if guild_ids is None or guild_id in guild_ids:
+                saved[guild_id] = SavedSession(guild_id, voice_channel_id, text_channel_id, position, bool(paused))
+        for guild_id, position, url, title, duration, requester, source, query in connection.execute(
+            "SELECT * FROM tracks ORDER BY guild_id, position"
+        ):
+            session = saved.get(guild_id)
+            if session is None:
+                continue
+            track = Track(url, title, duration, requester, source, query)
+            if position < 0:
+                session.current_song = track
+            else:
+                session.queue.append(track)
+        return list(saved.values())
+
+    def _guilds(self):
+        return [guild_id for (guild_id,) in self._connect().execute("SELECT guild_id FROM sessions")]
+
+    async def write(self, session_rows, rewrites, head_rows, dequeued, removed):
+        """Apply the rows captured by SessionSnapshots"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._write, session_rows, rewrites, head_rows, dequeued, removed)
+
+    async def load(self, guild_ids=None):
+        """Return the SavedSessions of guild_ids, or of every guild"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._load, guild_ids)
+
+    async def guilds(self):
+        """Guild IDs with a saved session"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._guilds)
+
+
+class SessionSnapshots:
+    """
+    Periodic snapshots of every guild's queue, song and position, so a restart or another
+    instance can pick up where playback stopped without searching anything again. Rows are
+    gathered on the event loop and handed to a store, SQLite or the shared state backend.
+    A queue is only rewritten when it changed other than by songs being dequeued, otherwise
+    just the session row and the head are updated and the dequeued rows deleted. Queue rows keep
+    the position they were written at, so the queue then starts at a head offset above 0.
+    """
+
+    def __init__(self, store, interval=15):
+        self.store = store
+        self.interval = interval
+        # guild_id -> (GuildQueue, version, popped, head offset, whether a current song was written)
+        self.written = {}
+        self.snapshots = 0
+        self.last_seconds = 0.0
+
+    def capture(self, sessions):
+        """Collect the rows that changed since the last snapshot, runs on the event loop"""
+        now = time.time()
+        session_rows = []
+        rewrites = {}  # guild_id -> every track row, for queues that changed
+        head_rows = []
+        dequeued = {}  # guild_id -> (songs dequeued since the last snapshot, head offset) for queues that did not
+        for guild_id, session in sessions.items():
+            voice_client = session.voice_client
+            if session.closed or voice_client is None or not voice_client.is_connected():
+                continue
+            source = session.active_source
+            position = getattr(source, 'position', 0.0) if source is not None else 0.0
+            session_rows.append((
+                guild_id, voice_client.channel.id, session.text_channel_id,
+                position, int(voice_client.is_paused()), now
+            ))
+
+            queue = session.queue
+            current = session.current_song
+            written = self.written.get(guild_id)
+            if (
+                written is None or written[0] is not queue
+                # Anything but popleft moved songs around
+                or queue.version - written[1] != queue.popped - written[2]
+                # A current song row that is no longer wanted is only dropped by a rewrite
+                or (current is None and written[4])
+            ):
+                rows = [_track_row(guild_id, -1, current)] if current is not None else []
+                rows.extend(_track_row(guild_id, index, track) for index, track in enumerate(queue))
+                rewrites[guild_id] = rows
+                self.written[guild_id] = (queue, queue.version, queue.popped, 0, current is not None)
+            else:
+                # Dequeued rows go, the rest keep their positions and only the matches
+                # the look-ahead found near the head are new
+                count = queue.popped - written[2]
+                head = written[3] + count
+                dequeued[guild_id] = (count, head)
+                self.written[guild_id] = (queue, queue.version, queue.popped, head, written[4] or current is not None)
+                if current is not None:
+                    head_rows.append(_track_row(guild_id, -1, current))
+                head_rows.extend(
+                    _track_row(guild_id, head + index, track) for index, track in enumerate(queue.slice(0, HEAD_ROWS))
+                )
+
+        live = {row[0] for row in session_rows}
+        removed = [guild_id for guild_id in self.written if guild_id not in live]
+        for guild_id in removed:
+            del self.written[guild_id]
+        return session_rows, rewrites, head_rows, dequeued, removed
+
+    async def save(self, sessions):
+        """Write a snapshot of sessions, a dict of guild_id -> GuildSession"""
+        started = time.perf_counter()
+        rows = self.capture(sessions)
+        try:
+            await self.store.write(*rows)
+        except Exception:
+            # Nothing from this snapshot is stored, so the next one rewrites every guild in full
+            self.written = dict.fromkeys(self.written)
+            raise
+        self.snapshots += 1
+        self.last_seconds = time.perf_counter() - started
+
+    async def load(self, guild_ids=None):
+        """Return the SavedSessions from the last snapshot, of guild_ids or of every guild"""
+        saved = await self.store.load(guild_ids)
+        # Guilds that are not restored get deleted by the next snapshot
+        for session in saved:
+            self.written.setdefault(session.guild_id, None)
+        return saved
+
+    async def forget(self, guild_id, stored=True):
+        """Stop snapshotting a guild, deleting its saved session unless another instance took it over"""
+        self.written.pop(guild_id, None)
+        if stored:
+            await self.store.write([], {}, [], {}, [guild_id])
+
+    async def run(self, get_sessions):
+        """Snapshot get_sessions() every interval seconds"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save(get_sessions())
+            except Exception as e:
+                print(f"Session snapshot failed: {e}")
@@ -1,66 +1,146 @@
+import asyncio
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import re
+from resilience import backoff_delay
+
+# Only request the fields we actually read from each page
+PLAYLIST_FIELDS = "items(track(name,duration_ms,artists(name))),next,total"
+# Tries per page before giving up on the rest of a playlist
+FETCH_ATTEMPTS = 4
+
+
+def _retryable(error):
+    """Rate limits, server errors and network failures are worth retrying, a missing playlist is not"""
+    status = getattr(error, 'http_status', None)
+    return status is None or status == 429 or status >= 500
+
+
+class PlaylistIncomplete(Exception):
+    """A later page of a playlist or album could not be fetched, so only part of it was yielded"""
+
+    def __init__(self, loaded, total):
+        super().__init__(f"loaded {loaded} of {total} tracks")
+        self.loaded = loaded  # Tracks yielded before the failed page
+        self.total = total  # Tracks Spotify reported, None if it did not say
+
 
 class Spotify:
-    def __init__(self, SECRET, ID):
+    def __init__(self, SECRET, ID, breaker=None):
         self.secret = SECRET
         self.id = ID
         self.client_credentials_manager = SpotifyClientCredentials(client_id=self.id, client_secret=self.secret)
         self.sp = spotipy.Spotify(client_credentials_manager=self.client_credentials_manager)
-        
-    def get_playlist_id_from_url(self, url):
-        # Extract the playlist ID from various URL formats
+        self.breaker = breaker
+
+    @staticmethod
+    def parse_url(url):
+        """Return (kind, id) for a Spotify playlist, album or track link, or (None, None)"""
+        # Extract the ID from various URL formats
         patterns = [
-            r'spotify:playlist:([a-zA-Z0-9]+)',  # Spotify URI
-            r'open.spotify.com/playlist/([a-zA-Z0-9]+)',  # Web URL
-            r'/playlist/([a-zA-Z0-9]+)'  # Partial URL
+            r'spotify:(playlist|album|track):([a-zA-Z0-9]+)',  # Spotify URI
+            r'open\.spotify\.com/(?:intl-[a-z\-]+/)?(playlist|album|track)/([a-zA-Z0-9]+)',  # Web URL
         ]
         for pattern in patterns:
             match = re.search(pattern, url)
             if match:
-                return match.group(1)
-        return None
-        
-    def get_playlist_info(self, playlist_url):
-        # Extract playlist ID from URL
-        playlist_id = self.get_playlist_id_from_url(playlist_url)
-        
-        if not playlist_id:
-            print(f"Could not extract playlist ID from URL: {playlist_url}")
-            return []
-        
+                return match.group(1), match.group(2)
+        return None, None
+
+    @staticmethod
+    def is_spotify_url(url):
+        """Check whether a /play query is a Spotify link we can load"""
+        return Spotify.parse_url(url)[0] is not None
+
+    @staticmethod
+    def _to_song(track):
+        """Convert a Spotify track object to [track_name, artist, seconds], or None if it is unusable"""
+        # Ensure track has a name and at least one artist
+        if not track or 'name' not in track or 'artists' not in track or not track['artists']:
+            return None
+
+        # Default to 'Unknown Artist' if no artist name is available
+        artist_name = {'name': 'Unknown Artist'}
+        if 'name' in track['artists'][0]:
+            artist_name = track['artists'][0]
+        duration = track.get('duration_ms')
+        return [track['name'], artist_name, duration // 1000 if duration else None]
+
+    async def _fetch(self, call, background=False):
+        """
+        Run a blocking Spotify call off the event loop, retrying failures with jittered backoff.
+        Background calls wait while the Spotify circuit breaker is open.
+        """
+        loop = asyncio.get_event_loop()
+        for attempt in range(FETCH_ATTEMPTS):
+            if background and self.breaker is not None:
+                await self.breaker.wait()
+            try:
+                result = await loop.run_in_executor(None, call)
+            except Exception as e:
+                retryable = _retryable(e)
+                if self.breaker is not None:
+                    self.breaker.record(not retryable)
+                if not retryable or attempt == FETCH_ATTEMPTS - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"Spotify request failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            if self.breaker is not None:
+                self.breaker.record(True)
+            return result
+
+    async def iter_tracks(self, url):
+        """
+        Yield [track_name, artist, seconds] for every track behind a playlist, album or track URL.
+        Pages are fetched one at a time, so callers can start on the first tracks
+        before the rest of a long playlist has been downloaded.
+        Raises PlaylistIncomplete if a page after the first fails, a failed first page yields nothing.
+        """
+        kind, item_id = self.parse_url(url)
+        if not kind:
+            print(f"Could not extract a Spotify ID from URL: {url}")
+            return
+
         try:
-            # Fetch the playlist
-            res = []
-            playlist = self.sp.playlist(playlist_id)
-            
-            # Check if tracks exist in the playlist
-            if not playlist or 'tracks' not in playlist or 'items' not in playlist['tracks']:
-                print(f"Invalid playlist structure: {playlist_url}")
-                return []
-                
-            for i, item in enumerate(playlist['tracks']['items']):
-                # Skip None tracks or items without track
-                if not item or 'track' not in item or not item['track']:
-                    continue
-                    
-                track = item['track']
-                
-                # Ensure track has a name and at least one artist
-                if 'name' not in track or 'artists' not in track or not track['artists']:
-                    continue
-                    
-                # Default to 'Unknown Artist' if no artist name is available
-                artist_name = {'name': 'Unknown Artist'}
-                if track['artists'] and 'name' in track['artists'][0]:
-                    artist_name = track['artists'][0]
-                    
-                res.append([track['name'], artist_name])
-            return res
+            if kind == 'track':
+                track = await self._fetch(lambda: self.sp.track(item_id))
+                song = self._to_song(track)
+                if song:
+                    yield song
+                return
+
+            if kind == 'playlist':
+                page = await self._fetch(lambda: self.sp.playlist_items(
+                    item_id, fields=PLAYLIST_FIELDS, additional_types=('track',)
+                ))
+            else:
+                page = await self._fetch(lambda: self.sp.album_tracks(item_id))
+
+            total = page.get('total') if page else None
+            loaded = 0
+            while page:
+                for item in page.get('items') or []:
+                    # Playlist items wrap the track, album items are the track
+                    track = item.get('track') if kind == 'playlist' and item else item
+                    song = self._to_song(track)
+                    if song:
+                        loaded += 1
+                        yield song
+
+                if not page.get('next'):
+                    break
+                current = page
+                # Later pages are loaded in the background while the first tracks play
+                try:
+                    page = await self._fetch(lambda: self.sp.next(current), background=True)
+                except Exception as e:
+                    print(f"Error loading the rest of Spotify {kind} {item_id}: {e}")
+                    raise PlaylistIncomplete(loaded, total) from e
+        except PlaylistIncomplete:
+            raise
         except spotipy.exceptions.SpotifyException as e:
-            print(f"Error accessing playlist: {e}")
-            return []
+            print(f"Error accessing Spotify {kind}: {e}")
         except Exception as e:
-            print(f"Unexpected error accessing playlist: {e}")
-            return []
\ No newline at end of file
+            print(f"Unexpected error accessing Spotify {kind}: {e}")
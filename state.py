@@ -0,0 +1,227 @@
+import asyncio
+import json
+import time
+
+from cache import RedisCache
+from snapshots import SavedSession
+from track import Track
+
+# Takes a guild if it is free or already ours, extending the lease either way
+ACQUIRE_SCRIPT = """
+local owner = redis.call('get', KEYS[1])
+if owner == false then
+    redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[2])
+    return 1
+elseif owner == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _session_records(session_rows, rewrites, head_rows):
+    """Turn the rows captured by SessionSnapshots into one record per guild plus queue changes"""
+    records = {}
+    for guild_id, voice_channel_id, text_channel_id, position, paused, updated_at in session_rows:
+        records[guild_id] = {
+            'voice_channel_id': voice_channel_id,
+            'text_channel_id': text_channel_id,
+            'position': position,
+            'paused': bool(paused),
+            'updated_at': updated_at,
+            'current': None
+        }
+    queues = {}  # guild_id -> every queued track, for queues that changed
+    heads = []  # (guild_id, position, track) for queues that did not
+    for guild_id, rows in rewrites.items():
+        queues[guild_id] = []
+        for row in rows:
+            if row[1] < 0:
+                records[guild_id]['current'] = list(row[2:])
+            else:
+                queues[guild_id].append(list(row[2:]))
+    for row in head_rows:
+        if row[1] < 0:
+            records[row[0]]['current'] = list(row[2:])
+        else:
+            heads.append((row[0], row[1], list(row[2:])))
+    return records, queues, heads
+
+
+def _saved_session(guild_id, record, queue):
+    saved = SavedSession(
+        guild_id, record['voice_channel_id'], record['text_channel_id'], record['position'], record['paused']
+    )
+    if record['current'] is not None:
+        saved.current_song = Track(*record['current'])
+    saved.queue = [Track(*fields) for fields in queue]
+    return saved
+
+
+class MemoryState:
+    """
+    Guild leases held in this process. Nothing is shared, so every guild is always ours.
+    This is the single-instance default, caches and saved sessions stay where they were.
+    """
+
+    shared = False
+    name = "memory"
+
+    def __init__(self):
+        self.leases = {}  # guild_id -> (owner, expires_at)
+
+    async def acquire(self, guild_id, owner, ttl):
+        """Take or extend the lease on a guild, False if another instance holds it"""
+        now = time.time()
+        holder, expires_at = self.leases.get(guild_id, (None, 0))
+        if holder not in (None, owner) and expires_at > now:
+            return False
+        self.leases[guild_id] = (owner, now + ttl)
+        return True
+
+    async def release(self, guild_id, owner):
+        if self.leases.get(guild_id, (None, 0))[0] == owner:
+            del self.leases[guild_id]
+
+
+class RedisState(RedisCache):
+    """
+    State shared by every instance through Redis: one warm search cache,
+    leases that split guilds between instances, and saved sessions that let another
+    instance take a guild over once its owner stops renewing the lease.
+    """
+
+    shared = True
+    name = "redis"
+
+    def __init__(self, url, prefix="rextunes:"):
+        super().__init__(url, prefix)
+        self.acquire_script = self.client.register_script(ACQUIRE_SCRIPT)
+        self.release_script = self.client.register_script(RELEASE_SCRIPT)
+
+    def _key(self, kind, guild_id):
+        return f"{self.prefix}{kind}:{guild_id}"
+
+    async def acquire(self, guild_id, owner, ttl):
+        """Take or extend the lease on a guild, False if another instance holds it"""
+        return bool(await self.acquire_script(keys=[self._key("lease", guild_id)], args=[owner, int(ttl * 1000)]))
+
+    async def release(self, guild_id, owner):
+        await self.release_script(keys=[self._key("lease", guild_id)], args=[owner])
+
+    async def write(self, session_rows, rewrites, head_rows, dequeued, removed):
+        """Apply the rows captured by SessionSnapshots in one transaction"""
+        records, queues, heads = _session_records(session_rows, rewrites, head_rows)
+        async with self.client.pipeline(transaction=True) as pipe:
+            for guild_id in removed:
+                pipe.delete(self._key("session", guild_id), self._key("queue", guild_id))
+                pipe.srem(self.prefix + "sessions", guild_id)
+            for guild_id, record in records.items():
+                pipe.set(self._key("session", guild_id), json.dumps(record))
+            if records:
+                pipe.sadd(self.prefix + "sessions", *records)
+            for guild_id, tracks in queues.items():
+                pipe.delete(self._key("queue", guild_id))
+                if tracks:
+                    pipe.rpush(self._key("queue", guild_id), *(json.dumps(track) for track in tracks))
+            for guild_id, (count, head) in dequeued.items():
+                if count:
+                    pipe.ltrim(self._key("queue", guild_id), count, -1)
+            for guild_id, position, track in heads:
+                # The list starts at the queue's head, row positions are offset by the songs dequeued before it
+                pipe.lset(self._key("queue", guild_id), position - dequeued[guild_id][1], json.dumps(track))
+            await pipe.execute()
+
+    async def load(self, guild_ids=None):
+        """Return the SavedSessions of guild_ids, or of every guild"""
+        guild_ids = list(await self.guilds() if guild_ids is None else guild_ids)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for guild_id in guild_ids:
+                pipe.get(self._key("session", guild_id))
+                pipe.lrange(self._key("queue", guild_id), 0, -1)
+            results = await pipe.execute()
+        saved = []
+        for guild_id, record, queue in zip(guild_ids, results[::2], results[1::2]):
+            if record:
+                saved.append(_saved_session(guild_id, json.loads(record), [json.loads(track) for track in queue]))
+        return saved
+
+    async def guilds(self):
+        """Guild IDs with a saved session"""
+        return [int(guild_id) for guild_id in await self.client.smembers(self.prefix + "sessions")]
+
+
+def create_state(backend, redis_url=None):
+    """Build the configured state backend, falling back to memory if Redis is unavailable"""
+    if backend == "redis":
+        try:
+            return RedisState(redis_url or "redis://localhost:6379/0")
+        except Exception as e:
+            print(f"Redis state backend disabled, keeping state in memory: {e}")
+    return MemoryState()
+
+
+class GuildLeases:
+    """
+    Leases on the guilds this instance plays in. They are renewed in the background
+    and expire lease_ttl seconds after the instance stops, freeing its guilds for others.
+    """
+
+    def __init__(self, state, owner, ttl=30):
+        self.state = state
+        self.owner = owner
+        self.ttl = ttl
+        self.held = {}  # guild_id -> when it was claimed
+        self.lost = 0
+
+    async def claim(self, guild_id):
+        """Lease a guild for this instance, False if another instance is playing there"""
+        try:
+            claimed = await self.state.acquire(guild_id, self.owner, self.ttl)
+        except Exception as e:
+            # Playing on without the lease beats refusing every command while the backend is down
+            print(f"Could not lease guild {guild_id}, playing without a lease: {e}")
+            return True
+        if claimed:
+            self.held[guild_id] = time.monotonic()
+        return claimed
+
+    async def release(self, guild_id):
+        if self.held.pop(guild_id, None) is None:
+            return
+        try:
+            await self.state.release(guild_id, self.owner)
+        except Exception as e:
+            print(f"Could not release the lease on guild {guild_id}: {e}")
+
+    async def renew(self, active):
+        """
+        Extend the leases on the guilds in active, returning the ones another instance took over.
+        Guilds claimed more than a lease ago that never became active, say because nobody was
+        in voice, are released.
+        """
+        stale_before = time.monotonic() - self.ttl
+        for guild_id, claimed_at in list(self.held.items()):
+            if guild_id not in active and claimed_at < stale_before:
+                await self.release(guild_id)
+
+        guild_ids = list(self.held)
+        results = await asyncio.gather(
+            *(self.state.acquire(guild_id, self.owner, self.ttl) for guild_id in guild_ids),
+            return_exceptions=True
+        )
+        lost = set()
+        for guild_id, result in zip(guild_ids, results):
+            if isinstance(result, Exception):
+                print(f"Could not renew the lease on guild {guild_id}: {result}")
+            elif not result and self.held.pop(guild_id, None) is not None:
+                lost.add(guild_id)
+        self.lost += len(lost)
+        return lost
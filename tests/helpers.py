@@ -0,0 +1,36 @@
+"""Fakes shared by the tests"""
+import os
+import sys
+
+# The bot modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session import GuildSession
+from track import Track
+
+
+class FakeVoiceClient:
+    def __init__(self, channel_id, paused=False):
+        self.channel = type("Channel", (), {"id": channel_id})()
+        self.paused = paused
+
+    def is_connected(self):
+        return True
+
+    def is_paused(self):
+        return self.paused
+
+
+class FakeSource:
+    def __init__(self, position):
+        self.position = position
+
+
+def playing_session(guild_id, titles, position=12.5):
+    session = GuildSession(guild_id)
+    session.voice_client = FakeVoiceClient(guild_id * 10)
+    session.text_channel_id = guild_id * 100
+    session.current_song = Track(f"https://www.youtube.com/watch?v={guild_id}", "Playing now", 200, "alice")
+    session.active_source = FakeSource(position)
+    session.queue.extend(Track.unresolved(title, "Artist", 180, "bob") for title in titles)
+    return session
@@ -0,0 +1,89 @@
+import unittest
+
+import helpers  # Puts the bot modules on the path
+from broadcast import BroadcastHub
+
+
+class FrameSource:
+    """Upstream source serving numbered frames, counting how many were read"""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.reads = 0
+        self.cleaned_up = False
+
+    def read(self):
+        if self.reads >= self.frames:
+            return b''
+        self.reads += 1
+        return str(self.reads).encode()
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class BroadcastTest(unittest.TestCase):
+    def setUp(self):
+        self.hub = BroadcastHub(buffer_frames=4)
+        self.opened = []
+
+    def open_source(self):
+        source = FrameSource(10)
+        self.opened.append(source)
+        return source
+
+    def test_listeners_share_the_upstream(self):
+        first = self.hub.subscribe("track", self.open_source)
+        first.read()
+        second = self.hub.subscribe("track", self.open_source)
+        self.assertEqual(len(self.opened), 1)
+
+        # The listener behind replays frames from the ring instead of reading upstream again
+        self.assertEqual(first.read(), b'2')
+        self.assertEqual(second.read(), b'1')
+        self.assertEqual(second.read(), b'2')
+        self.assertEqual(self.opened[0].reads, 2)
+
+        first.cleanup()
+        self.assertFalse(self.opened[0].cleaned_up)
+        second.cleanup()
+        self.assertTrue(self.opened[0].cleaned_up)
+        self.assertEqual(self.hub.snapshot()['broadcasts'], 0)
+
+    def test_late_guild_gets_its_own_stream(self):
+        first = self.hub.subscribe("track", self.open_source)
+        for _ in range(4):
+            first.read()
+        # The first frame has left the ring, so a new guild cannot hear the track from the start
+        self.hub.subscribe("track", self.open_source)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_slow_listener_is_overrun(self):
+        fast = self.hub.subscribe("track", self.open_source)
+        slow = self.hub.subscribe("track", self.open_source)
+        self.assertEqual(slow.read(), b'1')
+
+        for expected in range(1, 7):
+            self.assertEqual(fast.read(), str(expected).encode())
+
+        # Frame 2 was overwritten, the slow listener ends so it resumes on its own stream
+        self.assertEqual(slow.read(), b'')
+        self.assertTrue(slow.overrun)
+        self.assertEqual(slow.cursor, 1)
+        self.assertFalse(fast.overrun)
+
+    def test_end_of_track(self):
+        listener = self.hub.subscribe("track", self.open_source)
+        frames = []
+        while frame := listener.read():
+            frames.append(frame)
+        self.assertEqual(len(frames), 10)
+        self.assertFalse(listener.overrun)
+        self.assertEqual(listener.read(), b'')
+
+
+if __name__ == "__main__":
+    unittest.main()
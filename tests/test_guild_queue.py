@@ -0,0 +1,104 @@
+import random
+import unittest
+
+import helpers  # Puts the bot modules on the path
+from guild_queue import GuildQueue, HEAD_BUFFER_SIZE
+
+
+class GuildQueueTest(unittest.TestCase):
+    def assertMatches(self, queue, expected):
+        self.assertEqual(len(queue), len(expected))
+        self.assertEqual(list(queue), expected)
+
+    def test_behaves_like_a_list(self):
+        rng = random.Random(7)
+        queue = GuildQueue()
+        expected = []
+        counter = iter(range(10 ** 6))
+
+        for _ in range(3000):
+            operation = rng.choice([
+                'append', 'append', 'extend', 'appendleft', 'popleft', 'popleft', 'insert',
+                'getitem', 'slice', 'remove', 'remove_range', 'move', 'shuffle'
+            ])
+            if operation == 'append':
+                track = next(counter)
+                queue.append(track)
+                expected.append(track)
+            elif operation == 'extend':
+                tracks = [next(counter) for _ in range(rng.randrange(0, 2 * HEAD_BUFFER_SIZE))]
+                queue.extend(tracks)
+                expected.extend(tracks)
+            elif operation == 'appendleft':
+                track = next(counter)
+                queue.insert(0, track)
+                expected.insert(0, track)
+            elif operation == 'popleft':
+                if expected:
+                    self.assertEqual(queue.popleft(), expected.pop(0))
+                else:
+                    self.assertRaises(IndexError, queue.popleft)
+            elif operation == 'insert':
+                index = rng.randrange(0, len(expected) + 1)
+                track = next(counter)
+                queue.insert(index, track)
+                expected.insert(index, track)
+            elif operation == 'getitem':
+                if expected:
+                    index = rng.randrange(-len(expected), len(expected))
+                    self.assertEqual(queue[index], expected[index])
+                self.assertRaises(IndexError, lambda: queue[len(expected)])
+            elif operation == 'slice':
+                start = rng.randrange(0, len(expected) + 2)
+                stop = rng.randrange(start, len(expected) + 3)
+                self.assertEqual(queue[start:stop], expected[start:stop])
+            elif operation == 'remove':
+                if expected:
+                    index = rng.randrange(0, len(expected))
+                    self.assertEqual(queue.remove(index), expected.pop(index))
+            elif operation == 'remove_range':
+                start = rng.randrange(0, len(expected) + 1)
+                stop = rng.randrange(start, len(expected) + 2)
+                self.assertEqual(queue.remove_range(start, stop), expected[start:stop])
+                del expected[start:stop]
+            elif operation == 'move':
+                if expected:
+                    source = rng.randrange(0, len(expected))
+                    destination = rng.randrange(0, len(expected))
+                    self.assertEqual(queue.move(source, destination), expected[source])
+                    expected.insert(destination, expected.pop(source))
+            elif operation == 'shuffle':
+                queue.shuffle()
+                self.assertEqual(sorted(queue), sorted(expected))
+                expected = list(queue)
+            self.assertMatches(queue, expected)
+
+    def test_play_next_goes_before_the_rest(self):
+        queue = GuildQueue(range(HEAD_BUFFER_SIZE + 5))
+        # Fill the head buffer, so the lane is checked against all three parts
+        self.assertEqual(queue.popleft(), 0)
+        queue.insert_next('first')
+        queue.insert_next('second')
+        self.assertEqual(queue[:3], ['first', 'second', 1])
+
+        # Shuffling leaves the play-next lane alone
+        queue.shuffle()
+        self.assertEqual(queue[:2], ['first', 'second'])
+        self.assertEqual(queue.popleft(), 'first')
+        self.assertEqual(queue.popleft(), 'second')
+        self.assertEqual(sorted(queue), list(range(1, HEAD_BUFFER_SIZE + 5)))
+
+    def test_unshuffle_restores_the_order(self):
+        queue = GuildQueue(range(50))
+        queue.shuffle()
+        queue.append('added')
+        queue.remove(0)
+        self.assertTrue(queue.unshuffle())
+        restored = list(queue)
+        self.assertEqual(restored[-1], 'added')
+        self.assertEqual(restored[:-1], sorted(restored[:-1]))
+        self.assertFalse(queue.unshuffle())
+
+
+if __name__ == "__main__":
+    unittest.main()
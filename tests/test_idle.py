@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+
+import helpers  # Puts the bot modules on the path
+from idle import TimerWheel
+
+
+class TimerWheelTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fired = []
+        self.wheel = TimerWheel(self.fired.append, resolution=0.02)
+
+    async def test_deadlines_fire_in_order(self):
+        self.wheel.schedule('late', 0.3)
+        self.wheel.schedule('early', 0.05)
+        self.assertEqual(len(self.wheel), 2)
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.fired, ['early'])
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.fired, ['early', 'late'])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertIsNone(self.wheel.handle)
+
+    async def test_cancel_and_reschedule(self):
+        self.wheel.schedule('cancelled', 0.05)
+        self.wheel.schedule('moved', 0.05)
+        self.assertTrue(self.wheel.cancel('cancelled'))
+        self.assertFalse(self.wheel.cancel('cancelled'))
+        # Scheduling again replaces the earlier deadline
+        self.wheel.schedule('moved', 0.3)
+
+        await asyncio.sleep(0.12)
+        self.assertEqual(self.fired, [])
+        self.assertIn('moved', self.wheel)
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.fired, ['moved'])
+
+    async def test_one_timer_for_the_earliest_slot(self):
+        for number in range(20):
+            self.wheel.schedule(number, 0.5 + number * 0.01)
+        self.wheel.schedule('first', 0.05)
+        self.assertEqual(self.wheel.armed_slot, self.wheel.deadlines['first'])
+
+        # Emptied slots are skipped when the timer is armed again
+        self.wheel.cancel('first')
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.wheel.armed_slot, min(self.wheel.slots))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from helpers import playing_session
+from snapshots import SessionSnapshots, SqliteStore
+from track import Track
+
+
+class SqliteSnapshotTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = SqliteStore(os.path.join(directory.name, "sessions.db"))
+        self.addCleanup(self.store.executor.shutdown)
+
+    async def test_dequeues_do_not_rewrite_the_queue(self):
+        snapshots = SessionSnapshots(self.store)
+        session = playing_session(1, [f"song {number}" for number in range(100)])
+        await snapshots.save({1: session})
+
+        for _ in range(3):
+            session.current_song = session.queue.popleft()
+            _, rewrites, head_rows, dequeued, _ = snapshots.capture({1: session})
+            self.assertEqual(rewrites, {})
+            self.assertLessEqual(len(head_rows), 17)
+            await self.store.write([], rewrites, head_rows, dequeued, [])
+
+        [saved] = await SessionSnapshots(self.store).load()
+        self.assertEqual(saved.current_song.query, session.current_song.query)
+        self.assertEqual([track.query for track in saved.queue], [track.query for track in session.queue])
+
+    async def test_other_changes_rewrite_the_queue(self):
+        snapshots = SessionSnapshots(self.store)
+        session = playing_session(1, ["one", "two", "three"])
+        await snapshots.save({1: session})
+
+        session.current_song = session.queue.popleft()
+        await snapshots.save({1: session})
+        session.queue.insert(1, Track.unresolved("inserted", "Artist"))
+        _, rewrites, _, _, _ = snapshots.capture({1: session})
+        self.assertEqual(len(rewrites[1]), 4)
+        await self.store.write([], rewrites, [], {}, [])
+
+        [saved] = await self.store.load([1])
+        self.assertEqual([track.query for track in saved.queue], [track.query for track in session.queue])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Shared state backend tests against an in-process fake Redis.
+
+    pip install -r requirements-dev.txt
+    python -m unittest discover tests
+"""
+import asyncio
+import unittest
+
+from helpers import playing_session
+
+try:
+    import fakeredis
+    import redis.asyncio
+except ImportError:
+    fakeredis = None
+
+from snapshots import SessionSnapshots
+from track import Track
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisStateTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from state import RedisState
+
+        server = fakeredis.FakeServer()
+        from_url = redis.asyncio.from_url
+        redis.asyncio.from_url = lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server)
+        try:
+            # Two instances talking to the same Redis
+            self.first = RedisState("redis://fake")
+            self.second = RedisState("redis://fake")
+        finally:
+            redis.asyncio.from_url = from_url
+
+    async def test_lease_is_exclusive_until_released(self):
+        from state import GuildLeases
+
+        first = GuildLeases(self.first, "first", ttl=30)
+        second = GuildLeases(self.second, "second", ttl=30)
+        self.assertTrue(await first.claim(1))
+        self.assertTrue(await first.claim(1))
+        self.assertFalse(await second.claim(1))
+
+        await first.release(1)
+        self.assertTrue(await second.claim(1))
+        self.assertNotIn(1, first.held)
+
+    async def test_expired_lease_is_taken_over(self):
+        from state import GuildLeases
+
+        first = GuildLeases(self.first, "first", ttl=0.2)
+        second = GuildLeases(self.second, "second", ttl=0.2)
+        self.assertTrue(await first.claim(1))
+        self.assertFalse(await second.claim(1))
+
+        # The first instance stops renewing, so its lease runs out
+        await asyncio.sleep(0.3)
+        self.assertTrue(await second.claim(1))
+
+        # When it comes back, renewing tells it the guild is gone
+        self.assertEqual(await first.renew({1}), {1})
+        self.assertEqual(first.lost, 1)
+        self.assertEqual(await second.renew({1}), set())
+
+    async def test_snapshot_write_and_load(self):
+        snapshots = SessionSnapshots(self.first)
+        session = playing_session(1, ["one", "two", "three"])
+        await snapshots.save({1: session})
+
+        # Another instance reads back what the first one saved
+        [saved] = await SessionSnapshots(self.second).load()
+        self.assertEqual(saved.guild_id, 1)
+        self.assertEqual(saved.voice_channel_id, 10)
+        self.assertEqual(saved.text_channel_id, 100)
+        self.assertEqual(saved.position, 12.5)
+        self.assertFalse(saved.paused)
+        self.assertEqual(saved.current_song.url, session.current_song.url)
+        self.assertEqual([track.query for track in saved.queue], [track.query for track in session.queue])
+
+    async def test_snapshot_follows_queue_changes(self):
+        snapshots = SessionSnapshots(self.first)
+        session = playing_session(1, ["one", "two", "three", "four"])
+        await snapshots.save({1: session})
+
+        # A song ends, the look-ahead matches the next one and a song is added
+        session.current_song = session.queue.popleft()
+        session.queue[0].url = "https://www.youtube.com/watch?v=two"
+        session.queue[0].query = None
+        await snapshots.save({1: session})
+        session.queue.append(Track.unresolved("five", "Artist", 180, "bob"))
+        await snapshots.save({1: session})
+
+        [saved] = await snapshots.load([1])
+        self.assertEqual(saved.current_song.query, session.current_song.query)
+        self.assertEqual([track.url for track in saved.queue], [track.url for track in session.queue])
+        self.assertEqual([track.query for track in saved.queue], [track.query for track in session.queue])
+
+    async def test_forgotten_session_is_deleted(self):
+        snapshots = SessionSnapshots(self.first)
+        await snapshots.save({1: playing_session(1, ["one"]), 2: playing_session(2, ["two"])})
+        self.assertEqual(sorted(await self.second.guilds()), [1, 2])
+
+        await snapshots.forget(1)
+        self.assertEqual(await self.second.guilds(), [2])
+        self.assertEqual([saved.guild_id for saved in await self.second.load([1, 2])], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
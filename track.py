@@ -0,0 +1,58 @@
+class Track:
+    """
+    A queued song with the metadata needed to show and play it, filled in once at enqueue time.
+    Spotify tracks are queued unresolved, with a search query and no URL, and are only
+    looked up on YouTube once they get close to the head of the queue.
+    """
+
+    __slots__ = ('url', 'title', 'duration', 'requester', 'source', 'query')
+
+    def __init__(self, url, title=None, duration=None, requester=None, source='youtube', query=None):
+        self.url = url
+        self.title = title
+        self.duration = duration  # Seconds, None when unknown
+        self.requester = requester  # Display name of whoever queued the song
+        self.source = source  # 'youtube' or 'spotify'
+        self.query = query  # YouTube search for an unresolved track, cleared once resolved
+
+    @classmethod
+    def unresolved(cls, name, artist, duration=None, requester=None):
+        """A Spotify track that has not been looked up on YouTube yet"""
+        return cls(None, f"{name} - {artist}", duration, requester, 'spotify', f"{name} {artist}")
+
+    @property
+    def resolved(self):
+        return self.url is not None
+
+    @property
+    def display_title(self):
+        return self.title or self.url or "Unknown song"
+
+    def __repr__(self):
+        return f"Track({self.display_title!r}, {self.url!r})"
+
+
+def parse_duration(value):
+    """Convert a duration in seconds or as "H:MM:SS" text to whole seconds"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        seconds = 0
+        for part in str(value).split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def format_duration(seconds):
+    """Format seconds as M:SS or H:MM:SS"""
+    if seconds is None:
+        return "?:??"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"